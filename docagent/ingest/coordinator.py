@@ -0,0 +1,270 @@
+# coordinator.py - 单命令多进程数据并行导入协调器
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from docagent.ingest.json_stream import iter_record_chunks
+from docagent.ingest.normalize import normalize_chunk
+from docagent.retrieval.retriever.simple_retriever import SimpleRetriever
+
+
+def shard_files(file_paths, num_shards):
+    """按文件大小贪心分配，使各分片的数据量尽量均衡"""
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    for file_path in sorted(file_paths, key=os.path.getsize, reverse=True):
+        i = loads.index(min(loads))
+        shards[i].append(file_path)
+        loads[i] += os.path.getsize(file_path)
+    return [sorted(shard) for shard in shards]
+
+
+class VLLMEmbedderFactory:
+    """在工作进程内创建 vLLM 嵌入模型（对象本身可被 pickle，模型在子进程中加载）"""
+
+    def __init__(self, tensor_parallel_size=1, embedding_cache_dir=None, **kwargs):
+        self.tensor_parallel_size = tensor_parallel_size
+        self.embedding_cache_dir = embedding_cache_dir
+        self.kwargs = kwargs
+
+    def __call__(self):
+        from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
+        embedder = VLLMQwenEmbedding(tensor_parallel_size=self.tensor_parallel_size, **self.kwargs)
+        if self.embedding_cache_dir:
+            # 各工作进程共用同一缓存目录，EmbeddingCache 写入时持有文件锁并按文件大小分配行号
+            from docagent.retrieval.embedding.cache import EmbeddingCache, CachedEmbedding
+            embedder = CachedEmbedding(embedder, EmbeddingCache(self.embedding_cache_dir, embedder.model_name, embedder.embedding_dim,
+                                                                max_tokens=getattr(embedder, "max_tokens", None)))
+        return embedder
+
+
+def run_embedding_worker(shard_id, tasks, embedder_factory, out_queue, chunk_size=1000, batch_size=512, batch_retry=None):
+    """
+    默认的工作进程逻辑：读取分片内的文件，规范化并生成嵌入，把结果发送给协调器写入数据库。
+
+    Args:
+        shard_id (int): 分片编号。
+        tasks (list): (文件路径, 起始记录数) 列表。
+        embedder_factory (callable): 在子进程内创建嵌入模型的函数。
+        out_queue: 发送结果的进程队列。
+        chunk_size (int): 每块读取的记录数，也是进度记录的粒度。
+        batch_size (int): 每次送入嵌入模型的论文数。
+        batch_retry (BatchRetry): 嵌入失败时的重试与隔离策略。
+
+    处理某个文件出错时（包括 BatchRetry 判定为服务故障而抛出的异常）发送 file_failed 消息，
+    协调器不再记录该文件的进度并把本次运行判定为失败，然后继续处理分片中的其他文件。
+    """
+    embedder = embedder_factory()
+    retriever = SimpleRetriever(embedder, None, batch_retry=batch_retry)
+    out_queue.put(("ready", shard_id, embedder.embedding_dim))
+    for file_path, consumed in tasks:
+        try:
+            for records in iter_record_chunks(file_path, chunk_size=chunk_size, start=consumed):
+                papers = normalize_chunk(records)
+                consumed += len(records)
+                prepared = []
+                for i in range(0, len(papers), batch_size):
+                    prepared.extend(retriever.embed_documents(papers[i:i + batch_size]))
+                out_queue.put(("chunk", shard_id, prepared, file_path, consumed, False))
+            out_queue.put(("chunk", shard_id, [], file_path, consumed, True))
+        except Exception as e:
+            print(f"❌ [分片 {shard_id}] 处理文件出错: {os.path.basename(file_path)}: {str(e)}")
+            out_queue.put(("file_failed", shard_id, file_path, str(e)))
+    out_queue.put(("done", shard_id))
+
+
+def _worker_entry(worker_target, shard_id, tasks, gpu_ids, out_queue, worker_kwargs):
+    """子进程入口：先设置可见 GPU，再执行工作函数"""
+    if gpu_ids is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = ",".join(map(str, gpu_ids))
+    try:
+        worker_target(shard_id, tasks, out_queue=out_queue, **worker_kwargs)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        out_queue.put(("error", shard_id, str(e)))
+        sys.exit(1)
+
+
+class IngestCoordinator:
+    """
+    数据并行导入协调器：一条命令启动多个工作进程，各自处理一个输入分片。
+
+    工作进程只负责解析、规范化和生成嵌入，结果通过进程队列发回协调器，
+    由协调器作为唯一写入者写入最终集合并更新导入清单，因此不再需要事后合并。
+    工作进程异常退出时，协调器根据导入清单从中断的位置重启该分片。
+
+    Args:
+        database_factory (callable): 接收向量维度、返回数据库对象（提供 insert_documents）的函数。
+        embedder_factory (callable): 可 pickle 的嵌入模型工厂，在子进程内调用。
+        num_workers (int): 工作进程数。
+        manifest (IngestManifest): 导入清单，用于跳过已完成的文件和断点重启。
+        gpu_ids (list): 可用 GPU 编号，平均分配给各工作进程；为 None 时不设置 CUDA_VISIBLE_DEVICES。
+        worker_target (callable): 工作进程执行的函数，默认 run_embedding_worker。
+        max_restarts (int): 每个分片最多重启的次数。
+        chunk_size (int): 工作进程每块读取的记录数。
+        batch_size (int): 工作进程每次送入嵌入模型的论文数。
+        queue_size (int): 结果队列最多缓存的消息数（背压）。
+        report_interval (float): 输出进度的间隔秒数。
+        batch_retry (BatchRetry): 嵌入与写入失败时的重试与隔离策略（同时传给工作进程）。
+    """
+
+    def __init__(self, database_factory, embedder_factory, num_workers, manifest=None, gpu_ids=None,
+                 worker_target=run_embedding_worker, max_restarts=3, chunk_size=1000, batch_size=512,
+                 queue_size=None, report_interval=30, batch_retry=None):
+        self.database_factory = database_factory
+        self.embedder_factory = embedder_factory
+        self.num_workers = num_workers
+        self.manifest = manifest
+        self.gpu_ids = gpu_ids
+        self.worker_target = worker_target
+        self.max_restarts = max_restarts
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.queue_size = queue_size or 2 * num_workers
+        self.report_interval = report_interval
+        self.batch_retry = batch_retry
+        self.database = None
+        self._writer = None
+        self._context = multiprocessing.get_context("spawn")
+
+    def _tasks(self, files):
+        """根据导入清单计算分片中尚未完成的文件及起始位置"""
+        tasks = []
+        for file_path in files:
+            completed, consumed = self.manifest.status(file_path) if self.manifest is not None else (False, 0)
+            if not completed:
+                tasks.append((file_path, consumed))
+        return tasks
+
+    def _start(self, state):
+        tasks = self._tasks(state["files"])
+        if not tasks:
+            state["finished"] = True
+            return
+        gpu_ids = None
+        if self.gpu_ids is not None:
+            per_worker = max(1, len(self.gpu_ids) // self.num_workers)
+            gpu_ids = self.gpu_ids[state["id"] * per_worker:(state["id"] + 1) * per_worker]
+        worker_kwargs = {
+            "embedder_factory": self.embedder_factory,
+            "chunk_size": self.chunk_size,
+            "batch_size": self.batch_size,
+        }
+        if self.batch_retry is not None:
+            worker_kwargs["batch_retry"] = self.batch_retry
+        process = self._context.Process(
+            target=_worker_entry,
+            args=(self.worker_target, state["id"], tasks, gpu_ids, self._queue, worker_kwargs),
+            daemon=True,
+        )
+        process.start()
+        state["process"] = process
+        print(f"🚀 分片 {state['id']} 启动 (PID {process.pid}, GPU {gpu_ids}, 待处理 {len(tasks)} 个文件)")
+
+    def _handle(self, message, states):
+        kind, shard_id = message[0], message[1]
+        state = states[shard_id]
+        if kind == "ready":
+            if self.database is None:
+                self.database = self.database_factory(message[2])
+                self._writer = SimpleRetriever(None, self.database, batch_retry=self.batch_retry)
+        elif kind == "chunk":
+            _, _, prepared, file_path, consumed, finished = message
+            if prepared:
+                if not self._writer.insert_documents(prepared):
+                    # 写入失败的文件不再记录进度，下次运行时重新导入
+                    self._failed_files.add(file_path)
+                    state["failed_files"].add(file_path)
+                else:
+                    state["papers"] += len(prepared)
+            if self.manifest is not None and file_path not in self._failed_files:
+                self.manifest.update(file_path, consumed, completed=finished)
+            if finished:
+                state["files_done"] += 1
+        elif kind == "file_failed":
+            # 工作进程未能处理完的文件：不再记录进度，下次运行时从清单记录的位置继续
+            print(f"❌ 分片 {shard_id} 未能处理文件 {os.path.basename(message[2])}: {message[3]}")
+            self._failed_files.add(message[2])
+            state["failed_files"].add(message[2])
+        elif kind == "done":
+            state["finished"] = True
+        elif kind == "error":
+            print(f"❌ 分片 {shard_id} 出错: {message[2]}")
+
+    def _drain(self, states):
+        while True:
+            try:
+                self._handle(self._queue.get_nowait(), states)
+            except queue.Empty:
+                return
+
+    def report(self, states, elapsed):
+        total = sum(s["papers"] for s in states.values())
+        print(f"📊 已用时 {elapsed:.0f} 秒，共写入 {total} 篇论文 ({total / max(elapsed, 1e-9):.1f} 篇/秒)")
+        for state in states.values():
+            status = "完成" if state["finished"] else ("失败" if state["failed"] else "运行中")
+            if state["failed_files"]:
+                status += f" ({len(state['failed_files'])} 个文件失败)"
+            print(f"   分片 {state['id']}: {status} | 文件 {state['files_done']}/{len(state['files'])} | "
+                  f"论文 {state['papers']} | 重启 {state['restarts']} 次")
+
+    def run(self, file_paths):
+        """
+        处理给定的文件列表，返回 (写入的论文数, 失败的分片编号列表)。
+
+        重启次数用尽的分片，以及有文件未能完整处理（嵌入或写入失败）的分片都算作失败。
+        """
+        self._queue = self._context.Queue(maxsize=self.queue_size)
+        self._failed_files = set()
+        pending = [p for p in file_paths if self.manifest is None or not self.manifest.status(p)[0]]
+        shards = shard_files(pending, self.num_workers)
+        states = {
+            i: {"id": i, "files": files, "process": None, "restarts": 0, "papers": 0,
+                "files_done": 0, "finished": False, "failed": False, "failed_files": set()}
+            for i, files in enumerate(shards)
+        }
+        print(f"⏳ 协调器启动 {self.num_workers} 个工作进程，处理 {len(pending)}/{len(file_paths)} 个文件")
+
+        start_time = time.time()
+        last_report = start_time
+        for state in states.values():
+            self._start(state)
+
+        while any(not (s["finished"] or s["failed"]) for s in states.values()):
+            try:
+                self._handle(self._queue.get(timeout=1), states)
+            except queue.Empty:
+                pass
+
+            for state in states.values():
+                process = state["process"]
+                if state["finished"] or state["failed"] or process is None or process.is_alive():
+                    continue
+                # 进程已退出：先处理它留在队列中的结果，再判断是否需要重启
+                self._drain(states)
+                process.join()
+                if state["finished"]:
+                    continue
+                state["restarts"] += 1
+                if state["restarts"] > self.max_restarts:
+                    state["failed"] = True
+                    print(f"❌ 分片 {state['id']} 已重启 {self.max_restarts} 次仍失败，放弃")
+                else:
+                    print(f"⚠️ 分片 {state['id']} 异常退出 (exitcode={process.exitcode})，第 {state['restarts']} 次重启")
+                    self._start(state)
+
+            if time.time() - last_report >= self.report_interval:
+                self.report(states, time.time() - start_time)
+                last_report = time.time()
+
+        self._drain(states)
+        for state in states.values():
+            if state["process"] is not None:
+                state["process"].join()
+        self.report(states, time.time() - start_time)
+
+        failed = [s["id"] for s in states.values() if s["failed"] or s["failed_files"]]
+        return sum(s["papers"] for s in states.values()), failed
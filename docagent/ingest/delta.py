@@ -0,0 +1,136 @@
+# delta.py - 应用每日增量文件：新增/修改的论文按需计算向量，删除的论文按ID或条件删除
+import os
+import time
+
+from docagent.ingest.json_stream import iter_record_chunks
+from docagent.ingest.normalize import normalize_chunk, process_authors, process_publish_time
+from docagent.retrieval.database.slim_schema import make_doc_id
+
+
+def list_delta_files(path):
+    """增量文件路径：单个文件，或目录下全部 .json / .jsonl 文件（按文件名排序，即按日期顺序应用）"""
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith((".json", ".jsonl"))]
+    return [path]
+
+
+def delete_key(record):
+    """
+    删除记录对应的文档ID，无法确定时返回 None。
+
+    依次使用记录中的 doc_id、link，最后按规范化后的标题、作者和年份计算（与导入时生成ID的规则相同）。
+    删除记录不需要包含摘要等其他字段。
+    """
+    if record.get("doc_id") or str(record.get("link") or "").strip():
+        return make_doc_id(record)
+    if not record.get("title"):
+        return None
+    key = {"title": record["title"], "authors": process_authors(record.get("authors", ""))}
+    published = record.get("published", record.get("publish_time"))
+    if published is not None:
+        key["published"] = process_publish_time(published)
+        if key["published"] is None:
+            return None
+    return make_doc_id(key)
+
+
+def _runs(records):
+    """把记录切分为操作相同的连续片段，保证同一文件中先新增后删除（或相反）的顺序不变"""
+    run, op = [], None
+    for record in records:
+        record_op = "delete" if record.get("op") == "delete" else "upsert"
+        if run and record_op != op:
+            yield op, run
+            run = []
+        op = record_op
+        run.append(record)
+    if run:
+        yield op, run
+
+
+def apply_delta_file(file_path, retriever, normalize=normalize_chunk, manifest=None, chunk_size=1000, batch_size=64):
+    """
+    应用一个增量文件（JSON / JSON Lines）。
+
+    每条记录是一篇论文（新增或修改，字段与全量数据相同），或带 "op": "delete" 的删除记录：
+        {"op": "delete", "doc_id": "..."}                       按文档ID删除
+        {"op": "delete", "link": "..."}                         按链接删除
+        {"op": "delete", "title": ..., "authors": ..., ...}     按标题、作者和年份删除
+        {"op": "delete", "where": {"venue": "..."}}              按元数据条件删除
+    新增或修改的论文只在标题/摘要变化时重新计算向量，只有元数据变化时直接更新元数据。
+
+    Args:
+        file_path (str): 增量文件路径。
+        retriever (SimpleRetriever): 检索器（提供嵌入模型和数据库）。
+        normalize (callable): 规范化一块原始记录的函数，如 normalize_chunk 或 ChunkNormalizer。
+        manifest (IngestManifest): 记录已应用的文件及进度，为 None 时不记录。
+        chunk_size (int): 每次读取的记录数。
+        batch_size (int): 计算向量的批大小。
+
+    Returns:
+        dict: {"embedded", "metadata", "unchanged", "deleted", "success"}
+    """
+    start_time = time.time()
+    name = os.path.basename(file_path)
+    stats = {"embedded": 0, "metadata": 0, "unchanged": 0, "deleted": 0, "success": True}
+    consumed = 0
+    if manifest is not None:
+        completed, consumed = manifest.status(file_path)
+        if completed:
+            print(f"⏭️ 跳过已应用的增量文件: {name}")
+            return stats
+        if consumed:
+            print(f"⏩ {name} 从第 {consumed} 条记录继续应用")
+
+    print(f"📥 应用增量文件: {name}")
+    db = retriever.db
+    for records in iter_record_chunks(file_path, chunk_size=chunk_size, start=consumed):
+        chunk_success = True
+        for op, run in _runs(records):
+            if op == "upsert":
+                papers = normalize(run)
+                if papers:
+                    result = retriever.upsert_documents(papers, batch_size)
+                    for key in ("embedded", "metadata", "unchanged"):
+                        stats[key] += result[key]
+                    chunk_success = result["success"] and chunk_success
+                continue
+            ids = []
+            for record in run:
+                if record.get("where"):
+                    stats["deleted"] += db.delete_documents(where=record["where"])
+                    continue
+                doc_id = delete_key(record)
+                if doc_id is None:
+                    print(f"⚠️ 无法确定删除记录对应的论文，已跳过: {record}")
+                    continue
+                ids.append(doc_id)
+            if ids:
+                stats["deleted"] += db.delete_documents(ids=ids)
+        consumed += len(records)
+        if not chunk_success:
+            # 写入失败时不记录进度，下次运行从失败的分块重新应用（upsert 与删除都是幂等的）
+            stats["success"] = False
+            break
+        if manifest is not None:
+            manifest.update(file_path, consumed)
+
+    if stats["success"] and manifest is not None:
+        manifest.update(file_path, consumed, completed=True)
+    print(f"✅ {name}: 计算向量 {stats['embedded']} 篇，更新元数据 {stats['metadata']} 篇，"
+          f"未变化 {stats['unchanged']} 篇，删除 {stats['deleted']} 篇，用时 {time.time() - start_time:.2f} 秒")
+    return stats
+
+
+def apply_delta_files(path, retriever, normalize=normalize_chunk, manifest=None, chunk_size=1000, batch_size=64):
+    """按顺序应用 path（文件或目录）中的全部增量文件，遇到失败的文件时停止，返回是否全部成功"""
+    files = list_delta_files(path)
+    if not files:
+        print(f"⚠️ {path} 中没有增量文件")
+        return True
+    for file_path in files:
+        if not apply_delta_file(file_path, retriever, normalize, manifest, chunk_size, batch_size)["success"]:
+            print(f"❌ 增量文件 {os.path.basename(file_path)} 应用失败，后续文件未应用")
+            return False
+    return True
@@ -0,0 +1,162 @@
+# json_stream.py - 大文件 JSON / JSON Lines 流式读取
+import json
+import resource
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+# 单条记录允许占用的最大字符数，防止损坏文件把整个文件读进内存
+MAX_RECORD_CHARS = 64 * 1024 * 1024
+
+
+class _CharBuffer:
+    """在文件对象上维护一个滑动文本窗口，按需读取更多内容"""
+
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """丢弃已消费的部分并读取更多数据，返回是否读到新内容"""
+        if self.eof:
+            return False
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        if len(self.buf) > MAX_RECORD_CHARS:
+            raise ValueError(f"单条 JSON 记录超过 {MAX_RECORD_CHARS} 个字符，文件可能已损坏")
+        # 读取量随缓冲区增长而翻倍，避免超长记录被反复重新解析
+        chunk = self.f.read(max(self.read_size, len(self.buf)))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def peek(self):
+        """返回下一个字符，文件结束时返回空字符串"""
+        while self.pos >= len(self.buf):
+            if not self.fill():
+                return ""
+        return self.buf[self.pos]
+
+    def skip_whitespace(self):
+        while True:
+            n = len(self.buf)
+            while self.pos < n and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < n or not self.fill():
+                return
+
+    def decode(self):
+        """从当前位置解码一个完整的 JSON 值"""
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 可能只是记录被读取边界截断，读入更多内容后重试
+                if self.fill():
+                    continue
+                raise
+            # 位于缓冲区末尾的数字/字面量可能被截断，需要确认后面确实没有内容
+            if end == len(self.buf) and not isinstance(value, (dict, list, str)) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_records(file_path, read_size=1 << 20):
+    """
+    逐条读取 JSON 文件中的记录，内存占用与文件大小无关。
+
+    支持三种格式：顶层 JSON 数组、JSON Lines（每行一个对象）以及单个 JSON 对象。
+
+    Args:
+        file_path (str): JSON / JSONL 文件路径。
+        read_size (int): 每次从文件读取的字符数。
+
+    Yields:
+        dict: 文件中的每一条记录。
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = _CharBuffer(f, read_size)
+        reader.skip_whitespace()
+        first = reader.peek()
+        if not first:
+            return
+
+        if first == "[":
+            # 顶层数组：逐个解码元素，跳过分隔的逗号
+            reader.pos += 1
+            reader.skip_whitespace()
+            if reader.peek() == "]":
+                return
+            while True:
+                reader.skip_whitespace()
+                if not reader.peek():
+                    raise ValueError(f"JSON 数组未正常结束: {file_path}")
+                yield reader.decode()
+                reader.skip_whitespace()
+                ch = reader.peek()
+                if ch == ",":
+                    reader.pos += 1
+                elif ch == "]":
+                    return
+                else:
+                    raise ValueError(f"JSON 数组元素之间缺少逗号 (位置字符 {ch!r}): {file_path}")
+        else:
+            # JSON Lines 或单个对象：依次解码相邻的 JSON 值
+            while reader.peek():
+                yield reader.decode()
+                reader.skip_whitespace()
+
+
+def iter_record_chunks(file_path, chunk_size=1000, read_size=1 << 20, start=0):
+    """
+    以固定大小的分块返回文件中的记录。
+
+    Args:
+        file_path (str): JSON / JSONL 文件路径。
+        chunk_size (int): 每个分块包含的记录数。
+        read_size (int): 每次从文件读取的字符数。
+        start (int): 跳过文件开头的记录数（用于断点续传）。
+
+    Yields:
+        list: 最多 chunk_size 条记录组成的列表。
+    """
+    chunk = []
+    for index, record in enumerate(iter_json_records(file_path, read_size=read_size)):
+        if index < start:
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def reset_peak_rss():
+    """重置进程的峰值内存统计（仅 Linux 支持，其他平台静默忽略）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """返回自上次 reset_peak_rss 以来的峰值常驻内存 (MB)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # 无法读取 /proc 时退回到进程生命周期内的峰值
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
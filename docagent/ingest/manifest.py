@@ -0,0 +1,113 @@
+# manifest.py - 记录已导入文件及进度，支持断点续传
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """流式计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    导入清单：记录每个输入文件的路径、大小、修改时间、内容哈希和已导入的记录数。
+
+    文件导入完成后再次运行会直接跳过；中途中断的文件从上次记录的位置继续。
+    文件内容发生变化（哈希不同）时重新从头导入。
+
+    Args:
+        path (str): 清单 JSON 文件的保存路径。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get("files", {})
+                print(f"📒 已加载导入清单 {path}，记录 {len(self.entries)} 个文件")
+            except Exception as e:
+                print(f"⚠️ 导入清单 {path} 读取失败，将重新记录: {str(e)}")
+
+    def _match(self, key, file_path):
+        """返回与当前文件内容一致的清单条目，文件已变化时删除旧条目"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry
+        # 大小相同但修改时间变化（如被复制或 touch），通过内容哈希确认
+        if entry["size"] == stat.st_size and entry["sha256"] == file_sha256(file_path):
+            entry["mtime"] = stat.st_mtime
+            return entry
+        del self.entries[key]
+        return None
+
+    def status(self, file_path):
+        """
+        查询文件的导入状态。
+
+        Returns:
+            tuple: (是否已完成, 已导入的记录数)
+        """
+        key = os.path.abspath(file_path)
+        with self._lock:
+            entry = self._match(key, file_path)
+        if entry is None:
+            return False, 0
+        return entry["completed"], entry["records"]
+
+    def update(self, file_path, records, completed=False, expected_state=None):
+        """
+        记录文件的导入进度并立即写回磁盘。
+
+        Args:
+            expected_state (tuple, optional): 读取文件时的 (大小, 修改时间)。给出时若文件已变化
+                （如读取后又被追加），不记录进度，以免把未读到的内容一并标记为已导入。
+
+        Returns:
+            bool: 是否已记录。
+        """
+        key = os.path.abspath(file_path)
+        with self._lock:
+            if expected_state is not None:
+                stat = os.stat(file_path)
+                if (stat.st_size, stat.st_mtime) != tuple(expected_state):
+                    return False
+            entry = self._match(key, file_path)
+            if entry is None:
+                stat = os.stat(file_path)
+                entry = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "sha256": file_sha256(file_path),
+                }
+                self.entries[key] = entry
+            entry["records"] = records
+            entry["completed"] = completed
+            entry["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._save()
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.entries = {}
+            self._save()
+
+    def _save(self):
+        # 先写临时文件再替换，避免中断时留下损坏的清单
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
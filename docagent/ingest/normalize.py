@@ -0,0 +1,154 @@
+# normalize.py - 论文记录字段规范化
+import math
+import multiprocessing
+import os
+
+
+# 修改时间处理函数
+def process_publish_time(time_str):
+    """处理不同格式的发布时间"""
+    if not time_str or time_str == "Not Available":
+        return None
+    
+    try:
+        # 如果已经是整数（如已规范化的论文），直接返回
+        if isinstance(time_str, (int, float)):
+            return int(time_str)
+
+        # 处理 ISO 格式时间 (如 "2022-11-21T19:10:33.302000Z")
+        if 'T' in time_str:
+            return int(time_str.split('T')[0].split('-')[0])
+        
+        # 处理简单日期格式 (如 "2025-01-02")
+        if '-' in time_str:
+            return int(time_str.split('-')[0])
+            
+        return None
+    except Exception as e:
+        print(f"⚠️ 时间格式处理错误: {time_str}, 错误: {str(e)}")
+        return None
+
+# 修改作者处理函数
+def process_authors(authors):
+    """处理作者列表，清理格式"""
+    if not authors:
+        return ""
+    
+    if isinstance(authors, list):
+        # 处理列表中的每个作者
+        processed_authors = []
+        for author in authors:
+            if author and isinstance(author, str):
+                # 移除多余的大括号和空格
+                author = author.strip().strip('{}').strip()
+                if author:
+                    # 如果作者字符串中包含 "and"，则分割
+                    if " and " in author:
+                        and_authors = [a.strip() for a in author.split(" and ") if a.strip()]
+                        processed_authors.extend(and_authors)
+                    else:
+                        processed_authors.append(author)
+        return ", ".join(processed_authors)
+    elif isinstance(authors, str):
+        # 处理字符串形式的作者列表
+        authors = authors.strip()
+        if " and " in authors:
+            # 分割并处理 "and" 分隔的作者
+            and_authors = [a.strip() for a in authors.split(" and ") if a.strip()]
+            return ", ".join(and_authors)
+        return authors
+    return ""
+
+def process_paper(paper):
+    """处理单篇论文数据"""
+    try:
+        # 处理字段名称映射
+        if "abstract" in paper:
+            paper["summary"] = paper.pop("abstract")
+        if "journal_name" in paper:
+            paper["venue"] = paper.pop("journal_name")
+        if "publish_time" in paper:
+            paper["published"] = paper.pop("publish_time")
+        
+        # 处理作者列表
+        if "authors" in paper:
+            paper["authors"] = process_authors(paper["authors"])
+        
+        # 处理发布时间
+        if "published" in paper:
+            processed_time = process_publish_time(paper["published"])
+            if processed_time is not None:
+                paper["published"] = processed_time
+            else:
+                return None
+        
+        # 确保必要字段存在
+        if not all(key in paper for key in ["title", "authors", "summary"]):
+            return None
+        
+        # 处理期刊名称
+        if "venue" not in paper:
+            paper["venue"] = "未知"
+        elif not paper["venue"]:
+            paper["venue"] = "未知"
+        elif isinstance(paper["venue"], str):
+            paper["venue"] = paper["venue"].strip()
+            if paper["venue"] == "":
+                paper["venue"] = "未知"
+        
+        return paper
+    except Exception as e:
+        print(f"⚠️ 处理论文数据时出错: {str(e)}")
+        return None
+
+
+def normalize_chunk(records):
+    """规范化一块原始记录，返回其中有效的论文列表（供进程池以整块为单位调用）"""
+    return [p for p in map(process_paper, records) if p]
+
+
+class ChunkNormalizer:
+    """
+    使用进程池并行规范化论文记录。
+
+    process_paper 等函数是受 GIL 限制的纯 Python 字符串处理，线程池无法并行；
+    这里每个任务发送一整块记录给子进程，减少调度和序列化开销。
+
+    Args:
+        workers (int): 进程数，默认使用全部 CPU 核心；为 1 时直接在当前进程处理。
+        min_task_size (int): 单个任务的最少记录数，记录较少时不再拆分。
+    """
+
+    def __init__(self, workers=None, min_task_size=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_task_size = min_task_size
+        self.pool = None
+        if self.workers > 1:
+            # 优先使用 fork：应在加载嵌入模型（初始化 CUDA）之前创建本对象
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            self.pool = context.Pool(self.workers)
+
+    def __call__(self, records):
+        if not isinstance(records, list):
+            records = list(records)
+        if self.pool is None or len(records) < 2 * self.min_task_size:
+            return normalize_chunk(records)
+
+        task_size = max(self.min_task_size, math.ceil(len(records) / self.workers))
+        tasks = [records[i:i + task_size] for i in range(0, len(records), task_size)]
+        return [paper for part in self.pool.map(normalize_chunk, tasks) for paper in part]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,217 @@
+# pipeline.py - 解析 → 嵌入 → 入库 三阶段流水线
+import os
+import queue
+import threading
+import time
+
+from docagent.ingest.json_stream import iter_record_chunks
+
+# 阶段之间传递的结束标记
+_STOP = object()
+
+
+class StageStats:
+    """记录单个流水线阶段的工作时间与等待时间"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0      # 实际处理数据的时间
+        self.starved = 0.0   # 等待上游数据的时间
+        self.blocked = 0.0   # 下游队列已满、等待放入的时间
+        self.items = 0
+
+    def report(self, wall_time):
+        wall_time = max(wall_time, 1e-9)
+        return (f"{self.name:<6} 处理 {self.items:>9} 条 | "
+                f"工作 {self.busy / wall_time:6.1%} | "
+                f"等待上游 {self.starved / wall_time:6.1%} | "
+                f"被下游阻塞 {self.blocked / wall_time:6.1%}")
+
+
+class IngestPipeline:
+    """
+    并发执行解析、嵌入和入库的导入流水线。
+
+    三个阶段各自运行在独立线程中，通过有界队列连接：下游处理不过来时上游会被阻塞（背压），
+    从而在内存受控的前提下让嵌入模型持续满载。
+
+    Args:
+        retriever (SimpleRetriever): 提供 embed_documents 与 insert_documents 的检索器。
+        normalize (callable): 将一块原始记录转换为有效论文列表的函数。
+        chunk_size (int): 解析阶段每块读取的记录数。
+        batch_size (int): 嵌入与入库的批大小。
+        queue_size (int): 每个阶段间队列最多缓存的批次数。
+        manifest (IngestManifest): 可选的导入清单，用于跳过已完成的文件并记录进度。
+    """
+
+    def __init__(self, retriever, normalize, chunk_size=1000, batch_size=128, queue_size=4, manifest=None):
+        self.retriever = retriever
+        self.normalize = normalize
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.manifest = manifest
+        self.stats = {}
+        self._failed_files = set()
+        self._abort = threading.Event()
+        self._errors = []
+
+    def _put(self, q, item, stats):
+        """带背压的放入操作，流水线中止时放弃"""
+        start = time.perf_counter()
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.blocked += time.perf_counter() - start
+
+    def _get(self, q, stats):
+        start = time.perf_counter()
+        while not self._abort.is_set():
+            try:
+                item = q.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        else:
+            item = _STOP
+        stats.starved += time.perf_counter() - start
+        return item
+
+    def _run_stage(self, name, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            print(f"❌ 流水线阶段 {name} 出错: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            self._errors.append(e)
+            self._abort.set()
+
+    def _parse_stage(self, file_paths, out_q):
+        stats = self.stats["parse"]
+        pending = []
+        pending_files = []
+        # 进度标记 (位置, 文件, 已读取记录数, 是否读完)：pending 中前"位置"篇论文入库后该进度即生效
+        marks = []
+
+        def emit(size):
+            nonlocal pending, pending_files, marks
+            batch, pending = pending[:size], pending[size:]
+            batch_files, pending_files = set(pending_files[:size]), pending_files[size:]
+            batch_marks = [m[1:] for m in marks if m[0] <= size]
+            marks = [(m[0] - size,) + m[1:] for m in marks if m[0] > size]
+            stats.items += len(batch)
+            self._put(out_q, (batch, batch_files, batch_marks), stats)
+
+        for file_path in file_paths:
+            if self._abort.is_set():
+                break
+            start = time.perf_counter()
+            consumed = 0
+            if self.manifest is not None:
+                completed, consumed = self.manifest.status(file_path)
+                if completed:
+                    print(f"⏭️ 跳过已导入的文件: {os.path.basename(file_path)}")
+                    continue
+                if consumed:
+                    print(f"⏩ {os.path.basename(file_path)} 从第 {consumed} 条记录继续导入")
+            try:
+                for records in iter_record_chunks(file_path, chunk_size=self.chunk_size, start=consumed):
+                    papers = self.normalize(records)
+                    pending.extend(papers)
+                    pending_files.extend([file_path] * len(papers))
+                    consumed += len(records)
+                    marks.append((len(pending), file_path, consumed, False))
+                    # 按嵌入批大小切分后再送往下游，跨文件的零头会合并
+                    while len(pending) >= self.batch_size:
+                        stats.busy += time.perf_counter() - start
+                        emit(self.batch_size)
+                        start = time.perf_counter()
+                marks.append((len(pending), file_path, consumed, True))
+            except Exception as e:
+                print(f"❌ 处理文件出错: {os.path.basename(file_path)}: {str(e)}")
+            stats.busy += time.perf_counter() - start
+        if pending or marks:
+            emit(len(pending))
+        self._put(out_q, _STOP, stats)
+
+    def _embed_stage(self, in_q, out_q):
+        stats = self.stats["embed"]
+        while True:
+            item = self._get(in_q, stats)
+            if item is _STOP:
+                break
+            batch, batch_files, batch_marks = item
+            start = time.perf_counter()
+            try:
+                prepared = self.retriever.embed_documents(batch) if batch else []
+                stats.items += len(prepared)
+            except Exception as e:
+                # 嵌入失败的批次交给入库阶段按写入失败处理（不推进这些文件的进度）
+                print(f"❌ 生成嵌入失败 ({len(batch)} 篇): {str(e)}")
+                prepared = None
+            stats.busy += time.perf_counter() - start
+            self._put(out_q, (prepared, batch_files, batch_marks), stats)
+        self._put(out_q, _STOP, stats)
+
+    def _insert_stage(self, in_q):
+        stats = self.stats["insert"]
+        while True:
+            item = self._get(in_q, stats)
+            if item is _STOP:
+                break
+            batch, batch_files, batch_marks = item
+            start = time.perf_counter()
+            if batch is None:
+                self._failed_files.update(batch_files)
+            elif batch:
+                if not self.retriever.insert_documents(batch):
+                    # 写入失败的文件不再记录进度，下次运行时从上次记录的位置重新导入
+                    self._failed_files.update(batch_files)
+                else:
+                    stats.items += len(batch)
+            if self.manifest is not None:
+                for file_path, consumed, finished in batch_marks:
+                    if file_path not in self._failed_files:
+                        self.manifest.update(file_path, consumed, completed=finished)
+            stats.busy += time.perf_counter() - start
+
+    def run(self, file_paths):
+        """
+        处理给定文件列表，返回成功送入数据库的论文数。
+        """
+        self.stats = {name: StageStats(name) for name in ("parse", "embed", "insert")}
+        self._abort.clear()
+        self._errors = []
+        self._failed_files = set()
+
+        parsed_q = queue.Queue(maxsize=self.queue_size)
+        embedded_q = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._run_stage, args=("parse", self._parse_stage, file_paths, parsed_q), daemon=True),
+            threading.Thread(target=self._run_stage, args=("embed", self._embed_stage, parsed_q, embedded_q), daemon=True),
+            threading.Thread(target=self._run_stage, args=("insert", self._insert_stage, embedded_q), daemon=True),
+        ]
+
+        start_time = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall_time = time.perf_counter() - start_time
+
+        self.print_report(wall_time)
+        if self._errors:
+            raise self._errors[0]
+        return self.stats["insert"].items
+
+    def print_report(self, wall_time):
+        """输出各阶段利用率，工作占比最高的阶段即为瓶颈"""
+        print(f"📊 流水线统计 (总用时 {wall_time:.2f} 秒):")
+        for stats in self.stats.values():
+            print(f"   {stats.report(wall_time)}")
+        bottleneck = max(self.stats.values(), key=lambda s: s.busy)
+        print(f"🔍 瓶颈阶段: {bottleneck.name}")
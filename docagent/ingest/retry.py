@@ -0,0 +1,119 @@
+# retry.py - 批次失败处理：退避重试、二分定位出错记录、死信文件
+import json
+import os
+import threading
+import time
+
+# 同一进程内多个线程（如流水线的嵌入与入库阶段）共用死信文件时串行写入
+_WRITE_LOCK = threading.Lock()
+
+
+class DeadLetterFile:
+    """
+    死信文件：以 JSON Lines 追加保存无法处理的论文，便于排查后重新导入。
+
+    每行是一篇论文（不含向量），附加 _stage（embed / insert）、_error 与 _failed_at 字段。
+    修复问题后可直接用 --apply-delta 或放入数据目录重新导入，附加字段会被忽略。
+
+    Args:
+        path (str): 死信文件路径。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def write(self, records, stage, error):
+        failed_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        lines = []
+        for record in records:
+            record = {k: v for k, v in record.items() if k != "vector"}
+            record.update({"_stage": stage, "_error": error, "_failed_at": failed_at})
+            lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with _WRITE_LOCK:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+            self.count += len(records)
+
+
+class BatchRetry:
+    """
+    批次失败处理策略。
+
+    批次出错时先按指数退避整批重试（排除服务抖动、显存不足等瞬时错误）；仍失败时把批次二分，
+    两半各尝试一次，失败的一半继续二分，直到定位出无法处理的单条记录并写入死信文件，
+    其余记录照常写入。正常批次不受影响，仍以完整批大小处理。
+    整批记录全部失败时（包括只有一条记录的批次重试后仍失败）无法区分数据问题与服务故障，
+    按服务故障处理：抛出异常交给调用方按失败处理（不推进导入进度），不写入死信文件。
+
+    Args:
+        retries (int): 整批重试的次数。
+        backoff (float): 第一次重试前等待的秒数，之后每次翻倍。
+        max_backoff (float): 单次等待的最长秒数。
+        dead_letter (DeadLetterFile): 死信文件，为 None 时只输出被丢弃的记录数。
+    """
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=30.0, dead_letter=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letter = dead_letter
+
+    def _attempt(self, fn, items, retries):
+        """调用 fn(items)，返回 (结果, None) 或重试后仍失败时的 (None, 异常)"""
+        delay = self.backoff
+        for attempt in range(retries + 1):
+            try:
+                return fn(items), None
+            except Exception as e:
+                error = e
+                if attempt < retries:
+                    print(f"⚠️ {len(items)} 条记录处理失败 ({str(e)})，{delay:.1f} 秒后第 {attempt + 1} 次重试")
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_backoff)
+        return None, error
+
+    def _bisect(self, fn, items, results, rejected):
+        mid = len(items) // 2
+        for half in (items[:mid], items[mid:]):
+            if not half:
+                continue
+            output, error = self._attempt(fn, half, 0)
+            if error is None:
+                results.extend(output)
+            elif len(half) == 1:
+                rejected.append((half[0], error))
+            else:
+                self._bisect(fn, half, results, rejected)
+
+    def run(self, items, fn, stage):
+        """
+        对一批记录执行 fn。
+
+        Args:
+            items (list): 记录列表。
+            fn (callable): fn(记录列表) 返回与输入一一对应的结果列表，失败时抛出异常。
+            stage (str): 阶段名称，写入死信文件。
+
+        Returns:
+            list: 成功记录的结果（保持输入顺序），被隔离的记录不在其中。
+        """
+        results, error = self._attempt(fn, items, self.retries)
+        if error is None:
+            return results
+        if len(items) == 1:
+            raise error
+        print(f"⚠️ {stage} 批次 ({len(items)} 条) 重试 {self.retries} 次仍失败，二分定位出错的记录")
+        results, rejected = [], []
+        self._bisect(fn, items, results, rejected)
+        if len(rejected) == len(items):
+            raise error
+        for record, record_error in rejected:
+            message = f"{type(record_error).__name__}: {str(record_error)}"
+            if self.dead_letter is not None:
+                self.dead_letter.write([record], stage, message)
+            print(f"🚫 隔离 1 条无法处理的记录 ({stage}): {str(record.get('title', ''))[:60]} | {message}")
+        if self.dead_letter is not None:
+            print(f"📮 已写入死信文件 {self.dead_letter.path} (累计 {self.dead_letter.count} 条)")
+        return results
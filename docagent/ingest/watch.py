@@ -0,0 +1,203 @@
+# watch.py - 守护模式导入：持续监视数据目录，新增或变化的文件按微批次导入
+import os
+import queue
+import threading
+import time
+
+from docagent.ingest.json_stream import iter_record_chunks
+
+# 写入线程的结束标记
+_STOP = object()
+
+
+class DirectoryWatcher:
+    """
+    监视数据目录，把新增或内容变化的 JSON / JSON Lines 文件中的论文按微批次导入。
+
+    每隔 poll_interval 秒扫描一次目录，修改时间早于 settle_time 秒的文件视为已写完并开始读取。
+    读出的论文先进入待写入队列：攒满 batch_size 篇立即送去计算向量和写入；不足一批时最多等待
+    max_latency 秒（期间到达的新文件会补进同一批），之后即使不满也写入，保证论文在到达后
+    max_latency 秒左右即可被检索。写入在独立线程中进行，读取和规范化下一批时嵌入模型不会空闲。
+
+    写入使用 SimpleRetriever.upsert_documents：变化的文件被重新读取时，标题和摘要未变化的论文
+    不会重新计算向量。提供导入清单时按清单跳过已完成的文件、从上次的进度继续，写入失败的文件
+    在下一次扫描时从上次记录的进度重新导入。
+
+    Args:
+        data_dir (str): 数据目录。
+        retriever (SimpleRetriever): 检索器。
+        normalize (callable): 将一块原始记录转换为有效论文列表的函数。
+        manifest (IngestManifest): 导入清单，为 None 时只在本进程内记录已读取的文件。
+        batch_size (int): 每批写入的论文数（即送入嵌入模型的批大小）。
+        max_latency (float): 不满一批的论文最长等待时间（秒）。
+        poll_interval (float): 扫描目录的间隔（秒）。
+        settle_time (float): 文件最后一次修改后等待多久才读取（秒），避免读到正在写入的文件。
+        chunk_size (int): 每次从文件读取的记录数。
+        queue_size (int): 等待写入的批次数上限，写入跟不上时读取会被阻塞。
+    """
+
+    def __init__(self, data_dir, retriever, normalize, manifest=None, batch_size=128, max_latency=60.0,
+                 poll_interval=5.0, settle_time=2.0, chunk_size=1000, queue_size=2, extensions=(".json", ".jsonl")):
+        self.data_dir = data_dir
+        self.retriever = retriever
+        self.normalize = normalize
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.chunk_size = chunk_size
+        self.extensions = extensions
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._done = {}       # 文件 -> 读取时的 (大小, 修改时间)，状态不变时不再读取
+        self._failed = set()  # 写入失败的文件，其后续进度不再记录
+        self._pending = []
+        self._pending_files = []
+        # 进度标记 (位置, 文件, 已读取记录数, 是否读完)：待写入的前"位置"篇论文写入后该进度即生效
+        self._marks = []
+        self._pending_since = None
+        self.papers = 0
+        self.batches = 0
+        self.latencies = []
+
+    def ready_files(self):
+        """返回已写完且尚未导入（或导入后内容发生变化）的文件及其 (大小, 修改时间)"""
+        if not os.path.isdir(self.data_dir):
+            return []
+        now = time.time()
+        ready = []
+        for name in sorted(os.listdir(self.data_dir)):
+            if not name.endswith(self.extensions):
+                continue
+            path = os.path.join(self.data_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            with self._lock:
+                if self._done.get(path) == state:
+                    continue
+            if now - stat.st_mtime < self.settle_time:
+                continue
+            if self.manifest is not None and self.manifest.status(path)[0]:
+                with self._lock:
+                    self._done[path] = state
+                continue
+            ready.append((path, state))
+        return ready
+
+    def _read(self, path, state):
+        consumed = 0
+        if self.manifest is not None:
+            _, consumed = self.manifest.status(path)
+        with self._lock:
+            self._done[path] = state
+            self._failed.discard(path)
+        print(f"📄 读取新增或变化的文件: {os.path.basename(path)}" + (f"，从第 {consumed} 条记录继续" if consumed else ""))
+        try:
+            for records in iter_record_chunks(path, chunk_size=self.chunk_size, start=consumed):
+                papers = self.normalize(records)
+                if papers and self._pending_since is None:
+                    self._pending_since = time.time()
+                self._pending.extend(papers)
+                self._pending_files.extend([path] * len(papers))
+                consumed += len(records)
+                self._marks.append((len(self._pending), path, consumed, False, state))
+                while len(self._pending) >= self.batch_size:
+                    self._emit(self.batch_size)
+            self._marks.append((len(self._pending), path, consumed, True, state))
+        except Exception as e:
+            # 文件内容变化（如被重新写入）后会再次读取
+            print(f"❌ 处理文件出错: {os.path.basename(path)}: {str(e)}")
+
+    def _emit(self, size):
+        """把前 size 篇待写入的论文及对应的进度标记交给写入线程"""
+        batch, self._pending = self._pending[:size], self._pending[size:]
+        batch_files, self._pending_files = set(self._pending_files[:size]), self._pending_files[size:]
+        batch_marks = [m[1:] for m in self._marks if m[0] <= size]
+        self._marks = [(m[0] - size,) + m[1:] for m in self._marks if m[0] > size]
+        self._queue.put((batch, batch_files, batch_marks, self._pending_since))
+        self._pending_since = time.time() if self._pending else None
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, batch_files, batch_marks, since = item
+            if batch:
+                try:
+                    success = self.retriever.upsert_documents(batch, batch_size=self.batch_size)["success"]
+                except Exception as e:
+                    print(f"❌ 微批次写入失败: {str(e)}")
+                    success = False
+                if success:
+                    latency = time.time() - since
+                    self.papers += len(batch)
+                    self.batches += 1
+                    self.latencies.append(latency)
+                    print(f"⚡ 微批次写入 {len(batch)} 篇论文，从读取到可检索 {latency:.1f} 秒")
+                else:
+                    # 下一次扫描时从清单记录的进度重新读取这些文件
+                    with self._lock:
+                        self._failed.update(batch_files)
+                        for file_path in batch_files:
+                            self._done.pop(file_path, None)
+            if self.manifest is not None:
+                for file_path, consumed, finished, state in batch_marks:
+                    with self._lock:
+                        failed = file_path in self._failed
+                    if failed or not os.path.exists(file_path):
+                        continue
+                    # 读取后文件又被追加或改写时不记录进度，下一次扫描会按新内容重新读取
+                    recorded = self.manifest.update(file_path, consumed, completed=finished, expected_state=state)
+                    if not recorded and finished:
+                        print(f"⚠️ 文件 {os.path.basename(file_path)} 在导入期间发生变化，暂不记录进度")
+
+    def run_once(self):
+        """扫描一次目录并读取就绪的文件；不满一批的论文等待超过 max_latency 时写入"""
+        for path, state in self.ready_files():
+            if self._stop.is_set():
+                break
+            self._read(path, state)
+        overdue = self._pending_since is not None and time.time() - self._pending_since >= self.max_latency
+        # 没有待写入的论文时也要提交进度标记（如文件中全部是无效记录）
+        if overdue or (self._marks and not self._pending):
+            self._emit(len(self._pending))
+
+    def run(self):
+        """持续监视直到 stop() 被调用或收到 Ctrl+C，退出前写入剩余的论文"""
+        writer = threading.Thread(target=self._write_loop, name="watch-writer", daemon=True)
+        writer.start()
+        print(f"👀 开始监视 {self.data_dir} (批大小 {self.batch_size}，最长等待 {self.max_latency} 秒，"
+              f"扫描间隔 {self.poll_interval} 秒)")
+        try:
+            while not self._stop.is_set():
+                self.run_once()
+                wait = self.poll_interval
+                if self._pending_since is not None:
+                    wait = min(wait, max(0.0, self._pending_since + self.max_latency - time.time()))
+                self._stop.wait(wait)
+        except KeyboardInterrupt:
+            print("⏹️ 收到中断信号，写入剩余论文后退出")
+        finally:
+            if self._pending or self._marks:
+                self._emit(len(self._pending))
+            self._queue.put(_STOP)
+            writer.join()
+            self.report()
+
+    def stop(self):
+        self._stop.set()
+
+    def report(self):
+        if not self.latencies:
+            print("📊 监视期间没有写入新论文")
+            return
+        latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"📊 监视期间写入 {self.papers} 篇论文，{self.batches} 个批次，平均每批 {self.papers / self.batches:.0f} 篇，"
+              f"到达至可检索平均 {sum(latencies) / len(latencies):.1f} 秒，p95 {p95:.1f} 秒")
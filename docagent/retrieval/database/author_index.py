@@ -0,0 +1,104 @@
+# author_index.py - 作者倒排索引（规范化作者名 -> 文档ID），保存在集合旁的 SQLite 文件中
+import os
+import sqlite3
+import threading
+import time
+
+from docagent.retrieval.database.chroma_merge import list_ids
+from docagent.retrieval.database.slim_schema import split_authors
+
+
+def normalize_author(name):
+    """规范化作者名（忽略大小写与多余空白）"""
+    return " ".join(str(name).lower().split())
+
+
+class AuthorIndex:
+    """
+    作者倒排索引，用于按作者检索时直接得到文档ID，无需嵌入查询或 author1..author50 的 $or 过滤。
+
+    写入数据库时随文档一起更新；对已有集合可用 rebuild 从元数据重新构建。
+    meta 表中的 built 标记索引是否覆盖集合全部文档（由 rebuild 构建，或从空集合开始随写入维护），
+    未完成时按作者检索应回退到 author1..authorN 过滤，否则只能查到升级后写入的论文。
+
+    Args:
+        path (str): SQLite 索引文件路径。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (author TEXT NOT NULL, doc_id TEXT NOT NULL, "
+            "PRIMARY KEY (author, doc_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('built', 0)")
+        self._conn.commit()
+
+    def update_many(self, doc_ids, authors_list):
+        """写入一批文档的作者，已存在的文档会先删除旧的作者记录"""
+        rows = []
+        for doc_id, authors in zip(doc_ids, authors_list):
+            for author in {normalize_author(a) for a in split_authors(authors)}:
+                if author:
+                    rows.append((author, doc_id))
+        with self._lock:
+            self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self._conn.executemany("INSERT OR IGNORE INTO postings (author, doc_id) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def remove_many(self, doc_ids):
+        """删除文档的全部作者记录"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self._conn.commit()
+
+    def lookup(self, author):
+        """返回该作者全部论文的文档ID"""
+        with self._lock:
+            rows = self._conn.execute("SELECT doc_id FROM postings WHERE author = ?", (normalize_author(author),))
+            return [row[0] for row in rows]
+
+    def is_built(self):
+        """索引是否覆盖集合全部文档（其他进程完成 rebuild 后同样可见）"""
+        with self._lock:
+            return bool(self._conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()[0])
+
+    def indexed_count(self):
+        """索引中的文档数（没有作者的文档不计入）"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT doc_id) FROM postings").fetchone()[0]
+
+    def mark_built(self, built=True):
+        with self._lock:
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'built'", (int(built),))
+            self._conn.commit()
+
+    def reset(self, built=True):
+        """清空索引（重置集合时调用，此时索引仍然完整；rebuild 期间为 False）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'built'", (int(built),))
+            self._conn.commit()
+
+    def rebuild(self, collection, batch_size=5000):
+        """从集合的 authors 元数据重新构建索引"""
+        start_time = time.time()
+        # 中断时索引不完整，保持 built 为 0
+        self.reset(built=False)
+        ids = list_ids(collection)
+        for i in range(0, len(ids), batch_size):
+            results = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            self.update_many(results["ids"], [m.get("authors", "") for m in results["metadatas"]])
+            print(f"✅ 作者索引: 已处理 {min(i + batch_size, len(ids))}/{len(ids)} 篇论文")
+        self.mark_built()
+        print(f"✅ 作者索引构建完成，共 {len(ids)} 篇论文，用时 {time.time() - start_time:.2f} 秒")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
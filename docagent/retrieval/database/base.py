@@ -12,11 +12,13 @@ class BaseDatabase:
     def add(self, x):
         raise NotImplementedError
     
+    # x 为文档ID列表，支持按条件删除的后端也接受 where 条件字典
     def delete(self, x):
         raise NotImplementedError
     
     def query(self, x):
         raise NotImplementedError
     
+    # x 为论文列表：带 vector 的论文整条覆盖，不带 vector 时只更新元数据、保留已有向量
     def update(self, x):
         raise NotImplementedError
\ No newline at end of file
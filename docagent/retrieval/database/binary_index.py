@@ -0,0 +1,249 @@
+# binary_index.py - 二值量化的向量索引：按符号位打包，Hamming 距离生成候选
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from docagent.retrieval.database.chroma_merge import list_ids
+
+# numpy < 2.0 没有 bitwise_count，使用查表计算每个字节的 1 的个数
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(codes):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+
+def binarize(vectors):
+    """将向量按符号位量化并打包为 uint8（每 8 维一个字节）"""
+    return np.packbits(np.asarray(vectors, dtype=np.float32) > 0, axis=-1)
+
+
+class BinaryIndex:
+    """
+    集合向量的二值量化副本，保存在集合旁的目录中并通过内存映射读取。
+
+    每个向量只保留各维度的符号位（dim / 8 字节，约为 float32 的 1/32），检索时用 XOR + popcount
+    计算 Hamming 距离并取最近的候选，再由调用方读取候选的原始向量精确计算余弦相似度。
+    写入同一ID时原位覆盖编码，新ID追加到末尾；集合中删除的文档设置删除标记，不再作为候选。
+    meta.json 中的记录数在写入完成后才更新。写入进程之间通过 write.lock 文件锁互斥；
+    读取进程只映射已提交的记录、从不修改文件，在数据变化后自动重新映射。
+
+    目录结构：
+        meta.json   维度与已提交的记录数
+        codes.bin   uint8 编码矩阵（count × ceil(dim / 8)）
+        deleted.bin uint8 删除标记
+        ids.txt     文档ID（按行）
+
+    Args:
+        path (str): 索引目录。
+        dim (int): 向量维度，新建索引时必须提供。
+        block_rows (int): 扫描时每块的行数。
+    """
+
+    def __init__(self, path, dim=None, block_rows=262144):
+        self.path = path
+        self.block_rows = block_rows
+        os.makedirs(path, exist_ok=True)
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.RLock()
+        if not os.path.exists(self._meta_path):
+            if dim is None:
+                raise ValueError(f"二值索引 {path} 不存在，新建时需要指定维度")
+            for name in ("codes.bin", "deleted.bin", "ids.txt"):
+                open(self._file(name), 'ab').close()
+            self._save_meta({"dim": dim, "count": 0})
+        self._meta_mtime = None
+        self._ids = None
+        self._load()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save_meta(self, meta):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _load(self):
+        """
+        按 meta.json 中已提交的记录数映射编码文件。
+
+        只读取，不修改任何文件：中断写入留下的尾部由写入进程在持有写锁时截断。
+        记录数只增加时只读取新增的ID。
+        """
+        with self._lock:
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self._meta_mtime = os.stat(self._meta_path).st_mtime_ns
+            self.dim = meta["dim"]
+            self.code_bytes = (self.dim + 7) // 8
+            if self._ids is None or meta["count"] < len(self._ids):
+                self._ids, self._rows, self._ids_size = [], {}, 0
+            self.count = meta["count"]
+
+            ids_path = self._file("ids.txt")
+            if len(self._ids) < self.count:
+                with open(ids_path, 'rb') as f:
+                    f.seek(self._ids_size)
+                    for _ in range(self.count - len(self._ids)):
+                        line = f.readline()
+                        self._ids_size += len(line)
+                        doc_id = line.decode("utf-8").rstrip("\n")
+                        self._rows[doc_id] = len(self._ids)
+                        self._ids.append(doc_id)
+
+            if self.count:
+                self._codes = np.memmap(self._file("codes.bin"), dtype=np.uint8, mode="r",
+                                        shape=(self.count, self.code_bytes))
+            else:
+                self._codes = np.zeros((0, self.code_bytes), dtype=np.uint8)
+            deleted_path = self._file("deleted.bin")
+            deleted_rows = min(self.count, os.path.getsize(deleted_path) if os.path.exists(deleted_path) else 0)
+            if deleted_rows == self.count and self.count:
+                self._deleted = np.memmap(deleted_path, dtype=np.uint8, mode="r", shape=(self.count,))
+            else:
+                # 旧版本的索引没有删除标记文件，缺少的部分视为未删除（下次写入时补齐）
+                self._deleted = np.zeros(self.count, dtype=np.uint8)
+                if deleted_rows:
+                    self._deleted[:deleted_rows] = np.fromfile(deleted_path, dtype=np.uint8, count=deleted_rows)
+
+    def refresh(self):
+        """其他进程写入新数据后重新映射"""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._meta_mtime:
+            self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        """写入进程的排他文件锁：持有期间加载最新提交的数据，并截断中断写入留下的尾部"""
+        with self._lock:
+            with open(self._file("write.lock"), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    # 旧版本的索引没有 deleted.bin，这里同时补齐为未删除
+                    for name, size in (("codes.bin", self.count * self.code_bytes), ("ids.txt", self._ids_size),
+                                       ("deleted.bin", self.count)):
+                        with open(self._file(name), 'ab') as f:
+                            f.truncate(size)
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _set_deleted(self, rows, flag):
+        with open(self._file("deleted.bin"), 'r+b') as f:
+            for row in rows:
+                f.seek(row)
+                f.write(flag)
+
+    def add(self, ids, vectors):
+        """写入一批向量的编码（已存在的ID原位覆盖并取消删除标记）"""
+        if not ids:
+            return
+        codes = binarize(vectors).reshape(len(ids), self.code_bytes)
+        with self._write_lock():
+            new_ids, new_codes, restored = [], [], []
+            with open(self._file("codes.bin"), 'r+b') as f:
+                for doc_id, code in zip(ids, codes):
+                    row = self._rows.get(doc_id)
+                    if row is None:
+                        new_ids.append(doc_id)
+                        new_codes.append(code)
+                    else:
+                        f.seek(row * self.code_bytes)
+                        f.write(code.tobytes())
+                        if self._deleted[row]:
+                            restored.append(row)
+            self._set_deleted(restored, b"\x00")
+            if new_ids:
+                with open(self._file("codes.bin"), 'ab') as f:
+                    np.asarray(new_codes, dtype=np.uint8).tofile(f)
+                with open(self._file("deleted.bin"), 'ab') as f:
+                    f.write(bytes(len(new_ids)))
+                with open(self._file("ids.txt"), 'a', encoding='utf-8') as f:
+                    f.write("".join(f"{doc_id}\n" for doc_id in new_ids))
+            self._save_meta({"dim": self.dim, "count": self.count + len(new_ids)})
+            self._load()
+
+    def remove(self, ids):
+        """为已删除的文档设置删除标记，检索时不再作为候选"""
+        with self._write_lock():
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+            if rows:
+                self._set_deleted(rows, b"\x01")
+                # 更新 meta.json 使读取进程重新映射
+                self._save_meta({"dim": self.dim, "count": self.count})
+                self._load()
+            return len(rows)
+
+    def reset(self):
+        """清空索引（集合被重置时调用）"""
+        with self._write_lock():
+            self._save_meta({"dim": self.dim, "count": 0})
+            self._load()
+
+    def live_count(self):
+        """未被标记删除的记录数（与集合的文档数一致时说明索引已同步）"""
+        with self._lock:
+            self.refresh()
+            return self.count - int(np.count_nonzero(self._deleted))
+
+    def sync(self, collection, batch_size=5000):
+        """
+        将集合中尚未编码的文档加入索引，并为集合中已不存在的文档设置删除标记
+        （增量构建，可随时中断后重新运行）
+        """
+        start_time = time.time()
+        self.refresh()
+        collection_ids = set(list_ids(collection))
+        stale = [doc_id for doc_id, row in self._rows.items() if doc_id not in collection_ids and not self._deleted[row]]
+        if stale:
+            print(f"🗑️ 二值索引中有 {len(stale)} 条记录已从集合删除，设置删除标记")
+            self.remove(stale)
+        pending = [doc_id for doc_id in collection_ids if doc_id not in self._rows]
+        print(f"⏳ 二值索引需要补充 {len(pending)} 条记录")
+        for i in range(0, len(pending), batch_size):
+            results = collection.get(ids=pending[i:i + batch_size], include=["embeddings"])
+            self.add(results["ids"], results["embeddings"])
+            print(f"✅ 已编码 {min(i + batch_size, len(pending))}/{len(pending)} 条记录")
+        print(f"✅ 二值索引共 {self.count} 条记录，编码占用 {self.count * self.code_bytes / 1024 / 1024:.1f} MB "
+              f"(float32 向量约 {self.count * self.dim * 4 / 1024 / 1024:.1f} MB)，用时 {time.time() - start_time:.2f} 秒")
+
+    def candidates(self, query_vector, n):
+        """按 Hamming 距离返回最近的 n 个文档ID（由近到远）"""
+        with self._lock:
+            self.refresh()
+            if not self.count:
+                return []
+            query = binarize(query_vector).reshape(1, self.code_bytes)
+            best_rows = np.empty(0, dtype=np.int64)
+            best_dist = np.empty(0, dtype=np.int32)
+            for start in range(0, self.count, self.block_rows):
+                block = np.asarray(self._codes[start:start + self.block_rows])
+                dist = _popcount(block ^ query).sum(axis=1, dtype=np.int32)
+                rows = np.arange(start, start + len(block))
+                live = self._deleted[start:start + len(block)] == 0
+                dist, rows = dist[live], rows[live]
+                dist = np.concatenate([best_dist, dist])
+                rows = np.concatenate([best_rows, rows])
+                if len(dist) > n:
+                    keep = np.argpartition(dist, n - 1)[:n]
+                    dist, rows = dist[keep], rows[keep]
+                best_dist, best_rows = dist, rows
+            order = np.argsort(best_dist, kind="stable")
+            return [self._ids[row] for row in best_rows[order]]
@@ -0,0 +1,159 @@
+# chroma_merge.py - 可断点续传的 ChromaDB 集合合并
+import json
+import os
+import re
+import time
+
+# 旧版本按插入顺序生成的ID（doc_0, doc_1, ...），不同源集合之间会重复
+_POSITIONAL_ID = re.compile(r"^doc_\d+$")
+
+
+def dest_id(source_name, doc_id):
+    """计算文档在目标集合中的ID：内容生成的ID保持不变，旧的顺序ID加上源集合前缀以免冲突"""
+    if _POSITIONAL_ID.match(doc_id):
+        return f"{source_name}_{doc_id}"
+    return doc_id
+
+
+def _load_checkpoint(path, dest_name):
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("dest") == dest_name:
+            return checkpoint
+    return {"dest": dest_name, "sources": {}}
+
+
+def _save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def list_ids(collection):
+    """获取集合中全部文档ID并排序，作为分页的稳定顺序"""
+    return sorted(collection.get(include=[])["ids"])
+
+
+def missing_ids(collection, ids, batch_size=5000):
+    """返回 ids 中在 collection 里不存在的ID"""
+    missing = []
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        found = set(collection.get(ids=batch, include=[])["ids"])
+        missing.extend(doc_id for doc_id in batch if doc_id not in found)
+    return missing
+
+
+def merge_collections(client, source_names, dest_name, checkpoint_path=None, batch_size=5000, delete_sources=True):
+    """
+    将多个源集合合并到目标集合。
+
+    按排序后的文档ID分批读取（通过 ids 精确查询，不使用 offset，耗时与数据量线性相关），
+    保留原始ID（旧的顺序ID加源集合前缀）并使用 upsert 写入，因此重复执行不会产生重复数据。每写完一批记录一次进度，
+    中断后重新运行会从上次的位置继续。全部写入后逐一核对源集合中的ID是否都已存在于目标集合，
+    核对通过才删除源集合。
+
+    Args:
+        client: chromadb 客户端。
+        source_names (list): 源集合名称列表。
+        dest_name (str): 目标集合名称。
+        checkpoint_path (str): 进度文件路径，为 None 时不记录进度。
+        batch_size (int): 每批读取与写入的文档数。
+        delete_sources (bool): 核对通过后是否删除源集合。
+
+    Returns:
+        bool: 是否全部合并并核对成功。
+    """
+    existing = {c.name if hasattr(c, "name") else c for c in client.list_collections()}
+    sources = [name for name in source_names if name in existing]
+    for name in source_names:
+        if name not in existing:
+            print(f"⚠️ 源集合 {name} 不存在，跳过")
+    if not sources:
+        print("⚠️ 没有可合并的源集合")
+        return False
+
+    # 目标集合沿用源集合的配置（如 hnsw:space），避免默认使用 L2 距离
+    if dest_name in existing:
+        dest = client.get_collection(name=dest_name)
+    else:
+        dest = client.create_collection(name=dest_name, metadata=client.get_collection(name=sources[0]).metadata)
+        print(f"✅ 已创建目标集合 {dest_name}")
+    original_count = dest.count()
+    print(f"📊 目标集合 {dest_name} 中已有 {original_count} 条记录")
+
+    if hasattr(client, "get_max_batch_size"):
+        batch_size = min(batch_size, client.get_max_batch_size())
+
+    checkpoint = _load_checkpoint(checkpoint_path, dest_name)
+    source_ids = {}
+    for name in sources:
+        src = client.get_collection(name=name)
+        ids = list_ids(src)
+        source_ids[name] = ids
+        state = checkpoint["sources"].get(name)
+        if state is None or state.get("total") != len(ids):
+            # 源集合发生变化或首次合并：从头开始（upsert 保证重复写入无副作用）
+            state = {"next": 0, "total": len(ids), "done": False}
+            checkpoint["sources"][name] = state
+        if state["done"]:
+            print(f"⏭️ 集合 {name} 已合并，跳过")
+            continue
+        if state["next"]:
+            print(f"⏩ 集合 {name} 从第 {state['next']} 条记录继续合并")
+
+        start_time = time.time()
+        resumed_from = state["next"]
+        for i in range(state["next"], len(ids), batch_size):
+            batch_ids = ids[i:i + batch_size]
+            results = src.get(ids=batch_ids, include=["documents", "embeddings", "metadatas"])
+            # 精简结构的记录没有 documents，批次中只要有缺失就整体不写 documents（摘要已在元数据中）
+            documents = results["documents"]
+            if not documents or any(d is None for d in documents):
+                documents = None
+            dest.upsert(
+                ids=[dest_id(name, doc_id) for doc_id in results["ids"]],
+                embeddings=results["embeddings"],
+                documents=documents,
+                metadatas=results["metadatas"]
+            )
+            state["next"] = i + len(batch_ids)
+            _save_checkpoint(checkpoint_path, checkpoint)
+            rate = (state["next"] - resumed_from) / max(time.time() - start_time, 1e-9)
+            print(f"✅ {name}: 已合并 {state['next']}/{len(ids)} 条记录 ({rate:.0f} 条/秒)")
+        state["done"] = True
+        _save_checkpoint(checkpoint_path, checkpoint)
+        print(f"✅ 已完成集合 {name} 的合并")
+
+    # 核对：每个源集合的全部ID都必须已存在于目标集合
+    final_count = dest.count()
+    print(f"📊 合并前目标集合 {original_count} 条，合并后 {final_count} 条，源集合共 {sum(len(v) for v in source_ids.values())} 条")
+    all_present = True
+    for name, ids in source_ids.items():
+        missing = missing_ids(dest, [dest_id(name, doc_id) for doc_id in ids], batch_size)
+        if missing:
+            all_present = False
+            checkpoint["sources"][name] = {"next": 0, "total": len(ids), "done": False}
+            print(f"❌ 集合 {name} 有 {len(missing)} 条记录未出现在目标集合中，例如: {missing[:5]}")
+        else:
+            print(f"✅ 集合 {name} 的 {len(ids)} 条记录已全部核对")
+    _save_checkpoint(checkpoint_path, checkpoint)
+    if not all_present:
+        print("❌ 核对未通过，保留源集合，请重新运行合并")
+        return False
+
+    if delete_sources:
+        print("🗑️ 开始删除源集合...")
+        for name in sources:
+            try:
+                client.delete_collection(name)
+                print(f"✅ 已删除源集合 {name}")
+            except Exception as e:
+                print(f"⚠️ 删除集合 {name} 失败: {str(e)}")
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return True
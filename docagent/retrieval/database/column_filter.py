@@ -0,0 +1,79 @@
+# column_filter.py - 列式过滤：将 ChromaDB 风格的 where 条件转换为按行的布尔掩码
+import re
+
+import numpy as np
+
+from docagent.retrieval.database.author_index import normalize_author
+from docagent.retrieval.database.filter_stats import parse_year
+
+_AUTHOR_FIELD = re.compile(r"^author\d*$")
+
+
+class ColumnFilter:
+    """
+    基于列式数组的过滤（NumpyVectorDatabase 与 IVFPQIndex 共用）。
+
+    使用方需要提供以下属性：
+        count          记录数
+        _years         int32 年份数组（-1 表示未知）
+        _venues        int32 期刊编号数组，_venue_codes 为 期刊名 -> 编号
+        _authors       int32 作者编号数组，第 i 条记录的作者位于 _authors[_author_ptr[i]:_author_ptr[i+1]]
+        _author_codes  规范化作者名 -> 编号
+    """
+
+    def _author_mask(self, author):
+        mask = np.zeros(self.count, dtype=bool)
+        code = self._author_codes.get(normalize_author(author))
+        if code is not None and len(self._authors):
+            positions = np.flatnonzero(self._authors == code)
+            mask[np.searchsorted(self._author_ptr, positions, side="right") - 1] = True
+        return mask
+
+    def _compare(self, column, op, value):
+        if op == "$eq":
+            return column == value
+        if op == "$ne":
+            return column != value
+        if op == "$gt":
+            return column > value
+        if op == "$gte":
+            return column >= value
+        if op == "$lt":
+            return column < value
+        if op == "$lte":
+            return column <= value
+        if op == "$in":
+            return np.isin(column, value)
+        if op == "$nin":
+            return ~np.isin(column, value)
+        raise ValueError(f"不支持的过滤运算符: {op}")
+
+    def where_mask(self, where):
+        """将 ChromaDB 风格的 where 条件（build_filters 的输出）转换为布尔掩码"""
+        if not where:
+            return np.ones(self.count, dtype=bool)
+        masks = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                sub = [self.where_mask(w) for w in condition]
+                masks.append(np.logical_and.reduce(sub) if key == "$and" else np.logical_or.reduce(sub))
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if key == "published":
+                    values = [parse_year(v) for v in value] if op in ("$in", "$nin") else parse_year(value)
+                    masks.append(self._compare(self._years, op, values))
+                elif key == "venue":
+                    lookup = lambda v: self._venue_codes.get(str(v), -2)
+                    values = [lookup(v) for v in value] if op in ("$in", "$nin") else lookup(value)
+                    if op not in ("$eq", "$ne", "$in", "$nin"):
+                        raise ValueError(f"期刊字段不支持运算符 {op}")
+                    masks.append(self._compare(self._venues, op, values))
+                elif _AUTHOR_FIELD.match(key):
+                    if op != "$eq":
+                        raise ValueError(f"作者字段只支持 $eq，收到 {op}")
+                    masks.append(self._author_mask(value))
+                else:
+                    raise ValueError(f"不支持按字段 {key} 过滤")
+        return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
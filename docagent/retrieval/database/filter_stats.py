@@ -0,0 +1,218 @@
+# filter_stats.py - 按期刊/年份统计文档数，用于估计过滤条件的选择度
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from docagent.retrieval.database.chroma_merge import list_ids
+
+
+def parse_year(value):
+    """将 published 字段转换为整数年份，无法解析时返回 -1"""
+    try:
+        return int(str(value).strip()[:4])
+    except (TypeError, ValueError):
+        return -1
+
+
+def _matches(value, op, target):
+    if op == "$eq":
+        return value == target
+    if op == "$ne":
+        return value != target
+    if op == "$gt":
+        return value > target
+    if op == "$gte":
+        return value >= target
+    if op == "$lt":
+        return value < target
+    if op == "$lte":
+        return value <= target
+    if op == "$in":
+        return value in target
+    if op == "$nin":
+        return value not in target
+    return True
+
+
+class FilterStats:
+    """
+    集合中每个期刊、每个年份的文档数，保存在集合旁的 SQLite 文件中。
+
+    每篇文档记录一行 (doc_id, venue, year)，重复写入同一文档时覆盖旧值，计数保持准确；
+    内存中维护按期刊和按年份的计数，用于在查询前估计 where 条件会匹配多少文档；
+    其他进程写入后（PRAGMA data_version 变化）估计前重新统计。
+    每次写入同时递增 meta 表中的写入代数，其他进程据此判断集合是否发生过变化。
+    统计只有在覆盖集合全部文档时（meta 表中 built 为 1：由 rebuild 构建，或从空集合开始随写入维护）
+    才用于估计，否则按没有统计信息处理，避免旧集合只统计了升级后写入的少量文档而被误判为选择度极高。
+
+    Args:
+        path (str): SQLite 文件路径。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, venue TEXT, year INTEGER) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('built', 0)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            self.built = bool(self._conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()[0])
+            self.venues = Counter(dict(self._conn.execute("SELECT venue, COUNT(*) FROM docs GROUP BY venue")))
+            self.years = Counter(dict(self._conn.execute("SELECT year, COUNT(*) FROM docs GROUP BY year")))
+            self.total = sum(self.venues.values())
+
+    def refresh(self):
+        """其他连接提交过写入时重新统计（本连接的写入已增量计入，不改变 data_version）"""
+        with self._lock:
+            if self._conn.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+                self._load()
+
+    def update_many(self, doc_ids, metadatas):
+        """写入一批文档的期刊与年份（已存在的文档先扣除旧值）"""
+        rows = [(doc_id, str(m.get("venue", "")), parse_year(m.get("published"))) for doc_id, m in zip(doc_ids, metadatas)]
+        with self._lock:
+            for i in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[i:i + 500]]
+                placeholders = ",".join("?" * len(batch))
+                for venue, year in self._conn.execute(f"SELECT venue, year FROM docs WHERE doc_id IN ({placeholders})", batch):
+                    self.venues[venue] -= 1
+                    self.years[year] -= 1
+                    self.total -= 1
+            self._conn.executemany("INSERT OR REPLACE INTO docs (doc_id, venue, year) VALUES (?, ?, ?)", rows)
+            self._bump_generation()
+            self._conn.commit()
+            for _, venue, year in rows:
+                self.venues[venue] += 1
+                self.years[year] += 1
+                self.total += 1
+
+    def remove_many(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                row = self._conn.execute("SELECT venue, year FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row:
+                    self.venues[row[0]] -= 1
+                    self.years[row[1]] -= 1
+                    self.total -= 1
+            self._conn.executemany("DELETE FROM docs WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+            self._bump_generation()
+            self._conn.commit()
+
+    def reset(self, built=True):
+        """清空统计；集合同时被清空时统计仍然完整（built=True），rebuild 期间为 False"""
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._set_built(built)
+            self._bump_generation()
+            self._conn.commit()
+        self._load()
+
+    def _set_built(self, built):
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'built'", (int(built),))
+        self.built = built
+
+    def mark_built(self):
+        """确认统计覆盖集合全部文档（如打开空集合，或统计数与集合文档数一致时）"""
+        with self._lock:
+            self._set_built(True)
+            self._conn.commit()
+
+    def _bump_generation(self):
+        # 与统计数据在同一事务中提交
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def generation(self):
+        """持久化的写入代数，任一进程写入集合后递增"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def rebuild(self, collection, batch_size=5000):
+        """从集合元数据重新统计"""
+        start_time = time.time()
+        # 中断时统计不完整，保持 built 为 0
+        self.reset(built=False)
+        ids = list_ids(collection)
+        for i in range(0, len(ids), batch_size):
+            results = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            self.update_many(results["ids"], results["metadatas"])
+        self.mark_built()
+        print(f"✅ 过滤统计构建完成，共 {self.total} 篇论文、{len(+self.venues)} 个期刊，用时 {time.time() - start_time:.2f} 秒")
+
+    # ---------- 选择度估计 ----------
+
+    def _field_fraction(self, counter, predicates, convert):
+        if not predicates:
+            return 1.0
+        matched = 0
+        for value, count in counter.items():
+            if count > 0 and all(_matches(value, op, convert(target)) for op, target in predicates):
+                matched += count
+        return matched / self.total
+
+    def _fraction(self, where):
+        if not where:
+            return 1.0
+        if len(where) > 1:
+            return self._fraction({"$and": [{k: v} for k, v in where.items()]})
+        key, condition = next(iter(where.items()))
+        if key == "$or":
+            return min(1.0, sum(self._fraction(w) for w in condition))
+
+        # $and：同一字段的条件合并计算（如年份上下限），不同字段按相互独立估计
+        clauses = []
+        pending = list(condition) if key == "$and" else [where]
+        while pending:
+            clause = pending.pop()
+            if len(clause) == 1 and "$and" in clause:
+                pending.extend(clause["$and"])
+            else:
+                clauses.append(clause)
+        year_predicates, venue_predicates = [], []
+        fraction = 1.0
+        for clause in clauses:
+            if len(clause) != 1:
+                fraction *= self._fraction(clause)
+                continue
+            field, cond = next(iter(clause.items()))
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            if field == "published":
+                year_predicates.extend(cond.items())
+            elif field == "venue":
+                venue_predicates.extend(cond.items())
+            elif field == "$or":
+                fraction *= self._fraction(clause)
+            # 没有统计信息的字段按不过滤估计
+        to_year = lambda t: [parse_year(v) for v in t] if isinstance(t, list) else parse_year(t)
+        to_venue = lambda t: [str(v) for v in t] if isinstance(t, list) else str(t)
+        fraction *= self._field_fraction(self.years, year_predicates, to_year)
+        fraction *= self._field_fraction(self.venues, venue_predicates, to_venue)
+        return fraction
+
+    def estimate(self, where):
+        """
+        估计满足 where 条件的文档数。
+
+        Returns:
+            float: 估计的文档数；没有统计信息或统计不完整时返回 None。
+        """
+        with self._lock:
+            self.refresh()
+            if self.total <= 0 or not self.built:
+                return None
+            return self.total * self._fraction(where)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
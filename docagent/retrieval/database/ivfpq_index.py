@@ -0,0 +1,324 @@
+# ivfpq_index.py - IVF-PQ 索引：粗聚类倒排 + 残差乘积量化，内存映射加载
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from docagent.retrieval.database.author_index import normalize_author
+from docagent.retrieval.database.chroma_merge import list_ids
+from docagent.retrieval.database.column_filter import ColumnFilter
+from docagent.retrieval.database.filter_stats import parse_year
+from docagent.retrieval.database.slim_schema import split_authors
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def assign(vectors, centroids, block_rows=16384):
+    """返回每个向量最近（L2 距离）的聚类中心编号"""
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def kmeans(vectors, k, iterations=15, seed=0):
+    """Lloyd k-means，空簇重新随机取样本点作为中心"""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) < k:
+        raise ValueError(f"训练样本数 {len(vectors)} 少于聚类数 {k}")
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class IVFPQIndex(ColumnFilter):
+    """
+    从集合构建的 IVF-PQ 索引（只读，由 build_ivfpq_index 生成）。
+
+    向量归一化后先分配到 nlist 个粗聚类中心，与中心的残差切分为 m 段，每段用至多 256 个中心量化为 1 字节
+    （训练样本少于 256 个时码字数等于样本数）。
+    每篇论文只保存 m 字节的编码，按倒排表连续存放；检索时只扫描与查询最近的 nprobe 个倒排表，
+    用查表法估计内积。年份、期刊、作者以列式数组保存，支持与 build_filters 相同的过滤条件。
+    所有数组通过内存映射读取。
+
+    目录结构：
+        meta.json         维度、nlist、m、记录数等
+        centroids.npy     粗聚类中心（nlist × dim）
+        codebooks.npy     乘积量化码本（m × ksub × dim/m，ksub ≤ 256）
+        list_offsets.npy  第 l 个倒排表位于 codes.bin 的 [offsets[l], offsets[l+1]) 行
+        codes.bin         uint8 编码（按倒排表排列）
+        list_rows.bin     int64，codes.bin 每行对应的记录号
+        years.bin / venues.bin / author_ptr.bin / authors.bin  按记录号排列的过滤列
+        ids.txt / venues.txt / author_names.txt               文档ID与词表
+
+    Args:
+        path (str): 索引目录。
+        nprobe (int): 默认扫描的倒排表数。
+    """
+
+    def __init__(self, path, nprobe=16):
+        self.path = path
+        self.nprobe = nprobe
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.dim = self.meta["dim"]
+        self.nlist = self.meta["nlist"]
+        self.m = self.meta["m"]
+        self.count = self.meta["count"]
+
+        self.centroids = np.load(self._file("centroids.npy"))
+        self.codebooks = np.load(self._file("codebooks.npy"))
+        self.list_offsets = np.load(self._file("list_offsets.npy"))
+        self._codes = self._map("codes.bin", np.uint8, (self.count, self.m))
+        self._list_rows = self._map("list_rows.bin", "<i8", (self.count,))
+        self._years = self._map("years.bin", "<i4", (self.count,))
+        self._venues = self._map("venues.bin", "<i4", (self.count,))
+        self._author_ptr = np.fromfile(self._file("author_ptr.bin"), dtype="<i8")
+        self._authors = self._map("authors.bin", "<i4", (int(self._author_ptr[-1]),))
+        self._ids = self._read_lines("ids.txt")
+        self._venue_codes = {name: code for code, name in enumerate(self._read_lines("venues.txt"))}
+        self._author_codes = {name: code for code, name in enumerate(self._read_lines("author_names.txt"))}
+        print(f"✅ IVF-PQ 索引 {path} 已加载 {self.count} 条记录 (nlist={self.nlist}, m={self.m}, "
+              f"编码 {self.count * self.m / 1024 / 1024:.1f} MB)")
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, name, dtype, shape):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def _read_lines(self, name):
+        # 写入时只把值中的 \n 替换为空格，因此只按 \n 分行（splitlines 还会在 \r 等字符处分行，导致编码错位）
+        with open(self._file(name), 'r', encoding='utf-8', newline='') as f:
+            lines = f.read().split("\n")
+        return lines[:-1] if lines and lines[-1] == "" else lines
+
+    def search(self, query_vector, top_k=5, nprobe=None, filter_expression=None, author=None):
+        """
+        检索与查询向量内积（余弦相似度）最大的 top_k 篇论文。
+
+        Returns:
+            list: [(文档ID, 估计的相似度)]，按相似度从高到低排列。
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query = _normalize(query_vector).reshape(self.dim)
+        mask = self.where_mask(filter_expression) if filter_expression else None
+        if author and author.strip():
+            author_mask = self._author_mask(author)
+            mask = author_mask if mask is None else mask & author_mask
+
+        coarse = self.centroids @ query
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        # 每段子向量与各码字的内积表，编码对应的表项之和即为残差部分的内积
+        lut = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, -1))
+        sub = np.arange(self.m)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for l in probes:
+            start, end = int(self.list_offsets[l]), int(self.list_offsets[l + 1])
+            if start == end:
+                continue
+            rows = np.asarray(self._list_rows[start:end])
+            codes = np.asarray(self._codes[start:end])
+            if mask is not None:
+                keep = mask[rows]
+                rows, codes = rows[keep], codes[keep]
+                if not len(rows):
+                    continue
+            scores = coarse[l] + lut[sub, codes].sum(axis=1)
+            best_scores = np.concatenate([best_scores, scores.astype(np.float32)])
+            best_rows = np.concatenate([best_rows, rows])
+            if len(best_scores) > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return [(self._ids[row], float(best_scores[i])) for i, row in zip(order, best_rows[order])]
+
+
+def build_ivfpq_index(collection, path, nlist=1024, m=64, sample_size=50000, iterations=15, batch_size=5000, seed=0):
+    """
+    从集合训练并构建 IVF-PQ 索引。
+
+    在随机抽样的 sample_size 个向量上训练粗聚类中心与乘积量化码本，再分批读取全部向量编码。
+    先写入 <path>.building，完成后替换 path，构建期间旧索引仍可使用。
+
+    Args:
+        collection: ChromaDB 集合。
+        path (str): 索引目录。
+        nlist (int): 粗聚类中心（倒排表）数。
+        m (int): 乘积量化的段数（每篇论文的编码字节数），需整除向量维度。
+        sample_size (int): 训练样本数。
+        iterations (int): k-means 迭代次数。
+        batch_size (int): 编码时每批读取的记录数。
+
+    Returns:
+        IVFPQIndex: 构建完成的索引。
+    """
+    start_time = time.time()
+    ids = list_ids(collection)
+    if not ids:
+        raise ValueError("集合为空，无法构建索引")
+    rng = np.random.default_rng(seed)
+    sample_ids = [ids[i] for i in np.sort(rng.choice(len(ids), min(sample_size, len(ids)), replace=False))]
+    sample = []
+    for i in range(0, len(sample_ids), batch_size):
+        sample.extend(collection.get(ids=sample_ids[i:i + batch_size], include=["embeddings"])["embeddings"])
+    sample = _normalize(sample)
+    dim = sample.shape[1]
+    if dim % m:
+        raise ValueError(f"段数 m={m} 必须整除向量维度 {dim}")
+    nlist = min(nlist, len(sample))
+
+    print(f"⏳ 训练粗聚类中心: {len(sample)} 个样本, nlist={nlist}")
+    centroids = kmeans(sample, nlist, iterations, seed)
+    residuals = sample - centroids[assign(sample, centroids)]
+    # 每段编码为 1 字节，码字数最多 256；样本较少（小集合）时不能超过样本数
+    ksub = min(256, len(sample))
+    print(f"⏳ 训练乘积量化码本: m={m}, 每段 {dim // m} 维, {ksub} 个码字")
+    codebooks = np.stack([kmeans(residuals[:, j * (dim // m):(j + 1) * (dim // m)], ksub, iterations, seed + j + 1)
+                          for j in range(m)])
+
+    build_path = f"{path}.building"
+    shutil.rmtree(build_path, ignore_errors=True)
+    os.makedirs(build_path)
+    np.save(os.path.join(build_path, "centroids.npy"), centroids)
+    np.save(os.path.join(build_path, "codebooks.npy"), codebooks)
+    file = lambda name: os.path.join(build_path, name)
+
+    venue_codes, author_codes = {}, {}
+    labels = []
+    author_total = 0
+    with open(file("codes_unsorted.bin"), 'wb') as codes_f, open(file("years.bin"), 'wb') as years_f, \
+            open(file("venues.bin"), 'wb') as venues_f, open(file("authors.bin"), 'wb') as authors_f, \
+            open(file("author_ptr.bin"), 'wb') as ptr_f, open(file("ids.txt"), 'w', encoding='utf-8', newline='') as ids_f:
+        np.zeros(1, dtype="<i8").tofile(ptr_f)
+        for i in range(0, len(ids), batch_size):
+            results = collection.get(ids=ids[i:i + batch_size], include=["embeddings", "metadatas"])
+            vectors = _normalize(results["embeddings"])
+            batch_labels = assign(vectors, centroids)
+            residuals = vectors - centroids[batch_labels]
+            codes = np.empty((len(vectors), m), dtype=np.uint8)
+            for j in range(m):
+                codes[:, j] = assign(np.ascontiguousarray(residuals[:, j * (dim // m):(j + 1) * (dim // m)]), codebooks[j])
+            codes.tofile(codes_f)
+            labels.append(batch_labels.astype(np.int32))
+
+            years, venues, authors, ptr = [], [], [], []
+            for metadata in results["metadatas"]:
+                years.append(parse_year(metadata.get("published")))
+                venues.append(venue_codes.setdefault(str(metadata.get("venue", "")), len(venue_codes)))
+                codes_set = {author_codes.setdefault(normalize_author(a), len(author_codes))
+                             for a in split_authors(metadata.get("authors", ""))}
+                authors.extend(sorted(codes_set))
+                author_total += len(codes_set)
+                ptr.append(author_total)
+            np.asarray(years, dtype="<i4").tofile(years_f)
+            np.asarray(venues, dtype="<i4").tofile(venues_f)
+            np.asarray(authors, dtype="<i4").tofile(authors_f)
+            np.asarray(ptr, dtype="<i8").tofile(ptr_f)
+            ids_f.write("".join(f"{doc_id}\n" for doc_id in results["ids"]))
+            print(f"✅ 已编码 {min(i + batch_size, len(ids))}/{len(ids)} 条记录")
+
+    for name, codes in (("venues.txt", venue_codes), ("author_names.txt", author_codes)):
+        with open(file(name), 'w', encoding='utf-8', newline='') as f:
+            f.write("".join(value.replace("\n", " ") + "\n" for value in codes))
+
+    # 按倒排表重新排列编码，使每个倒排表在磁盘上连续
+    labels = np.concatenate(labels)
+    order = np.argsort(labels, kind="stable")
+    np.save(file("list_offsets.npy"), np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]))
+    order.astype("<i8").tofile(file("list_rows.bin"))
+    unsorted = np.memmap(file("codes_unsorted.bin"), dtype=np.uint8, mode="r", shape=(len(labels), m))
+    with open(file("codes.bin"), 'wb') as f:
+        for start in range(0, len(order), 1 << 20):
+            np.asarray(unsorted[order[start:start + (1 << 20)]]).tofile(f)
+    del unsorted
+    os.remove(file("codes_unsorted.bin"))
+
+    with open(file("meta.json"), 'w', encoding='utf-8') as f:
+        json.dump({"dim": dim, "nlist": nlist, "m": m, "count": len(labels), "sample_size": len(sample)}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(build_path, path)
+    print(f"✅ IVF-PQ 索引构建完成: {len(labels)} 条记录，编码 {len(labels) * m / 1024 / 1024:.1f} MB "
+          f"(float32 向量约 {len(labels) * dim * 4 / 1024 / 1024:.1f} MB)，用时 {time.time() - start_time:.2f} 秒")
+    return IVFPQIndex(path)
+
+
+def evaluate_ivfpq(index, collection, nprobes=(1, 4, 16, 64), num_queries=100, top_k=10, batch_size=5000, seed=0,
+                   rerank_factor=1):
+    """
+    用库内论文作为查询，对比 IVF-PQ 与精确检索：每个 nprobe 的 recall@k 与单次查询延迟。
+
+    精确结果通过一次遍历集合全部向量得到；检索时排除查询论文自身。
+    rerank_factor 大于 1 时取 top_k × rerank_factor 个候选并读取原始向量精确重排（与检索时的设置一致）。
+
+    Returns:
+        list: 每个 nprobe 一项 {"nprobe", "recall", "mean_ms", "p95_ms"}。
+    """
+    rng = np.random.default_rng(seed)
+    sample_ids = [index._ids[i] for i in rng.choice(index.count, min(num_queries, index.count), replace=False)]
+    results = collection.get(ids=sample_ids, include=["embeddings"])
+    query_ids, queries = results["ids"], _normalize(results["embeddings"])
+
+    # 精确 top_k（多取 1 条以便排除查询自身）
+    k = top_k + 1
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=object)
+    ids = list_ids(collection)
+    for i in range(0, len(ids), batch_size):
+        results = collection.get(ids=ids[i:i + batch_size], include=["embeddings"])
+        scores = np.concatenate([best_scores, queries @ _normalize(results["embeddings"]).T], axis=1)
+        batch_ids = np.concatenate([best_ids, np.broadcast_to(np.asarray(results["ids"], dtype=object),
+                                                              (len(queries), len(results["ids"])))], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores, batch_ids = np.take_along_axis(scores, keep, axis=1), np.take_along_axis(batch_ids, keep, axis=1)
+        best_scores, best_ids = scores, batch_ids
+    exact = []
+    for q, doc_id in enumerate(query_ids):
+        order = np.argsort(-best_scores[q])
+        exact.append([i for i in best_ids[q][order] if i != doc_id][:top_k])
+
+    report = []
+    for nprobe in nprobes:
+        recalls, timings = [], []
+        for query, doc_id, truth in zip(queries, query_ids, exact):
+            start = time.perf_counter()
+            hits = index.search(query, k * rerank_factor, nprobe=nprobe)
+            if rerank_factor > 1 and hits:
+                candidates = collection.get(ids=[hit_id for hit_id, _ in hits], include=["embeddings"])
+                scores = _normalize(candidates["embeddings"]) @ query
+                hits = [(candidates["ids"][i], float(scores[i])) for i in np.argsort(-scores)[:k]]
+            timings.append((time.perf_counter() - start) * 1000)
+            found = [hit_id for hit_id, _ in hits if hit_id != doc_id][:top_k]
+            recalls.append(len(set(found) & set(truth)) / max(len(truth), 1))
+        timings.sort()
+        report.append({"nprobe": nprobe, "recall": sum(recalls) / len(recalls), "mean_ms": sum(timings) / len(timings),
+                       "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))]})
+
+    print(f"📊 IVF-PQ 测试 (nlist={index.nlist}, m={index.m}, {len(queries)} 个查询, Top K: {top_k}, 精排倍数: {rerank_factor})")
+    for item in report:
+        print(f"   nprobe={item['nprobe']:<4} recall@{top_k}: {item['recall']:.3f}  "
+              f"平均 {item['mean_ms']:.1f} ms  p95 {item['p95_ms']:.1f} ms")
+    return report
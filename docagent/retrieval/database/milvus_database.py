@@ -4,16 +4,70 @@ from chromadb.config import Settings
 import os
 import uuid  # 添加uuid模块导入
 import re # 需要导入 re 模块
+import math
+import numpy as np
+
+from docagent.retrieval.database.author_index import AuthorIndex
+from docagent.retrieval.database.base import BaseDatabase
+from docagent.retrieval.database.binary_index import BinaryIndex
+from docagent.retrieval.database.filter_stats import FilterStats
+from docagent.retrieval.database.slim_schema import build_metadata, content_hash, make_doc_id, slim_metadata
 
 # Define the maximum number of author fields to store separately
 MAX_AUTHORS_PER_PAPER = 50
 
-class ChromaDatabase:
-    def __init__(self, collection_name, dim):
-        """初始化数据库连接"""
+# ChromaDB 持久化目录
+CHROMA_PERSIST_DIRECTORY = "/home/dataset-assist-0/data/chromadb"
+
+
+def author_index_path(collection_name, persist_directory=None):
+    """集合对应的作者索引文件路径"""
+    return os.path.join(persist_directory or CHROMA_PERSIST_DIRECTORY, f"author_index_{collection_name}.sqlite3")
+
+
+def filter_stats_path(collection_name, persist_directory=None):
+    """集合对应的过滤统计文件路径"""
+    return os.path.join(persist_directory or CHROMA_PERSIST_DIRECTORY, f"filter_stats_{collection_name}.sqlite3")
+
+
+def binary_index_path(collection_name, persist_directory=None):
+    """集合对应的二值量化索引目录"""
+    return os.path.join(persist_directory or CHROMA_PERSIST_DIRECTORY, f"binary_index_{collection_name}")
+
+
+def author_where(author):
+    """作者条件的 where 表达式（author1..authorN 的 $or），仅在作者索引不可用时使用"""
+    return {"$or": [{f"author{i}": {"$eq": author.strip()}} for i in range(1, MAX_AUTHORS_PER_PAPER + 1)]}
+
+
+def plan_changes(unique_docs, existing):
+    """按 {文档ID: 论文} 与已有元数据 {文档ID: 元数据} 的差异分组，见 ChromaDatabase.plan_upsert"""
+    plan = {"embed": [], "metadata": [], "unchanged": 0}
+    for doc_id, doc in unique_docs.items():
+        old = existing.get(doc_id)
+        if old is None or content_hash(old) != content_hash(doc):
+            plan["embed"].append(doc)
+        elif build_metadata(doc, MAX_AUTHORS_PER_PAPER) != slim_metadata(old):
+            plan["metadata"].append(doc)
+        else:
+            plan["unchanged"] += 1
+    return plan
+
+
+class ChromaDatabase(BaseDatabase):
+    def __init__(self, collection_name, dim, author_index_file=None, exact_search_threshold=20000, max_overfetch=8,
+                 persist_directory=None):
+        """初始化数据库连接
+
+        exact_search_threshold: 过滤条件估计匹配的文档数不超过该值时，读取候选向量精确计算而不使用 HNSW 索引。
+        max_overfetch: 使用索引检索带过滤条件的查询时，n_results 最多放大的倍数。
+        persist_directory: ChromaDB 目录，默认为 CHROMA_PERSIST_DIRECTORY；作者索引等辅助文件保存在同一目录。
+        """
         # 设置存储路径 - 使用特定实例目录
         # 可以选择使用根目录或特定实例目录
-        persist_directory = "/home/dataset-assist-0/data/chromadb"
+        super().__init__(collection_name, dim)
+        persist_directory = persist_directory or CHROMA_PERSIST_DIRECTORY
+        self.persist_directory = persist_directory
         
         # 确保目录存在
         os.makedirs(persist_directory, exist_ok=True)
@@ -51,72 +105,378 @@ class ChromaDatabase:
              print(f"✅ 成功创建新集合: {collection_name}")
 
 
-        # 记录集合当前文档数，用于生成唯一ID
+        # 记录集合当前文档数
         self.doc_count = self.collection.count()
         print(f"当前集合中已有文档数: {self.doc_count}")
 
-    def insert_documents(self, documents):
-        """批量插入文档，并将作者拆分到单独字段"""
+        # 作者倒排索引，随写入同步更新
+        self.author_index = AuthorIndex(author_index_file or author_index_path(collection_name, persist_directory))
+        if not self.author_index.is_built() and self.author_index.indexed_count() == self.doc_count:
+            # 空集合（或索引已覆盖全部文档）从此随写入维护即完整
+            self.author_index.mark_built()
+        # 按期刊/年份的文档数，用于估计过滤条件的选择度并选择查询计划
+        self.filter_stats = FilterStats(filter_stats_path(collection_name, persist_directory))
+        if not self.filter_stats.built:
+            if self.filter_stats.total == self.doc_count:
+                self.filter_stats.mark_built()
+            else:
+                print(f"⚠️ 过滤统计只覆盖 {self.filter_stats.total}/{self.doc_count} 篇论文，查询计划按未知选择度处理，"
+                      f"请运行 --build-author-index 构建")
+        self.exact_search_threshold = exact_search_threshold
+        self.max_overfetch = max_overfetch
+        # 二值量化索引：已构建时随写入增量更新，enable_binary_index 后检索改用 Hamming 初筛
+        self.binary_index = None
+        self._open_binary_index()
+        self.binary_search = False
+        self.binary_rerank_factor = 10
+        # IVF-PQ 索引（enable_ivfpq 启用）
+        self.ivfpq_index = None
+        self.ivfpq_rerank_factor = 1
+
+    def _open_binary_index(self):
+        """
+        打开其他进程（如 --build-binary-index）构建的二值索引。写入前都会调用，
+        使索引构建之前已启动的长期写入进程也把后续写入同步到索引。
+        """
+        if self.binary_index is None:
+            path = binary_index_path(self.collection_name, self.persist_directory)
+            if BinaryIndex.exists(path):
+                self.binary_index = BinaryIndex(path)
+        return self.binary_index
+
+    def enable_binary_index(self, rerank_factor=10, sync=True):
+        """
+        检索时使用二值量化索引：按 Hamming 距离取 n_results × rerank_factor 个候选，
+        再读取候选的原始向量精确计算余弦距离。索引不存在时从集合向量构建，sync 为 True 时先补齐缺少的文档；
+        sync 为 False 时若索引的有效记录数与集合文档数不一致（如有写入进程未同步索引）也会补齐。
+        """
+        if self._open_binary_index() is None:
+            self.binary_index = BinaryIndex(binary_index_path(self.collection_name, self.persist_directory), dim=self.dim)
+            sync = True
+        elif not sync:
+            live_count, doc_count = self.binary_index.live_count(), self.collection.count()
+            if live_count != doc_count:
+                print(f"⚠️ 二值索引有 {live_count} 条有效记录，集合有 {doc_count} 篇论文，重新同步")
+                sync = True
+        if sync:
+            self.binary_index.sync(self.collection)
+        self.binary_search = True
+        self.binary_rerank_factor = rerank_factor
+        print(f"✅ 二值量化检索已启用: Hamming 初筛，精排 n_results × {rerank_factor} 个候选")
+
+    def enable_ivfpq(self, path, nprobe=16, rerank_factor=1):
+        """
+        检索时使用 IVF-PQ 索引（由 build_ivfpq_index 从集合构建）。
+
+        rerank_factor 大于 1 时取 n_results × rerank_factor 个候选，读取原始向量精确重排；
+        为 1 时直接使用量化编码估计的距离，不再读取原始向量。
+        索引中的过滤列是构建时的快照：候选的 where 条件会按集合中的当前元数据再次检查，
+        但构建后元数据改为满足条件的论文在重新构建索引前检索不到。
+        """
+        from docagent.retrieval.database.ivfpq_index import IVFPQIndex
+
+        self.ivfpq_index = IVFPQIndex(path, nprobe=nprobe)
+        self.ivfpq_rerank_factor = rerank_factor
+        missing = self.collection.count() - self.ivfpq_index.count
+        if missing > 0:
+            print(f"⚠️ 集合中有 {missing} 篇论文是在 IVF-PQ 索引构建之后写入的，需重新构建索引才能检索到")
+        print("ℹ️ IVF-PQ 索引的过滤列是构建时的快照，之后的元数据更新需重新构建索引才会用于过滤")
+        print(f"✅ IVF-PQ 检索已启用: nprobe={nprobe}, 精排倍数 {rerank_factor}")
+
+    def search_ivfpq(self, query_vector, top_k=5, n_results=None, filter_expression=None):
+        """IVF-PQ 检索，filter_expression 在索引的列式数组上过滤"""
+        n_results = n_results or top_k
+        hits = self.ivfpq_index.search(query_vector, n_results * self.ivfpq_rerank_factor,
+                                       filter_expression=filter_expression)
+        print(f"🧮 IVF-PQ 检索返回 {len(hits)} 个候选 (nprobe={self.ivfpq_index.nprobe})")
+        if self.ivfpq_rerank_factor > 1:
+            return self.search_candidates([doc_id for doc_id, _ in hits], query_vector, top_k, filter_expression)
+        if not hits:
+            return []
+        # 按当前元数据再次检查 where：索引构建后元数据被修改的论文不再满足条件时被排除
+        results = self.collection.get(ids=[doc_id for doc_id, _ in hits], where=filter_expression, include=["metadatas"])
+        metadatas = dict(zip(results["ids"], results["metadatas"]))
+        return [{"entity": metadatas[doc_id], "distance": 1.0 - score}
+                for doc_id, score in hits if doc_id in metadatas][:top_k]
+
+    def version(self):
+        """当前数据版本（文档数与持久化的写入代数），用于判断检索结果缓存是否过期；其他进程的写入同样可见"""
+        return (self.collection.count(), self.filter_stats.generation())
+
+    def insert_documents(self, documents, raise_errors=False):
+        """
+        批量写入文档（按内容生成的ID执行 upsert，重复导入不会产生重复数据），并将作者拆分到单独字段。
+        返回是否成功；raise_errors 为 True 时写入出错直接抛出原始异常（供重试与死信处理区分错误原因）。
+        """
         # 准备数据
         ids = []
-        documents_list = []
         embeddings = []
         metadatas = []
 
-        for i, doc in enumerate(documents):
-            unique_id = f"doc_{self.doc_count + i}"
+        # 同一批次中ID相同的论文只保留最后一条，否则 upsert 会因ID重复而失败
+        unique_docs = {}
+        for doc in documents:
+            unique_docs[make_doc_id(doc)] = doc
+
+        for unique_id, doc in unique_docs.items():
             ids.append(unique_id)
-            documents_list.append(f"{doc['title']} {doc['summary']}") # Document content remains the same
             embeddings.append(doc['vector'])
+            # 精简元数据：只写入实际存在的作者字段，摘要不再重复写入 documents
+            metadatas.append(build_metadata(doc, MAX_AUTHORS_PER_PAPER))
 
-            # Prepare metadata, including split authors
-            metadata = {
-                "title": doc["title"],
-                "summary": doc["summary"],
-                "authors": doc["authors"], # Keep the original string/list for display
-                "venue": doc["venue"],
-                "link": doc.get("link", ""), # <-- Use 'link' from source, store as 'link'
-                "published": doc["published"]
-            }
-
-            # Split authors and add author1, author2, ... fields
-            authors_list = []
-            if isinstance(doc["authors"], list):
-                 authors_list = doc["authors"]
-            elif isinstance(doc["authors"], str):
-                 # Simple split, adjust if delimiter is different or needs trimming
-                 authors_list = [a.strip() for a in doc["authors"].split(',') if a.strip()]
-
-            for j in range(MAX_AUTHORS_PER_PAPER):
-                author_field_name = f"author{j+1}"
-                if j < len(authors_list):
-                    metadata[author_field_name] = authors_list[j]
-                else:
-                    # Set remaining author fields to a default value (e.g., empty string or None)
-                    # Using empty string might be safer for filtering ($eq: "")
-                    metadata[author_field_name] = ""
-
-            metadatas.append(metadata)
-
-        # 批量插入
+        # 批量写入（已存在的ID会被覆盖）
         try:
-            self.collection.add(
+            self.collection.upsert(
                 ids=ids,
-                documents=documents_list, # Content for vector search
                 embeddings=embeddings,
                 metadatas=metadatas # Metadata including author1..N
             )
-            self.doc_count += len(documents)
-            print(f"✅ 成功插入 {len(documents)} 条数据 (含拆分作者字段)，当前总数: {self.doc_count}")
+            self.author_index.update_many(ids, [doc["authors"] for doc in unique_docs.values()])
+            self.filter_stats.update_many(ids, metadatas)
+            if self._open_binary_index() is not None:
+                self.binary_index.add(ids, embeddings)
+            self.doc_count = self.collection.count()
+            print(f"✅ 成功写入 {len(ids)} 条数据 (含拆分作者字段)，当前总数: {self.doc_count}")
+            return True
         except Exception as e:
             print(f"❌ 数据插入失败: {str(e)}")
+            if raise_errors:
+                raise
             # Consider logging the problematic batch/metadata for debugging
             # import traceback
             # traceback.print_exc()
+            return False
+
+
+    def get_metadatas(self, ids, batch_size=5000):
+        """读取已存在文档的元数据，返回 {文档ID: 元数据}（不存在的ID不出现在结果中）"""
+        existing = {}
+        for i in range(0, len(ids), batch_size):
+            results = self.collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+            existing.update(zip(results["ids"], results["metadatas"]))
+        return existing
+
+    def plan_upsert(self, documents):
+        """
+        将待写入的论文（尚未计算向量）按与集合中已有记录的差异分组。
+
+        Returns:
+            dict: {"embed": 新论文或标题/摘要变化、需要计算向量的论文,
+                   "metadata": 只有元数据（作者、期刊、年份、链接）变化的论文,
+                   "unchanged": 与已有记录完全相同、跳过的论文数}
+        """
+        unique_docs = {}
+        for doc in documents:
+            unique_docs[make_doc_id(doc)] = doc
+        return plan_changes(unique_docs, self.get_metadatas(list(unique_docs.keys())))
+
+    def update_metadata(self, documents, batch_size=5000):
+        """只更新论文的元数据，保留已有向量（论文必须已存在），返回是否成功"""
+        unique_docs = {}
+        for doc in documents:
+            unique_docs[make_doc_id(doc)] = doc
+        ids = list(unique_docs.keys())
+        try:
+            existing = self.get_metadatas(ids, batch_size)
+            ids = [doc_id for doc_id in ids if doc_id in existing]
+            metadatas = []
+            for doc_id in ids:
+                metadata = build_metadata(unique_docs[doc_id], MAX_AUTHORS_PER_PAPER)
+                # update 只覆盖给出的字段：作者变少时把多出的 authorN 置空，避免旧作者仍可被检索到
+                for key in existing[doc_id]:
+                    if key not in metadata:
+                        metadata[key] = ""
+                metadatas.append(metadata)
+            for i in range(0, len(ids), batch_size):
+                self.collection.update(ids=ids[i:i + batch_size], metadatas=metadatas[i:i + batch_size])
+            self.author_index.update_many(ids, [unique_docs[doc_id]["authors"] for doc_id in ids])
+            self.filter_stats.update_many(ids, metadatas)
+            print(f"✅ 成功更新 {len(ids)} 条元数据 (向量保持不变)")
+            return True
+        except Exception as e:
+            print(f"❌ 元数据更新失败: {str(e)}")
+            return False
+
+    def delete_documents(self, ids=None, where=None, batch_size=5000):
+        """
+        按文档ID或元数据条件删除论文，同时从作者索引和过滤统计中移除。
+
+        Args:
+            ids (list): 要删除的文档ID。
+            where (dict): ChromaDB 风格的 where 条件，删除所有满足条件的论文。
+
+        Returns:
+            int: 实际删除的论文数。
+        """
+        if where is not None:
+            matched = self.collection.get(where=where, include=[])["ids"]
+            ids = list(ids or []) + matched
+        if not ids:
+            return 0
+        ids = list(self.get_metadatas(list(dict.fromkeys(ids)), batch_size).keys())
+        if not ids:
+            return 0
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[i:i + batch_size])
+        # IVF-PQ 索引中残留的编码不影响结果：候选会在读取集合时被过滤
+        if self._open_binary_index() is not None:
+            self.binary_index.remove(ids)
+        self.author_index.remove_many(ids)
+        self.filter_stats.remove_many(ids)
+        self.doc_count = self.collection.count()
+        print(f"🗑️ 已删除 {len(ids)} 篇论文，当前总数: {self.doc_count}")
+        return len(ids)
+
+    # BaseDatabase 接口
+    def add(self, x):
+        return self.insert_documents(x)
 
+    def update(self, x):
+        """带向量的论文整条写入，不带向量的论文只更新元数据"""
+        with_vectors = [doc for doc in x if doc.get("vector") is not None]
+        without_vectors = [doc for doc in x if doc.get("vector") is None]
+        success = True
+        if with_vectors:
+            success = self.insert_documents(with_vectors) and success
+        if without_vectors:
+            success = self.update_metadata(without_vectors) and success
+        return success
+
+    def delete(self, x):
+        """x 为文档ID列表，或 where 条件字典"""
+        if isinstance(x, dict):
+            return self.delete_documents(where=x)
+        return self.delete_documents(ids=list(x))
+
+    def query(self, x):
+        return self.similarity_search(x)
+
+    def author_candidates(self, author):
+        """
+        从作者索引中查找作者的全部文档ID。
+
+        Returns:
+            list: 文档ID列表；索引尚未覆盖全部文档（旧集合尚未构建索引）时返回 None。
+        """
+        if not self.author_index.is_built() and self.collection.count() > 0:
+            print("⚠️ 作者索引未完整构建，请运行 --build-author-index 构建，本次使用 author1..authorN 过滤")
+            return None
+        return self.author_index.lookup(author)
+
+    def search_candidates(self, candidate_ids, query_vector=None, top_k=5, filter_expression=None, batch_size=5000):
+        """
+        在给定的候选文档中精确检索：读取候选文档的向量计算余弦距离并取 top_k；
+        未提供查询向量时按发表年份从新到旧排序。
+        """
+        ids, metadatas, embeddings = [], [], []
+        include = ["metadatas", "embeddings"] if query_vector is not None else ["metadatas"]
+        for i in range(0, len(candidate_ids), batch_size):
+            results = self.collection.get(ids=candidate_ids[i:i + batch_size], where=filter_expression, include=include)
+            ids.extend(results["ids"])
+            metadatas.extend(results["metadatas"])
+            if query_vector is not None:
+                embeddings.extend(results["embeddings"])
+        if not ids:
+            return []
+
+        if query_vector is None:
+            order = sorted(range(len(ids)), key=lambda i: str(metadatas[i].get("published", "")), reverse=True)[:top_k]
+            return [{"entity": metadatas[i], "distance": None} for i in order]
+        return self._score_exact(query_vector, embeddings, metadatas, top_k)
+
+    def _get_where_limited(self, filter_expression):
+        """
+        读取满足过滤条件的文档向量，最多 exact_search_threshold 篇。
+
+        Returns:
+            dict: collection.get 的结果；实际匹配数超过上限（估计偏低）时返回 None，由调用方改用 HNSW 索引。
+        """
+        results = self.collection.get(where=filter_expression, limit=self.exact_search_threshold + 1,
+                                      include=["metadatas", "embeddings"])
+        if len(results["ids"]) > self.exact_search_threshold:
+            print(f"⚠️ 过滤条件匹配超过 {self.exact_search_threshold} 篇，改用 HNSW 索引检索")
+            return None
+        return results
+
+    def search_where_exact(self, query_vector, top_k=5, filter_expression=None):
+        """
+        读取满足过滤条件的全部文档向量并精确计算余弦距离（用于选择度高的过滤条件）。
+        匹配数超过 exact_search_threshold 时返回 None。
+        """
+        results = self._get_where_limited(filter_expression)
+        if results is None:
+            return None
+        if not results["ids"]:
+            return []
+        return self._score_exact(query_vector, results["embeddings"], results["metadatas"], top_k)
+
+    def _score_exact(self, query_vector, embeddings, metadatas, top_k):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        query = np.asarray(query_vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+        distances = 1.0 - (matrix @ query) / np.maximum(norms, 1e-12)
+        order = np.argsort(distances, kind="stable")[:top_k]
+        return [{"entity": metadatas[i], "distance": float(distances[i])} for i in order]
+
+    def search_by_author(self, author, top_k=5, filter_expression=None):
+        """只按作者检索（不需要查询向量），结果按发表年份从新到旧排序"""
+        candidate_ids = self.author_candidates(author)
+        if candidate_ids is None:
+            where = author_where(author) if filter_expression is None else {"$and": [filter_expression, author_where(author)]}
+            results = self.collection.get(where=where, limit=top_k, include=["metadatas"])
+            return [{"entity": m, "distance": None} for m in results["metadatas"]]
+        print(f"👤 作者索引命中 {len(candidate_ids)} 篇论文: {author}")
+        return self.search_candidates(candidate_ids, None, top_k, filter_expression)
+
+    def plan_query(self, top_k, filter_expression):
+        """
+        根据过滤条件的估计匹配数选择查询计划。
+
+        Returns:
+            tuple: (计划, 估计匹配数, n_results)。计划为 "exact"（读取候选向量精确计算）或 "ann"（HNSW 索引）；
+            过滤条件越严格，ann 计划的 n_results 放大得越多，以免过滤后结果不足 top_k。
+        """
+        if not filter_expression:
+            return "ann", None, top_k
+        estimated = self.filter_stats.estimate(filter_expression)
+        if estimated is None:
+            return "ann", None, top_k
+        if estimated <= self.exact_search_threshold:
+            return "exact", estimated, top_k
+        selectivity = estimated / max(self.filter_stats.total, 1)
+        overfetch = 1 + (1 - selectivity) * (self.max_overfetch - 1)
+        return "ann", estimated, int(math.ceil(top_k * overfetch))
+
+    def search_binary(self, query_vector, top_k, n_results, filter_expression=None, estimated=None):
+        """
+        二值索引 Hamming 初筛后在候选中精排。
+
+        过滤条件在精排时才生效，满足条件的候选不足 top_k 时放大候选数重试，直到候选覆盖全部记录
+        或结果达到估计匹配数为止；放大到上限仍不足时返回 None，由调用方改用 HNSW 索引检索。
+        """
+        n_candidates = n_results * self.binary_rerank_factor
+        max_candidates = top_k * self.binary_rerank_factor * self.max_overfetch * 4
+        while True:
+            candidate_ids = self.binary_index.candidates(query_vector, n_candidates)
+            print(f"🔢 二值索引 Hamming 初筛 {len(candidate_ids)} 个候选，精排 Top K: {top_k}")
+            results = self.search_candidates(candidate_ids, query_vector, top_k, filter_expression)
+            if (len(results) >= top_k or not filter_expression or len(candidate_ids) < n_candidates
+                    or (estimated is not None and len(results) >= estimated)):
+                return results
+            if n_candidates >= max_candidates:
+                return None
+            n_candidates *= 2
+            print(f"⚠️ 过滤后只剩 {len(results)} 条结果，放大候选数至 {n_candidates} 重试")
+
+    def similarity_search(self, query_vector, top_k=5, filter_expression=None, author=None):
+        """相似性搜索，直接使用传入的 filter_expression 作为 where 条件；指定作者时在作者索引给出的候选文档中精确检索。"""
+        if author and author.strip():
+            candidate_ids = self.author_candidates(author)
+            if candidate_ids is not None:
+                print(f"👤 作者索引命中 {len(candidate_ids)} 篇论文，在候选文档中精确检索: {author}")
+                return self.search_candidates(candidate_ids, query_vector, top_k, filter_expression)
+            filter_expression = author_where(author) if filter_expression is None else {"$and": [filter_expression, author_where(author)]}
 
-    def similarity_search(self, query_vector, top_k=5, filter_expression=None):
-        """相似性搜索，直接使用传入的 filter_expression 作为 where 条件。"""
         # 注意：filter_expression 现在应该是一个 ChromaDB where document (字典)
         # 移除了之前的字符串解析逻辑
         where_conditions = filter_expression # Directly use the dictionary
@@ -125,40 +485,116 @@ class ChromaDatabase:
         print(f"[Debug DB] Received where_conditions for query: {where_conditions}")
 
         try:
+            plan, estimated, n_results = self.plan_query(top_k, where_conditions)
+            if not where_conditions:
+                print(f"🧭 查询计划: {plan} (无过滤条件, n_results={n_results})")
+            else:
+                estimated_text = "未知" if estimated is None else f"{estimated:.0f}/{self.filter_stats.total}"
+                print(f"🧭 查询计划: {plan} (过滤条件估计匹配 {estimated_text} 篇, n_results={n_results})")
+            if plan == "exact" and query_vector:
+                formatted_results = self.search_where_exact(query_vector, top_k, where_conditions)
+                if formatted_results is not None:
+                    return formatted_results
+                n_results = top_k * self.max_overfetch
+            if self.ivfpq_index is not None and query_vector:
+                return self.search_ivfpq(query_vector, top_k, n_results, where_conditions)
+            if self.binary_search and query_vector:
+                formatted_results = self.search_binary(query_vector, top_k, n_results, where_conditions, estimated)
+                if formatted_results is not None:
+                    return formatted_results
+                print("⚠️ 二值初筛的候选中满足过滤条件的结果不足，改用 HNSW 索引检索")
+
             # Execute DB search with the provided where clause
-            print(f"🔍 执行 ChromaDB 查询，Top K: {top_k}, DB Where: {where_conditions}")
-            results = self.collection.query(
-                query_embeddings=[query_vector] if query_vector else None,
-                n_results=top_k,
-                where=where_conditions, # Use the received dictionary directly
-                include=["metadatas", "distances"]
-            )
+            while True:
+                print(f"🔍 执行 ChromaDB 查询，Top K: {top_k}, n_results: {n_results}, DB Where: {where_conditions}")
+                results = self.collection.query(
+                    query_embeddings=[query_vector] if query_vector else None,
+                    n_results=n_results,
+                    where=where_conditions, # Use the received dictionary directly
+                    include=["metadatas", "distances"]
+                )
+                # Format results (no client-side filtering needed now)
+                formatted_results = self._format_query_results(results, 0)
+                # 过滤后结果不足 top_k 而估计匹配数足够时，放大 n_results 重试
+                if (len(formatted_results) >= top_k or estimated is None or len(formatted_results) >= estimated
+                        or n_results >= top_k * self.max_overfetch * 4):
+                    break
+                n_results *= 2
+                print(f"⚠️ 索引只返回 {len(formatted_results)} 条结果，放大 n_results 至 {n_results} 重试")
 
-            # Format results (no client-side filtering needed now)
-            formatted_results = []
-            if results and results["ids"] and results["ids"][0]:
-                for i in range(len(results["ids"][0])):
-                    if results["metadatas"] and len(results["metadatas"]) > 0 and results["metadatas"][0] and len(results["metadatas"][0]) > i:
-                        metadata = results["metadatas"][0][i]
-                        # Remove author1..N fields before returning to keep API clean? Optional.
-                        # entity = {k: v for k, v in metadata.items() if not k.startswith('author')}
-                        entity = metadata # Keep all metadata for now
-
-                        formatted_results.append({
-                            "entity": entity,
-                             # Handle case where distances might be None if query_embeddings wasn't provided/used effectively
-                            "distance": results["distances"][0][i] if results["distances"] and results["distances"][0] else None
-                        })
-                    else:
-                        print(f"⚠️ 警告：查询结果中缺少索引 {i} 的元数据。")
-            else:
+            if not formatted_results:
                  print("ℹ️ ChromaDB 查询未返回任何结果。")
 
-
-            return formatted_results
+            return formatted_results[:top_k]
 
         except Exception as e:
             print(f"❌ ChromaDB 搜索失败: {str(e)}")
             import traceback
             traceback.print_exc()
-            return []
\ No newline at end of file
+            return []
+
+    def similarity_search_many(self, query_vectors, top_k=5, filter_expression=None):
+        """
+        多个查询向量的相似性搜索，返回每个查询各自的结果列表。
+
+        与 similarity_search 使用相同的查询计划（所有查询共用同一过滤条件，只估计一次）：
+        exact 计划只读取一次满足条件的向量，ann 计划一次 collection.query 调用完成全部查询，
+        结果不足 top_k 的查询再单独按 similarity_search 放大 n_results 重试。
+        """
+        if not query_vectors:
+            return []
+        try:
+            plan, estimated, n_results = self.plan_query(top_k, filter_expression)
+            print(f"🧭 批量查询计划: {plan} (查询数 {len(query_vectors)}, n_results={n_results})")
+            if plan == "exact":
+                results = self._get_where_limited(filter_expression)
+                if results is not None:
+                    if not results["ids"]:
+                        return [[] for _ in query_vectors]
+                    return [self._score_exact(v, results["embeddings"], results["metadatas"], top_k) for v in query_vectors]
+                n_results = top_k * self.max_overfetch
+            if self.ivfpq_index is not None:
+                return [self.search_ivfpq(v, top_k, n_results, filter_expression) for v in query_vectors]
+            if self.binary_search:
+                # 与单条检索相同的候选放大与回退
+                return [self.similarity_search(v, top_k, filter_expression) for v in query_vectors]
+            print(f"🔍 执行 ChromaDB 批量查询，查询数: {len(query_vectors)}, Top K: {top_k}, n_results: {n_results}, "
+                  f"DB Where: {filter_expression}")
+            results = self.collection.query(
+                query_embeddings=list(query_vectors),
+                n_results=n_results,
+                where=filter_expression,
+                include=["metadatas", "distances"]
+            )
+            batch_results = []
+            for q, vector in enumerate(query_vectors):
+                formatted_results = self._format_query_results(results, q)
+                if len(formatted_results) < top_k and estimated is not None and len(formatted_results) < estimated:
+                    formatted_results = self.similarity_search(vector, top_k, filter_expression)
+                batch_results.append(formatted_results[:top_k])
+            return batch_results
+        except Exception as e:
+            print(f"❌ ChromaDB 批量搜索失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return [[] for _ in query_vectors]
+
+    def _format_query_results(self, results, query_index):
+        """将 collection.query 返回的第 query_index 个查询的结果整理为 [{"entity", "distance"}]"""
+        formatted_results = []
+        if not (results and results["ids"] and len(results["ids"]) > query_index):
+            return formatted_results
+        metadatas = (results.get("metadatas") or [])[query_index:query_index + 1]
+        distances = (results.get("distances") or [])[query_index:query_index + 1]
+        metadatas = metadatas[0] if metadatas else None
+        distances = distances[0] if distances else None
+        for i in range(len(results["ids"][query_index])):
+            if metadatas and len(metadatas) > i:
+                formatted_results.append({
+                    "entity": metadatas[i],
+                    # Handle case where distances might be None if query_embeddings wasn't provided/used effectively
+                    "distance": distances[i] if distances else None
+                })
+            else:
+                print(f"⚠️ 警告：查询结果中缺少索引 {i} 的元数据。")
+        return formatted_results
@@ -0,0 +1,483 @@
+# numpy_database.py - 基于 NumPy 内存映射的向量库后端（精确检索）
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from docagent.retrieval.database.author_index import normalize_author
+from docagent.retrieval.database.base import BaseDatabase
+from docagent.retrieval.database.chroma_merge import list_ids
+from docagent.retrieval.database.column_filter import ColumnFilter
+from docagent.retrieval.database.filter_stats import parse_year
+from docagent.retrieval.database.slim_schema import build_metadata, make_doc_id, split_authors
+
+
+class NumpyVectorDatabase(ColumnFilter, BaseDatabase):
+    """
+    基于 NumPy 内存映射文件的向量库，与 ChromaDatabase 提供相同的检索接口。
+
+    向量归一化后按行存入 float16/float32 矩阵文件，检索时分块做矩阵-向量乘法（余弦相似度），
+    得到精确的 top_k。年份、期刊、作者以列式数组保存，过滤条件转换为布尔掩码。
+    所有文件都通过内存映射读取，多个进程打开同一目录时共享操作系统的页缓存。
+
+    目录结构：
+        meta.json          维度、数据类型、已提交的记录数（写入完成后最后更新）
+        vectors.bin        归一化向量矩阵
+        years.bin          int32 年份（-1 表示未知）
+        venues.bin         int32 期刊编号，编号对应 venues.txt 的行
+        author_ptr.bin     int64，第 i 条记录的作者编号位于 authors.bin[ptr[i]:ptr[i+1]]
+        authors.bin        int32 作者编号，编号对应 author_names.txt 的行（规范化作者名）
+        deleted.bin        uint8 删除标记（更新同一ID时旧记录被标记删除）
+        records.jsonl      元数据（按行），record_ptr.bin 保存每条记录的字节偏移
+        ids.txt            文档ID（按行）
+
+    写入进程之间通过 write.lock 文件锁互斥；读取进程只映射已提交的记录、从不修改文件，
+    在数据变化后自动重新映射。
+
+    Args:
+        path (str): 向量库目录。
+        dim (int): 向量维度，新建向量库时必须提供。
+        dtype (str): 向量存储类型，float16 或 float32（仅新建时生效）。
+        block_rows (int): 分块计算时每块的行数。
+    """
+
+    def __init__(self, path, dim=None, dtype="float16", block_rows=65536):
+        self.path = path
+        self.block_rows = block_rows
+        os.makedirs(path, exist_ok=True)
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.RLock()
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if dim is not None and meta["dim"] != dim:
+                raise ValueError(f"向量库 {path} 的维度 {meta['dim']} 与当前维度 {dim} 不一致")
+        else:
+            if dim is None:
+                raise ValueError(f"向量库 {path} 不存在，新建时需要指定维度")
+            meta = {"dim": dim, "dtype": np.dtype(dtype).name, "count": 0, "venues": 0, "authors": 0, "generation": 0}
+            for name in ("author_ptr.bin", "record_ptr.bin"):
+                np.zeros(1, dtype="<i8").tofile(os.path.join(path, name))
+            self._save_meta(meta)
+        super().__init__(path, meta["dim"])
+        self.dim = meta["dim"]
+        self.embedding_dtype = np.dtype(meta["dtype"])
+        self._meta_mtime = None
+        # 两阶段检索的低维索引（enable_two_stage 启用）
+        self.reduced_index = None
+        self._load()
+        print(f"✅ NumPy 向量库 {path} 已加载 {self.count} 条记录 (维度 {self.dim}, {self.embedding_dtype.name})")
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save_meta(self, meta):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _truncate(self, name, size):
+        file_path = self._file(name)
+        if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+            with open(file_path, 'r+b') as f:
+                f.truncate(size)
+
+    def _read_lines(self, name, total):
+        """从上次读到的位置继续读取文本文件，直到已读取 total 行（只读，不修改文件）"""
+        file_path = self._file(name)
+        lines = []
+        if total <= self._lines[name] or not os.path.exists(file_path):
+            return lines
+        with open(file_path, 'rb') as f:
+            f.seek(self._offsets[name])
+            for _ in range(total - self._lines[name]):
+                line = f.readline()
+                self._offsets[name] += len(line)
+                lines.append(line.decode("utf-8").rstrip("\n"))
+        self._lines[name] = total
+        return lines
+
+    def _map(self, name, dtype, shape, mode="r"):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode=mode, shape=shape)
+
+    def _reset_state(self):
+        self.count = 0
+        self._ids, self._rows, self._stale = [], {}, []
+        self._venue_names, self._venue_codes, self._author_codes = [], {}, {}
+        # 各文本文件已读取的字节数与行数（写入进程的 _code 会先在内存中登记新取值）
+        self._offsets = {"ids.txt": 0, "venues.txt": 0, "author_names.txt": 0}
+        self._lines = dict.fromkeys(self._offsets, 0)
+
+    def _load(self):
+        """
+        按 meta.json 中已提交的记录数映射各文件。
+
+        只读取，不修改任何文件：写入进程追加但尚未提交的尾部由写入进程在持有写锁时修复。
+        记录数只增加时只读取新增的ID和词表行，各数组重新映射（内存映射本身不读取数据）。
+        """
+        with self._lock:
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self._meta_mtime = os.stat(self._meta_path).st_mtime_ns
+            if not hasattr(self, "_ids") or meta["count"] < self.count:
+                self._reset_state()
+            self.meta = meta
+
+            for doc_id in self._read_lines("ids.txt", meta["count"]):
+                row = len(self._ids)
+                self._ids.append(doc_id)
+                # 同一ID出现多次时只保留最后一条，旧记录由写入进程标记删除
+                if doc_id in self._rows:
+                    self._stale.append(self._rows[doc_id])
+                self._rows[doc_id] = row
+            for name in self._read_lines("venues.txt", meta["venues"]):
+                self._venue_codes.setdefault(name, len(self._venue_names))
+                self._venue_names.append(name)
+            for name in self._read_lines("author_names.txt", meta["authors"]):
+                self._author_codes.setdefault(name, len(self._author_codes))
+            self.count = meta["count"]
+            self._map_arrays()
+
+    def _map_arrays(self):
+        count = self.count
+        self._author_ptr = self._map("author_ptr.bin", "<i8", (count + 1,))
+        self._record_ptr = self._map("record_ptr.bin", "<i8", (count + 1,))
+        self._vectors = self._map("vectors.bin", self.embedding_dtype, (count, self.dim))
+        self._years = self._map("years.bin", "<i4", (count,))
+        self._venues = self._map("venues.bin", "<i4", (count,))
+        self._deleted = self._map("deleted.bin", np.uint8, (count,))
+        self._authors = self._map("authors.bin", "<i4", (int(self._author_ptr[-1]),))
+        self._stale = [row for row in self._stale if not self._deleted[row]]
+        if self._stale:
+            # 写入进程尚未标记删除的旧记录，在内存中的副本上屏蔽
+            self._deleted = np.array(self._deleted)
+            self._deleted[self._stale] = 1
+
+    def _reload(self):
+        """丢弃内存中的状态，按已提交的数据重新加载"""
+        with self._lock:
+            self._reset_state()
+            self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        """写入进程的排他文件锁：持有期间加载最新提交的数据，并修复中断写入留下的尾部"""
+        with self._lock:
+            with open(self._file("write.lock"), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    self._repair()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _repair(self):
+        """截断未提交的尾部，并把同一ID的旧记录标记为删除（只在持有写锁时调用）"""
+        count = self.count
+        for name, size in (("vectors.bin", count * self.dim * self.embedding_dtype.itemsize),
+                           ("years.bin", count * 4), ("venues.bin", count * 4), ("deleted.bin", count),
+                           ("author_ptr.bin", (count + 1) * 8), ("record_ptr.bin", (count + 1) * 8),
+                           ("authors.bin", int(self._author_ptr[-1]) * 4), ("records.jsonl", int(self._record_ptr[-1]))):
+            self._truncate(name, size)
+        for name, size in self._offsets.items():
+            self._truncate(name, size)
+        if self._stale:
+            self._mark_deleted(self._stale)
+            self._stale = []
+            self._map_arrays()
+
+    def refresh(self):
+        """其他进程写入新数据后重新映射"""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._meta_mtime:
+            self._load()
+
+    def version(self):
+        """当前数据版本（记录数与写入次数），用于判断检索结果缓存是否过期"""
+        self.refresh()
+        return (self.count, self.meta["generation"])
+
+    # ---------- 写入 ----------
+
+    def _code(self, codes, value, file_name):
+        """返回取值的编号，新取值追加到词表文件（提交前中断时由下次写入截断）"""
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+            with open(self._file(file_name), 'a', encoding='utf-8') as f:
+                f.write(value.replace("\n", " ") + "\n")
+        return code
+
+    def add_rows(self, ids, vectors, metadatas):
+        """追加一批记录（已存在的ID会把旧记录标记为删除），全部写入后才提交记录数"""
+        with self._write_lock():
+            try:
+                self._append(ids, vectors, metadatas)
+            except Exception:
+                # 恢复到最后一次提交的状态，未提交的尾部在下次写入时被截断
+                self._reload()
+                raise
+
+    def _append(self, ids, vectors, metadatas):
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.maximum(norms, 1e-12)
+
+        years, venues, author_codes, author_ptr = [], [], [], []
+        records, record_ptr = [], []
+        author_total = int(self._author_ptr[-1])
+        record_total = int(self._record_ptr[-1])
+        for metadata in metadatas:
+            years.append(parse_year(metadata.get("published")))
+            venues.append(self._code(self._venue_codes, str(metadata.get("venue", "")), "venues.txt"))
+            codes = {self._code(self._author_codes, normalize_author(a), "author_names.txt")
+                     for a in split_authors(metadata.get("authors", ""))}
+            author_codes.extend(sorted(codes))
+            author_total += len(codes)
+            author_ptr.append(author_total)
+            line = (json.dumps(metadata, ensure_ascii=False) + "\n").encode("utf-8")
+            records.append(line)
+            record_total += len(line)
+            record_ptr.append(record_total)
+
+        replaced = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        with open(self._file("vectors.bin"), 'ab') as f:
+            matrix.astype(self.embedding_dtype).tofile(f)
+        for name, values, dtype in (("years.bin", years, "<i4"), ("venues.bin", venues, "<i4"),
+                                    ("authors.bin", author_codes, "<i4"), ("author_ptr.bin", author_ptr, "<i8"),
+                                    ("record_ptr.bin", record_ptr, "<i8"), ("deleted.bin", [0] * len(ids), np.uint8)):
+            with open(self._file(name), 'ab') as f:
+                np.asarray(values, dtype=dtype).tofile(f)
+        with open(self._file("records.jsonl"), 'ab') as f:
+            f.write(b"".join(records))
+        with open(self._file("ids.txt"), 'a', encoding='utf-8') as f:
+            f.write("".join(f"{doc_id}\n" for doc_id in ids))
+
+        meta = dict(self.meta)
+        meta["count"] = self.count + len(ids)
+        meta["venues"] = len(self._venue_codes)
+        meta["authors"] = len(self._author_codes)
+        meta["generation"] = meta.get("generation", 0) + 1
+        self._save_meta(meta)
+        # 新记录提交后再把同一ID的旧记录标记为删除（中断时由下次写入的 _repair 补做）
+        self._mark_deleted(replaced)
+        self._load()  # 只读取本批新增的行
+
+    def _mark_deleted(self, rows):
+        if not rows:
+            return
+        with open(self._file("deleted.bin"), 'r+b') as f:
+            for row in rows:
+                f.seek(row)
+                f.write(b"\x01")
+
+    def insert_documents(self, documents, raise_errors=False):
+        """批量写入文档（与 ChromaDatabase.insert_documents 相同的输入格式），返回是否成功；raise_errors 为 True 时抛出原始异常"""
+        try:
+            unique_docs = {}
+            for doc in documents:
+                unique_docs[make_doc_id(doc)] = doc
+            self.add_rows(list(unique_docs.keys()), [doc["vector"] for doc in unique_docs.values()],
+                          [build_metadata(doc) for doc in unique_docs.values()])
+            print(f"✅ 成功写入 {len(unique_docs)} 条数据，当前总数: {self.count}")
+            return True
+        except Exception as e:
+            print(f"❌ 数据插入失败: {str(e)}")
+            if raise_errors:
+                raise
+            return False
+
+    def delete_ids(self, ids):
+        """按文档ID删除（标记删除，不回收空间）"""
+        with self._write_lock():
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+            if rows:
+                self._mark_deleted(rows)
+                meta = dict(self.meta)
+                meta["generation"] = meta.get("generation", 0) + 1
+                self._save_meta(meta)
+                self._load()
+            return len(rows)
+
+    # BaseDatabase 接口
+    def add(self, x):
+        return self.insert_documents(x)
+
+    def update(self, x):
+        return self.insert_documents(x)
+
+    def delete(self, x):
+        return self.delete_ids(x)
+
+    def query(self, x):
+        return self.similarity_search(x)
+
+    # ---------- 过滤 ----------
+
+    def _candidate_mask(self, filter_expression=None, author=None):
+        mask = self.where_mask(filter_expression) & (self._deleted == 0)
+        if author and author.strip():
+            mask &= self._author_mask(author)
+        return mask
+
+    # ---------- 检索 ----------
+
+    def _top_k(self, queries, top_k, mask, vectors=None):
+        """
+        分块计算 queries（m × dim）与候选向量的余弦相似度，返回每个查询的 (行号数组, 相似度数组)。
+        候选较少时只读取候选行，否则按连续块扫描全部向量并屏蔽不满足条件的行。
+        vectors 默认为全维向量矩阵，两阶段检索时传入低维向量矩阵。
+        """
+        vectors = self._vectors if vectors is None else vectors
+        count = len(vectors)
+        m = len(queries)
+        best_rows = np.empty((m, 0), dtype=np.int64)
+        best_scores = np.empty((m, 0), dtype=np.float32)
+        candidates = np.flatnonzero(mask)
+        sparse = len(candidates) < count // 2
+        total = len(candidates) if sparse else count
+        for start in range(0, total, self.block_rows):
+            if sparse:
+                rows = candidates[start:start + self.block_rows]
+                block = np.asarray(vectors[rows], dtype=np.float32)
+            else:
+                rows = np.arange(start, min(start + self.block_rows, count))
+                block = np.asarray(vectors[start:start + len(rows)], dtype=np.float32)
+            scores = queries @ block.T
+            if not sparse:
+                scores[:, ~mask[rows]] = -np.inf
+            rows = np.broadcast_to(rows, scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > top_k:
+                keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+
+        results = []
+        for q in range(m):
+            order = np.argsort(-best_scores[q], kind="stable")
+            order = order[np.isfinite(best_scores[q][order])]
+            results.append((best_rows[q][order], best_scores[q][order]))
+        return results
+
+    def enable_two_stage(self, reduced_dim, method="pca", rerank_factor=10):
+        """
+        启用两阶段检索：低维投影生成候选，全维向量精排（见 ReducedIndex）。
+
+        低维索引不存在时会先拟合投影并投影全部记录。
+        """
+        from docagent.retrieval.database.reduced_index import ReducedIndex
+
+        with self._lock:
+            self.refresh()
+            index = ReducedIndex(self, reduced_dim, method=method, rerank_factor=rerank_factor)
+            if index.count == 0:
+                index.build()
+            self.reduced_index = index
+            print(f"✅ 两阶段检索已启用: {method} {reduced_dim} 维初筛，精排 Top K × {rerank_factor} 个候选 "
+                  f"(已投影 {index.count}/{self.count} 条)")
+
+    def _search(self, queries, top_k, mask):
+        """候选足够多时使用两阶段检索，否则精确检索"""
+        if self.reduced_index is not None and int(mask.sum()) > top_k * self.reduced_index.rerank_factor:
+            return self.reduced_index.search(queries, top_k, mask), "两阶段"
+        return self._top_k(queries, top_k, mask), "精确"
+
+    def _records(self, rows):
+        """读取指定行的元数据"""
+        entities = []
+        with open(self._file("records.jsonl"), 'rb') as f:
+            for row in rows:
+                start, end = int(self._record_ptr[row]), int(self._record_ptr[row + 1])
+                f.seek(start)
+                entities.append(json.loads(f.read(end - start).decode("utf-8")))
+        return entities
+
+    def _format(self, rows, scores):
+        return [{"entity": entity, "distance": float(1.0 - score)} for entity, score in zip(self._records(rows), scores)]
+
+    def _prepare_queries(self, query_vectors):
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        return queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    def similarity_search(self, query_vector, top_k=5, filter_expression=None, author=None):
+        """相似性搜索（启用两阶段检索时先低维初筛），filter_expression 为 ChromaDB 风格的 where 条件"""
+        try:
+            with self._lock:
+                self.refresh()
+                if not self.count:
+                    return []
+                start_time = time.perf_counter()
+                mask = self._candidate_mask(filter_expression, author)
+                results, plan = self._search(self._prepare_queries([query_vector]), top_k, mask)
+                rows, scores = results[0]
+                print(f"🔍 NumPy {plan}检索: 候选 {int(mask.sum())}/{self.count} 条, Top K: {top_k}, "
+                      f"用时 {(time.perf_counter() - start_time) * 1000:.1f} ms")
+                return self._format(rows, scores)
+        except Exception as e:
+            print(f"❌ NumPy 向量库搜索失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return []
+
+    def similarity_search_many(self, query_vectors, top_k=5, filter_expression=None):
+        """多个查询向量一次扫描完成检索，返回每个查询各自的结果列表"""
+        if not query_vectors:
+            return []
+        try:
+            with self._lock:
+                self.refresh()
+                if not self.count:
+                    return [[] for _ in query_vectors]
+                mask = self._candidate_mask(filter_expression)
+                results, _ = self._search(self._prepare_queries(query_vectors), top_k, mask)
+                return [self._format(rows, scores) for rows, scores in results]
+        except Exception as e:
+            print(f"❌ NumPy 向量库批量搜索失败: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return [[] for _ in query_vectors]
+
+    def search_by_author(self, author, top_k=5, filter_expression=None):
+        """只按作者检索，结果按发表年份从新到旧排序"""
+        with self._lock:
+            self.refresh()
+            if not self.count:
+                return []
+            rows = np.flatnonzero(self._candidate_mask(filter_expression, author))
+            rows = rows[np.argsort(-self._years[rows], kind="stable")][:top_k]
+            return [{"entity": entity, "distance": None} for entity in self._records(rows)]
+
+
+def export_collection(collection, path, dtype="float16", batch_size=5000):
+    """
+    将 ChromaDB 集合导出为 NumPy 向量库（按排序后的文档ID分批读取）。
+
+    Returns:
+        NumpyVectorDatabase: 导出后的向量库。
+    """
+    ids = list_ids(collection)
+    database = None
+    start_time = time.time()
+    for i in range(0, len(ids), batch_size):
+        results = collection.get(ids=ids[i:i + batch_size], include=["embeddings", "metadatas"])
+        if database is None:
+            database = NumpyVectorDatabase(path, dim=len(results["embeddings"][0]), dtype=dtype)
+        database.add_rows(results["ids"], results["embeddings"], results["metadatas"])
+        print(f"✅ 已导出 {min(i + batch_size, len(ids))}/{len(ids)} 条记录")
+    print(f"✅ 导出完成，共 {len(ids)} 条记录，用时 {time.time() - start_time:.2f} 秒")
+    return database
@@ -0,0 +1,194 @@
+# reduced_index.py - 两阶段检索：低维投影生成候选，全维向量精排
+import json
+import os
+import time
+
+import numpy as np
+
+
+def fit_projection(vectors, reduced_dim, method="pca"):
+    """
+    根据样本向量拟合降维投影。
+
+    Args:
+        vectors (np.ndarray): 样本向量（n × dim，已归一化）。
+        reduced_dim (int): 降维后的维度。
+        method (str): "pca" 使用样本协方差的前 reduced_dim 个主成分；
+            "truncate" 直接截取前 reduced_dim 维（Matryoshka 式截断，适用于按该方式训练的模型）。
+
+    Returns:
+        tuple: (mean, components)，投影为 (x - mean) @ components.T。
+    """
+    dim = vectors.shape[1]
+    if reduced_dim >= dim:
+        raise ValueError(f"降维后的维度 {reduced_dim} 必须小于原始维度 {dim}")
+    if method == "truncate":
+        return np.zeros(dim, dtype=np.float32), np.eye(dim, dtype=np.float32)[:reduced_dim]
+    if method != "pca":
+        raise ValueError(f"未知的降维方法: {method}")
+    vectors = np.asarray(vectors, dtype=np.float64)
+    mean = vectors.mean(axis=0)
+    centered = vectors - mean
+    # dim × dim 协方差矩阵的特征分解，比对 n × dim 样本做 SVD 更省内存
+    eigenvalues, eigenvectors = np.linalg.eigh(centered.T @ centered / max(len(vectors) - 1, 1))
+    order = np.argsort(eigenvalues)[::-1][:reduced_dim]
+    explained = eigenvalues[order].sum() / max(eigenvalues.sum(), 1e-12)
+    print(f"📐 PCA 投影 {dim} -> {reduced_dim} 维，保留方差 {explained:.1%}")
+    return mean.astype(np.float32), eigenvectors[:, order].T.astype(np.float32)
+
+
+def project(vectors, mean, components):
+    """投影到低维空间并归一化"""
+    reduced = (np.asarray(vectors, dtype=np.float32) - mean) @ components.T
+    return reduced / np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+
+
+class ReducedIndex:
+    """
+    NumpyVectorDatabase 的低维候选索引。
+
+    第一阶段在 reduced_dim 维的投影上检索 top_k × rerank_factor 个候选，
+    第二阶段读取候选的全维向量精确计算余弦相似度并取 top_k。
+    投影与低维向量保存在向量库目录下的 reduced_<method>_<dim>/ 中，随向量库一样通过内存映射读取；
+    构建之后新写入的记录尚未投影时，直接用全维向量精确计算并与候选合并，保证不会漏检。
+
+    Args:
+        database (NumpyVectorDatabase): 全维向量库。
+        reduced_dim (int): 降维后的维度。
+        method (str): "pca" 或 "truncate"。
+        rerank_factor (int): 第一阶段候选数相对 top_k 的倍数。
+        sample_size (int): 拟合 PCA 时抽样的记录数。
+    """
+
+    def __init__(self, database, reduced_dim, method="pca", rerank_factor=10, sample_size=20000):
+        self.database = database
+        self.reduced_dim = reduced_dim
+        self.method = method
+        self.rerank_factor = rerank_factor
+        self.sample_size = sample_size
+        self.path = database._file(f"reduced_{method}_{reduced_dim}")
+        os.makedirs(self.path, exist_ok=True)
+        self.count = 0
+        self._reduced = np.zeros((0, reduced_dim), dtype=np.float16)
+        projection_path = os.path.join(self.path, "projection.npz")
+        if os.path.exists(projection_path):
+            projection = np.load(projection_path)
+            self.mean, self.components = projection["mean"], projection["components"]
+            self._load()
+        else:
+            self.mean, self.components = self._fit()
+            np.savez(projection_path, mean=self.mean, components=self.components)
+
+    def _fit(self):
+        database = self.database
+        rows = np.flatnonzero(database._deleted == 0)
+        if not len(rows):
+            raise ValueError(f"向量库 {database.path} 为空，无法拟合投影")
+        rng = np.random.default_rng(0)
+        if len(rows) > self.sample_size:
+            rows = np.sort(rng.choice(rows, self.sample_size, replace=False))
+        return fit_projection(np.asarray(database._vectors[rows], dtype=np.float32), self.reduced_dim, self.method)
+
+    def _load(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.count = json.load(f)["count"]
+        vectors_path = os.path.join(self.path, "reduced.bin")
+        if self.count and os.path.getsize(vectors_path) >= self.count * self.reduced_dim * 2:
+            self._reduced = np.memmap(vectors_path, dtype=np.float16, mode="r", shape=(self.count, self.reduced_dim))
+        else:
+            self.count = 0
+
+    def build(self, batch_size=65536):
+        """为尚未投影的记录计算低维向量并追加写入（只应由一个进程执行）"""
+        database = self.database
+        database.refresh()
+        start_time = time.time()
+        vectors_path = os.path.join(self.path, "reduced.bin")
+        if os.path.exists(vectors_path):
+            with open(vectors_path, 'r+b') as f:
+                f.truncate(self.count * self.reduced_dim * 2)
+        with open(vectors_path, 'ab') as f:
+            for start in range(self.count, database.count, batch_size):
+                block = np.asarray(database._vectors[start:min(start + batch_size, database.count)], dtype=np.float32)
+                project(block, self.mean, self.components).astype(np.float16).tofile(f)
+        added = database.count - self.count
+        with open(os.path.join(self.path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({"count": database.count, "method": self.method, "reduced_dim": self.reduced_dim}, f)
+        self._load()
+        print(f"✅ 低维索引 {os.path.basename(self.path)} 已投影 {added} 条新记录 (共 {self.count} 条)，"
+              f"用时 {time.time() - start_time:.2f} 秒")
+
+    def search(self, queries, top_k, mask):
+        """
+        两阶段检索，queries 为归一化的全维查询向量（m × dim），mask 为候选掩码。
+
+        Returns:
+            list: 每个查询的 (行号数组, 相似度数组)，与 NumpyVectorDatabase._top_k 的返回格式相同。
+        """
+        database = self.database
+        indexed = min(self.count, database.count)
+        candidates = database._top_k(project(queries, self.mean, self.components),
+                                     top_k * self.rerank_factor, mask[:indexed], vectors=self._reduced[:indexed])
+        # 尚未投影的新记录全部参与精排
+        tail = np.flatnonzero(mask[indexed:]) + indexed
+        results = []
+        for query, (rows, _) in zip(queries, candidates):
+            rows = np.sort(np.concatenate([rows, tail]))
+            scores = np.asarray(database._vectors[rows], dtype=np.float32) @ query
+            order = np.argsort(-scores, kind="stable")[:top_k]
+            results.append((rows[order], scores[order]))
+        return results
+
+
+def benchmark_reduced_dims(database, dims=(64, 128, 256, 512), method="pca", num_queries=100, top_k=10,
+                           rerank_factor=10, seed=0):
+    """
+    在向量库自身的数据上对比两阶段检索与精确检索：每个维度的 recall@k 与单次查询延迟。
+
+    查询为随机抽取的库内论文向量，检索时排除论文自身。各维度的低维索引会被构建并保存，
+    选定维度后可直接使用。
+
+    Returns:
+        list: 每个维度一项 {"dim", "recall", "mean_ms", "p95_ms"}，第一项为精确检索（dim 为全维）。
+    """
+    database.refresh()
+    rows = np.flatnonzero(database._deleted == 0)
+    if not len(rows):
+        print("⚠️ 向量库为空，无法测试")
+        return []
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(rows, min(num_queries, len(rows)), replace=False))
+    queries = database._prepare_queries(np.asarray(database._vectors[sample], dtype=np.float32))
+    base_mask = database._deleted == 0
+
+    def run(search):
+        found, timings = [], []
+        for row, query in zip(sample, queries):
+            mask = base_mask.copy()
+            mask[row] = False
+            start = time.perf_counter()
+            result_rows, _ = search(query[None, :], top_k, mask)[0]
+            timings.append((time.perf_counter() - start) * 1000)
+            found.append(set(result_rows.tolist()))
+        timings.sort()
+        return found, sum(timings) / len(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+    exact, exact_mean, exact_p95 = run(database._top_k)
+    report = [{"dim": database.dim, "recall": 1.0, "mean_ms": exact_mean, "p95_ms": exact_p95}]
+    for dim in dims:
+        if dim >= database.dim:
+            continue
+        index = ReducedIndex(database, dim, method=method, rerank_factor=rerank_factor)
+        index.build()
+        found, mean_ms, p95_ms = run(index.search)
+        recall = sum(len(a & b) / max(len(b), 1) for a, b in zip(found, exact)) / len(exact)
+        report.append({"dim": dim, "recall": recall, "mean_ms": mean_ms, "p95_ms": p95_ms})
+
+    print(f"📊 两阶段检索测试 ({method}, {len(sample)} 个查询, Top K: {top_k}, 精排倍数: {rerank_factor})")
+    for item in report:
+        label = "精确检索" if item["dim"] == database.dim else f"{item['dim']} 维初筛"
+        print(f"   {label:<10} recall@{top_k}: {item['recall']:.3f}  平均 {item['mean_ms']:.1f} ms  "
+              f"p95 {item['p95_ms']:.1f} ms  加速 {exact_mean / max(item['mean_ms'], 1e-9):.1f}x")
+    return report
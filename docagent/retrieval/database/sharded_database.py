@@ -0,0 +1,135 @@
+# sharded_database.py - 分片检索：并行查询多个分片集合，用堆合并各分片的 top_k
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docagent.retrieval.database.milvus_database import ChromaDatabase, CHROMA_PERSIST_DIRECTORY
+
+
+def parse_shard_spec(spec, default_directory=CHROMA_PERSIST_DIRECTORY):
+    """
+    解析分片描述，返回 (ChromaDB 目录, 集合名称)。
+
+    支持三种写法：
+        papers0520_dp0             默认目录中的集合
+        /data/shard0:papers0520    指定目录中的集合
+        /data/shard0               指定目录中唯一的集合
+    """
+    spec = spec.strip()
+    if os.path.isdir(spec):
+        return spec, None
+    if ":" in spec:
+        directory, name = spec.rsplit(":", 1)
+        return directory, name
+    return default_directory, spec
+
+
+def open_shards(specs, dim, **kwargs):
+    """按分片描述打开各分片的 ChromaDatabase（目录中只有一个集合时可省略集合名称）"""
+    import chromadb
+
+    shards = []
+    for spec in specs:
+        directory, name = parse_shard_spec(spec)
+        if name is None:
+            names = [c if isinstance(c, str) else c.name for c in chromadb.PersistentClient(path=directory).list_collections()]
+            if len(names) != 1:
+                raise ValueError(f"分片目录 {directory} 中有 {len(names)} 个集合，请用 目录:集合名 指定")
+            name = names[0]
+        print(f"🧩 打开分片: {directory} / {name}")
+        shards.append(ChromaDatabase(collection_name=name, dim=dim, persist_directory=directory, **kwargs))
+    return shards
+
+
+def _by_distance(result):
+    return result["distance"] if result["distance"] is not None else float("inf")
+
+
+def _by_published_desc(result):
+    """按发表时间从新到旧排序的键（与按字符串逆序一致），缺少发表时间的结果排在最后"""
+    published = result["entity"].get("published")
+    text = "" if published is None else str(published)
+    # 末尾的 0 大于任何取负的字符，使较短的前缀排在以它开头的较长字符串之后
+    return (text == "", tuple(-ord(ch) for ch in text) + (0,))
+
+
+class ShardedDatabase:
+    """
+    由多个分片组成的只读检索后端，与 ChromaDatabase 提供相同的检索接口。
+
+    每次查询以相同的查询向量和 where 条件并行检索全部分片（每个分片各自使用作者索引、查询计划等），
+    各分片返回按距离排好序的 top_k，再用堆归并取全局 top_k。分片可以单独构建、重建和替换，
+    查询延迟取决于最大的分片而不是总文档数。
+    本类不提供写入接口：导入时直接写入各分片集合（如数据并行导入的 papers0520_dp{rank}）。
+
+    Args:
+        shards (list): 各分片的数据库对象（如 ChromaDatabase）。
+        max_workers (int): 并行查询的线程数，默认与分片数相同。
+    """
+
+    def __init__(self, shards, max_workers=None):
+        if not shards:
+            raise ValueError("至少需要一个分片")
+        self.shards = shards
+        self.dim = shards[0].dim
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(shards), thread_name_prefix="shard")
+        counts = [shard.collection.count() for shard in shards]
+        for shard, count in zip(shards, counts):
+            if not count:
+                print(f"⚠️ 分片 {shard.persist_directory} / {shard.collection_name} 中没有文档")
+        print(f"📊 共 {len(shards)} 个分片，{sum(counts)} 篇论文")
+
+    def shards_for(self, filter_expression):
+        """需要查询的分片（子类可根据过滤条件裁剪）"""
+        return self.shards
+
+    def _scatter(self, fn, shards):
+        """在每个分片上并行执行 fn(shard)，返回各分片的结果与最慢分片的用时"""
+        def timed(shard):
+            start = time.perf_counter()
+            result = fn(shard)
+            return result, (time.perf_counter() - start) * 1000
+
+        outputs = list(self._executor.map(timed, shards))
+        return [result for result, _ in outputs], max((elapsed for _, elapsed in outputs), default=0.0)
+
+    @staticmethod
+    def _gather(per_shard, top_k, key):
+        """各分片结果已按 key 排序，堆归并后取前 top_k 条"""
+        return list(itertools.islice(heapq.merge(*per_shard, key=key), top_k))
+
+    def version(self):
+        """各分片数据版本的组合，任一分片变化时检索结果缓存失效"""
+        return tuple(shard.version() for shard in self.shards)
+
+    def similarity_search(self, query_vector, top_k=5, filter_expression=None, author=None):
+        start = time.perf_counter()
+        shards = self.shards_for(filter_expression)
+        per_shard, slowest = self._scatter(
+            lambda shard: shard.similarity_search(query_vector, top_k=top_k, filter_expression=filter_expression, author=author),
+            shards)
+        results = self._gather(per_shard, top_k, _by_distance)
+        print(f"🧩 分片检索: {len(shards)} 个分片，最慢分片 {slowest:.1f} ms，"
+              f"合并后共 {(time.perf_counter() - start) * 1000:.1f} ms")
+        return results
+
+    def similarity_search_many(self, query_vectors, top_k=5, filter_expression=None):
+        if not query_vectors:
+            return []
+        per_shard, _ = self._scatter(
+            lambda shard: shard.similarity_search_many(query_vectors, top_k=top_k, filter_expression=filter_expression),
+            self.shards_for(filter_expression))
+        return [self._gather([results[q] for results in per_shard], top_k, _by_distance) for q in range(len(query_vectors))]
+
+    def search_by_author(self, author, top_k=5, filter_expression=None):
+        per_shard, _ = self._scatter(
+            lambda shard: shard.search_by_author(author, top_k=top_k, filter_expression=filter_expression),
+            self.shards_for(filter_expression))
+        # 作者索引不可用时分片返回的结果未排序，先按发表时间从新到旧排序
+        per_shard = [sorted(results, key=_by_published_desc) for results in per_shard]
+        return self._gather(per_shard, top_k, _by_published_desc)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
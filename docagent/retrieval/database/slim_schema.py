@@ -0,0 +1,238 @@
+# slim_schema.py - 精简的论文元数据结构，以及将旧集合改写为精简结构的迁移工具
+import hashlib
+import json
+import os
+import random
+import re
+import time
+
+from docagent.retrieval.database.chroma_merge import list_ids, missing_ids
+
+# 旧结构中为每篇论文补齐的 author1..author50 字段
+_AUTHOR_FIELD = re.compile(r"^author\d+$")
+
+
+def make_doc_id(doc):
+    """根据论文内容生成稳定的文档ID，重复导入同一篇论文得到相同的ID"""
+    if doc.get("doc_id"):
+        return str(doc["doc_id"])
+    link = str(doc.get("link") or "").strip()
+    if link:
+        key = f"link:{link}"
+    else:
+        # 没有链接时使用标题、作者和年份标识论文（忽略大小写与多余空白）
+        parts = [" ".join(str(doc.get(field) or "").lower().split()) for field in ("title", "authors", "published")]
+        key = "paper:" + "\x1f".join(parts)
+    return "doc_" + hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def content_hash(doc):
+    """标题与摘要（即嵌入的输入）的哈希，用于判断论文更新时是否需要重新计算向量"""
+    text = f"{doc.get('title') or ''}\x1f{doc.get('summary') or ''}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def split_authors(authors):
+    """将作者字段（列表或逗号分隔的字符串）拆分为作者列表"""
+    if isinstance(authors, list):
+        return [str(a).strip() for a in authors if str(a).strip()]
+    if isinstance(authors, str):
+        return [a.strip() for a in authors.split(',') if a.strip()]
+    return []
+
+
+def build_metadata(doc, max_authors=50):
+    """
+    生成论文的精简元数据。
+
+    摘要只保存在元数据中（不再同时写入 documents），
+    作者只写入实际存在的 author1..authorN 字段，不再用空字符串补齐到 50 个。
+    """
+    metadata = {
+        "title": doc["title"],
+        "summary": doc["summary"],
+        "authors": doc["authors"],
+        "venue": doc["venue"],
+        "link": doc.get("link", ""),
+        "published": doc["published"]
+    }
+    for j, author in enumerate(split_authors(doc["authors"])[:max_authors]):
+        metadata[f"author{j+1}"] = author
+    return metadata
+
+
+def slim_metadata(metadata):
+    """去掉旧结构中值为空的 authorN 字段"""
+    return {k: v for k, v in metadata.items() if not (_AUTHOR_FIELD.match(k) and v in ("", None))}
+
+
+def directory_size(path):
+    """目录占用的磁盘字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _payload_bytes(metadata, document):
+    """单条记录元数据与文档文本序列化后的字节数"""
+    size = len(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+    if document:
+        size += len(document.encode("utf-8"))
+    return size
+
+
+def build_benchmark_queries(collection, num_queries=20, seed=0):
+    """
+    从集合中随机抽取论文，用其向量、期刊和第一作者构造基准查询，
+    迁移前后使用同一组查询以便对比。
+    """
+    ids = list_ids(collection)
+    if not ids:
+        return []
+    sample = random.Random(seed).sample(ids, min(num_queries, len(ids)))
+    results = collection.get(ids=sample, include=["embeddings", "metadatas"])
+    queries = []
+    for embedding, metadata in zip(results["embeddings"], results["metadatas"]):
+        authors = split_authors(metadata.get("authors", ""))
+        queries.append({
+            "vector": [float(v) for v in embedding],
+            "venue": metadata.get("venue", ""),
+            "author": authors[0] if authors else "",
+        })
+    return queries
+
+
+def measure_query_latency(collection, queries, top_k=10, max_authors=50):
+    """
+    对集合执行基准查询，返回各类查询的延迟统计（毫秒）。
+
+    查询类型与界面一致：纯向量检索、按期刊过滤的向量检索、按作者过滤的向量检索
+    （作者条件为 author1..authorN 的 $or）。
+    """
+    timings = {"vector": [], "venue": [], "author": []}
+    for query in queries:
+        wheres = {
+            "vector": None,
+            "venue": {"venue": {"$eq": query["venue"]}},
+            "author": {"$or": [{f"author{i+1}": {"$eq": query["author"]}} for i in range(max_authors)]},
+        }
+        for kind, where in wheres.items():
+            start = time.perf_counter()
+            collection.query(query_embeddings=[query["vector"]], n_results=top_k, where=where,
+                             include=["metadatas", "distances"])
+            timings[kind].append((time.perf_counter() - start) * 1000)
+
+    report = {}
+    for kind, values in timings.items():
+        if not values:
+            continue
+        values = sorted(values)
+        report[kind] = {
+            "mean": sum(values) / len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+    return report
+
+
+def print_migration_report(report):
+    """打印迁移前后的磁盘占用与查询延迟对比"""
+    mb = 1024 * 1024
+    print("📊 元数据精简迁移报告")
+    print(f"   记录数: {report['records']}")
+    print(f"   元数据字段数/条: {report['fields_before'] / max(report['records'], 1):.1f} -> "
+          f"{report['fields_after'] / max(report['records'], 1):.1f}")
+    print(f"   元数据与文档载荷: {report['payload_before'] / mb:.1f} MB -> {report['payload_after'] / mb:.1f} MB")
+    print(f"   数据库目录: 迁移前 {report['disk_before'] / mb:.1f} MB，写入新集合后 {report['disk_after'] / mb:.1f} MB"
+          + (f"，删除旧集合后 {report['disk_final'] / mb:.1f} MB" if report.get("disk_final") is not None else ""))
+    for kind in ("vector", "venue", "author"):
+        before = report["latency_before"].get(kind)
+        after = report["latency_after"].get(kind)
+        if before and after:
+            print(f"   查询延迟[{kind}]: 平均 {before['mean']:.1f} -> {after['mean']:.1f} ms，"
+                  f"p50 {before['p50']:.1f} -> {after['p50']:.1f} ms，p95 {before['p95']:.1f} -> {after['p95']:.1f} ms")
+
+
+def migrate_collection(client, source_name, dest_name=None, persist_directory=None, batch_size=5000,
+                       swap=False, delete_source=False, num_queries=20):
+    """
+    将使用旧结构（author1..author50 补齐、摘要同时写入 documents）的集合改写为精简结构。
+
+    按排序后的文档ID分批读取源集合，去掉空的作者字段、不再写入 documents，
+    保留原始ID、向量和其余元数据写入新集合。目标集合中已存在的ID会被跳过，
+    中断后重新运行即可继续。迁移前后用同一组查询测量延迟，并统计磁盘占用。
+
+    Args:
+        client: chromadb 客户端。
+        source_name (str): 源集合名称。
+        dest_name (str): 目标集合名称，默认为 "<源集合>_slim"。
+        persist_directory (str): 数据库目录，用于统计磁盘占用；为 None 时不统计。
+        batch_size (int): 每批读取与写入的记录数。
+        swap (bool): 核对通过后交换集合名称，使新集合使用源集合的名称（旧集合改名为 "<源集合>_legacy"）。
+        delete_source (bool): 交换后删除旧集合。
+        num_queries (int): 测量延迟使用的查询数。
+
+    Returns:
+        dict: 迁移报告；核对未通过时返回 None。
+    """
+    dest_name = dest_name or f"{source_name}_slim"
+    source = client.get_collection(name=source_name)
+    dest = client.get_or_create_collection(name=dest_name, metadata=source.metadata)
+    if hasattr(client, "get_max_batch_size"):
+        batch_size = min(batch_size, client.get_max_batch_size())
+
+    queries = build_benchmark_queries(source, num_queries)
+    report = {
+        "records": 0, "fields_before": 0, "fields_after": 0, "payload_before": 0, "payload_after": 0,
+        "disk_before": directory_size(persist_directory) if persist_directory else 0,
+        "latency_before": measure_query_latency(source, queries),
+    }
+
+    ids = list_ids(source)
+    pending = missing_ids(dest, ids, batch_size)
+    print(f"⏳ 集合 {source_name} 共 {len(ids)} 条记录，需要改写 {len(pending)} 条 -> {dest_name}")
+    start_time = time.time()
+    for i in range(0, len(pending), batch_size):
+        batch_ids = pending[i:i + batch_size]
+        results = source.get(ids=batch_ids, include=["documents", "embeddings", "metadatas"])
+        documents = results["documents"] or [None] * len(results["ids"])
+        metadatas = []
+        for metadata, document in zip(results["metadatas"], documents):
+            slim = slim_metadata(metadata)
+            report["fields_before"] += len(metadata)
+            report["fields_after"] += len(slim)
+            report["payload_before"] += _payload_bytes(metadata, document)
+            report["payload_after"] += _payload_bytes(slim, None)
+            metadatas.append(slim)
+        dest.upsert(ids=results["ids"], embeddings=results["embeddings"], metadatas=metadatas)
+        report["records"] += len(batch_ids)
+        rate = report["records"] / max(time.time() - start_time, 1e-9)
+        print(f"✅ 已改写 {i + len(batch_ids)}/{len(pending)} 条记录 ({rate:.0f} 条/秒)")
+
+    missing = missing_ids(dest, ids, batch_size)
+    if missing:
+        print(f"❌ 有 {len(missing)} 条记录未出现在 {dest_name} 中，例如: {missing[:5]}，请重新运行迁移")
+        return None
+    print(f"✅ {dest_name} 已包含 {source_name} 的全部 {len(ids)} 条记录")
+
+    report["disk_after"] = directory_size(persist_directory) if persist_directory else 0
+    report["latency_after"] = measure_query_latency(dest, queries)
+
+    if swap:
+        legacy_name = f"{source_name}_legacy"
+        source.modify(name=legacy_name)
+        dest.modify(name=source_name)
+        print(f"🔁 已交换集合: {dest_name} -> {source_name}，旧集合改名为 {legacy_name}")
+        if delete_source:
+            client.delete_collection(legacy_name)
+            print(f"🗑️ 已删除旧集合 {legacy_name}")
+            report["disk_final"] = directory_size(persist_directory) if persist_directory else 0
+            print("ℹ️ SQLite 文件不会自动收缩，可执行 `chroma utils vacuum` 回收空间")
+
+    print_migration_report(report)
+    return report
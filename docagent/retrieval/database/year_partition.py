@@ -0,0 +1,275 @@
+# year_partition.py - 按发表年份分区的集合：导入时按年份路由，检索时按年份条件裁剪分区
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docagent.retrieval.database.author_index import AuthorIndex
+from docagent.retrieval.database.binary_index import BinaryIndex
+from docagent.retrieval.database.filter_stats import FilterStats, parse_year
+from docagent.retrieval.database.milvus_database import (ChromaDatabase, CHROMA_PERSIST_DIRECTORY, author_index_path,
+                                                         filter_stats_path, binary_index_path, plan_changes)
+from docagent.retrieval.database.sharded_database import ShardedDatabase
+from docagent.retrieval.database.slim_schema import make_doc_id
+
+
+def partition_name(base_name, year, span=1):
+    """论文所属分区的集合名称：papers0520_y2019，按多年分区时为 papers0520_y2015_2019，年份未知时为 papers0520_yunknown"""
+    if year is None or year < 0:
+        return f"{base_name}_yunknown"
+    if span <= 1:
+        return f"{base_name}_y{year}"
+    start = year // span * span
+    return f"{base_name}_y{start}_{start + span - 1}"
+
+
+def parse_partition_name(base_name, name, data_parallel=False):
+    """
+    解析分区集合名称。
+
+    Args:
+        data_parallel (bool): 同时接受数据并行导入各进程写入的分区（如 papers0520_dp0_y2019）。
+
+    Returns:
+        tuple: (起始年份, 结束年份)，年份未知的分区为 (None, None)；不是 base_name 的分区时返回 None。
+    """
+    prefix = re.escape(base_name) + (r"(?:_dp\d+)?" if data_parallel else "")
+    if re.fullmatch(prefix + "_yunknown", name):
+        return (None, None)
+    match = re.fullmatch(prefix + r"_y(\d{4})(?:_(\d{4}))?", name)
+    if not match:
+        return None
+    start = int(match.group(1))
+    return (start, int(match.group(2) or start))
+
+
+def year_range(where):
+    """
+    从 where 条件中提取发表年份的范围（只考虑顶层及 $and 中的 published 条件）。
+
+    Returns:
+        tuple: (最小年份, 最大年份)，没有对应条件时为 None。
+    """
+    low, high = None, None
+    pending = [where] if where else []
+    while pending:
+        clause = pending.pop()
+        for key, condition in clause.items():
+            if key == "$and":
+                pending.extend(condition)
+                continue
+            if key != "published":
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if op == "$in":
+                    years = [parse_year(v) for v in value if parse_year(v) >= 0]
+                    bounds = (min(years), max(years)) if years else (None, None)
+                else:
+                    year = parse_year(value)
+                    if year < 0:
+                        continue
+                    bounds = {"$eq": (year, year), "$gte": (year, None), "$gt": (year + 1, None),
+                              "$lte": (None, year), "$lt": (None, year - 1)}.get(op, (None, None))
+                if bounds[0] is not None:
+                    low = bounds[0] if low is None else max(low, bounds[0])
+                if bounds[1] is not None:
+                    high = bounds[1] if high is None else min(high, bounds[1])
+    return low, high
+
+
+def list_partitions(client, base_name, data_parallel=False):
+    """列出 base_name 的全部分区集合，返回 {集合名称: (起始年份, 结束年份)}"""
+    partitions = {}
+    for collection in client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        bounds = parse_partition_name(base_name, name, data_parallel)
+        if bounds is not None:
+            partitions[name] = bounds
+    return partitions
+
+
+def reset_year_partitions(base_name, persist_directory=None):
+    """删除 base_name 的全部分区集合，并清空各分区的作者索引、过滤统计与二值索引"""
+    import chromadb
+
+    persist_directory = persist_directory or CHROMA_PERSIST_DIRECTORY
+    client = chromadb.PersistentClient(path=persist_directory)
+    for name in list_partitions(client, base_name):
+        client.delete_collection(name)
+        AuthorIndex(author_index_path(name, persist_directory)).reset()
+        FilterStats(filter_stats_path(name, persist_directory)).reset()
+        if BinaryIndex.exists(binary_index_path(name, persist_directory)):
+            BinaryIndex(binary_index_path(name, persist_directory)).reset()
+        print(f"🗑️ 已删除分区 {name}")
+
+
+class YearPartitionedDatabase(ShardedDatabase):
+    """
+    按发表年份分区的数据库：每个年份（或每 span 年）一个集合，名称为 <base_name>_y<年份>。
+
+    写入时按论文的 published 年份路由到对应分区（分区不存在时创建）；检索时从 where 条件中提取年份范围，
+    只并行查询与范围重叠的分区并归并结果。年份范围越窄，查询的分区越少、单个 HNSW 索引越小。
+    其他进程新建的分区在 refresh_interval 秒内被发现。
+    检索数据并行导入的结果时设置 data_parallel=True：各进程写入的 <base_name>_dp<序号>_y<年份>
+    分区一并打开，同一年份的多个分区都参与检索。
+
+    Args:
+        base_name (str): 集合名称前缀，如 papers0520。
+        dim (int): 向量维度。
+        span (int): 每个分区包含的年数（只影响写入路由，检索按已有分区的名称判断范围）。
+        persist_directory (str): ChromaDB 目录。
+        max_workers (int): 并行查询的线程数。
+        refresh_interval (float): 重新列出分区集合的最短间隔（秒）。
+        data_parallel (bool): 同时打开数据并行导入各进程的分区（只用于检索，写入仍路由到 base_name 的分区）。
+    """
+
+    def __init__(self, base_name, dim, span=1, persist_directory=None, max_workers=8, refresh_interval=30.0,
+                 data_parallel=False):
+        import chromadb
+
+        self.base_name = base_name
+        self.dim = dim
+        self.span = span
+        self.persist_directory = persist_directory or CHROMA_PERSIST_DIRECTORY
+        self.refresh_interval = refresh_interval
+        self.data_parallel = data_parallel
+        self._client = chromadb.PersistentClient(path=self.persist_directory)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="partition")
+        self._lock = threading.Lock()
+        self.partitions = {}  # 集合名称 -> ((起始年份, 结束年份), ChromaDatabase)
+        self._relocated = {}  # 文档ID -> 旧分区，重新计算向量写入新分区后从旧分区删除
+        self._last_refresh = 0.0
+        self.refresh(force=True)
+        counts = sum(database.collection.count() for database in self.shards)
+        print(f"📅 {base_name} 共 {len(self.partitions)} 个年份分区，{counts} 篇论文")
+
+    @property
+    def shards(self):
+        # 其他线程可能正在打开新分区，在锁内复制
+        with self._lock:
+            return [database for _, database in self.partitions.values()]
+
+    def _open(self, name, bounds):
+        database = ChromaDatabase(collection_name=name, dim=self.dim, persist_directory=self.persist_directory)
+        self.partitions[name] = (bounds, database)
+        return database
+
+    def refresh(self, force=False):
+        """打开其他进程新建的分区"""
+        if not force and time.time() - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            for name, bounds in sorted(list_partitions(self._client, self.base_name, self.data_parallel).items()):
+                if name not in self.partitions:
+                    self._open(name, bounds)
+            self._last_refresh = time.time()
+
+    def shards_for(self, filter_expression):
+        """只返回与 where 中年份范围重叠的分区"""
+        self.refresh()
+        low, high = year_range(filter_expression)
+        if low is None and high is None:
+            return self.shards
+        with self._lock:
+            entries = list(self.partitions.values())
+        selected = []
+        for (start, end), database in entries:
+            # 年份未知的论文不满足任何年份条件
+            if start is None:
+                continue
+            if (high is None or start <= high) and (low is None or end >= low):
+                selected.append(database)
+        print(f"📅 年份分区裁剪: {low or '-'} ~ {high or '-'}，查询 {len(selected)}/{len(entries)} 个分区")
+        return selected
+
+    def _target(self, doc):
+        """论文按发表年份应属的分区（不存在时创建）"""
+        name = partition_name(self.base_name, parse_year(doc.get("published")), self.span)
+        with self._lock:
+            entry = self.partitions.get(name)
+            return entry[1] if entry else self._open(name, parse_partition_name(self.base_name, name))
+
+    def _locate(self, ids):
+        """查找已有论文所在的分区，返回 {文档ID: (分区, 元数据)}"""
+        self.refresh(force=True)
+        located = {}
+        for database in self.shards:
+            for doc_id, metadata in database.get_metadatas(ids).items():
+                located[doc_id] = (database, metadata)
+        return located
+
+    def _group(self, documents):
+        groups = {}
+        for doc in documents:
+            database = self._target(doc)
+            groups.setdefault(database.collection_name, (database, []))[1].append(doc)
+        return [groups[name] for name in sorted(groups)]
+
+    def insert_documents(self, documents, raise_errors=False):
+        """按发表年份把文档路由到各分区写入，全部分区写入成功时返回 True；raise_errors 为 True 时抛出分区的原始异常"""
+        success = True
+        for database, docs in self._group(documents):
+            inserted = database.insert_documents(docs, raise_errors=raise_errors)
+            success = inserted and success
+            if inserted:
+                self._drop_relocated(database, docs)
+        return success
+
+    def _drop_relocated(self, database, docs):
+        """论文已写入新的年份分区后，删除旧分区中的副本"""
+        stale = {}
+        for doc in docs:
+            old = self._relocated.pop(make_doc_id(doc), None)
+            if old is not None and old is not database:
+                stale.setdefault(old.collection_name, (old, []))[1].append(make_doc_id(doc))
+        for old, ids in stale.values():
+            old.delete_documents(ids=ids)
+
+    def plan_upsert(self, documents):
+        """与 ChromaDatabase.plan_upsert 相同，已有论文在其当前所在的分区中比较"""
+        unique_docs = {}
+        for doc in documents:
+            unique_docs[make_doc_id(doc)] = doc
+        located = self._locate(list(unique_docs.keys()))
+        plan = plan_changes(unique_docs, {doc_id: metadata for doc_id, (_, metadata) in located.items()})
+        # 标题或摘要变化且年份也变化的论文，写入新分区后再删除旧分区中的副本
+        for doc in plan["embed"]:
+            doc_id = make_doc_id(doc)
+            if doc_id in located:
+                self._relocated[doc_id] = located[doc_id][0]
+        return plan
+
+    def update_metadata(self, documents):
+        """只更新元数据；发表年份变化的论文连同已有向量移到新分区，不重新计算向量"""
+        unique_docs = {}
+        for doc in documents:
+            unique_docs[make_doc_id(doc)] = doc
+        located = self._locate(list(unique_docs.keys()))
+        success = True
+        for database, docs in self._group([doc for doc_id, doc in unique_docs.items() if doc_id in located]):
+            staying = [doc for doc in docs if located[make_doc_id(doc)][0] is database]
+            if staying:
+                success = database.update_metadata(staying) and success
+            moving = {}
+            for doc in docs:
+                old = located[make_doc_id(doc)][0]
+                if old is not database:
+                    moving.setdefault(old.collection_name, (old, []))[1].append(doc)
+            for old, moved in moving.values():
+                results = old.collection.get(ids=[make_doc_id(doc) for doc in moved], include=["embeddings"])
+                vectors = dict(zip(results["ids"], results["embeddings"]))
+                moved = [dict(doc, vector=vectors[make_doc_id(doc)]) for doc in moved if make_doc_id(doc) in vectors]
+                if database.insert_documents(moved):
+                    old.delete_documents(ids=[make_doc_id(doc) for doc in moved])
+                    print(f"📅 {len(moved)} 篇论文从分区 {old.collection_name} 移到 {database.collection_name}")
+                else:
+                    success = False
+        return success
+
+    def delete_documents(self, ids=None, where=None):
+        """按文档ID或 where 条件在各分区中删除论文（只按 where 删除时按年份范围裁剪分区），返回删除数"""
+        self.refresh(force=True)
+        shards = self.shards if ids else self.shards_for(where)
+        return sum(database.delete_documents(ids=ids, where=where) for database in shards)
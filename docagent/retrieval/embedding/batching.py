@@ -0,0 +1,132 @@
+# batching.py - 并发查询的微批调度：把短时间内到达的多个请求合并为一次 embed 调用
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from docagent.retrieval.embedding.base import BaseEmbedding
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """
+    在嵌入模型前增加微批调度。
+
+    各线程调用 embed 时请求进入队列，由单独的调度线程收集：第一个请求到达后最多再等待
+    max_wait_ms 毫秒，或凑满 max_batch_size 条文本，就合并为一次 embed 调用，再把向量分发给各个调用方。
+    模型只在调度线程中调用，多个请求不会同时争用同一个 vLLM 引擎。
+    提供与被包装模型相同的 embed / embedding_dim 接口，另有 embed_async 供 asyncio 代码使用。
+
+    Args:
+        embedder: 实际的嵌入模型，如 VLLMQwenEmbedding。
+        max_batch_size (int): 每次 embed 调用最多合并的文本数。
+        max_wait_ms (float): 收集一批请求的最长等待时间（毫秒）。
+    """
+
+    def __init__(self, embedder, max_batch_size=32, max_wait_ms=5):
+        super().__init__()
+        self.embedder = embedder
+        self.embedding_dim = embedder.embedding_dim
+        self.model_name = getattr(embedder, "model_name", None)
+        self.max_tokens = getattr(embedder, "max_tokens", None)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.max_batch_seen = 0
+        self.max_queue_depth = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """提交一组文本，返回在调度线程完成后得到向量列表的 Future"""
+        if isinstance(texts, str):
+            texts = [texts]
+        future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        if self._closed:
+            raise RuntimeError("嵌入调度器已关闭")
+        with self._lock:
+            self._pending += len(texts)
+            self.max_queue_depth = max(self.max_queue_depth, self._pending)
+        self._queue.put((list(texts), future))
+        return future
+
+    def embed(self, texts):
+        return self.submit(texts).result()
+
+    async def embed_async(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _collect(self, first):
+        """从第一个请求开始，在等待时间内继续收集请求，直到凑满一批"""
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号放回队列，当前批次处理完后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            with self._lock:
+                self._pending -= len(texts)
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(texts)
+                self.max_batch_seen = max(self.max_batch_seen, len(texts))
+            try:
+                vectors = self.embedder.embed(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"嵌入结果数量 {len(vectors)} 与文本数量 {len(texts)} 不一致")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for item_texts, future in batch:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._pending,
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "avg_requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+            }
+
+    def close(self):
+        """停止调度线程（已提交的请求会先处理完）"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
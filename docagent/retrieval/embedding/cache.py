@@ -0,0 +1,295 @@
+# cache.py - 基于文本哈希的持久化嵌入缓存
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from docagent.retrieval.embedding.base import BaseEmbedding
+
+
+def normalize_text(text):
+    """规范化文本（合并空白字符），使仅空白不同的文本命中同一缓存项"""
+    return " ".join(str(text).split())
+
+
+class EmbeddingCache:
+    """
+    磁盘嵌入缓存，按 (模型路径, 最大 token 数, 规范化文本哈希) 索引。
+
+    每个模型使用单独的子目录，包含三个文件：
+        vectors.bin  追加写入的向量矩阵（按行存储，读取时内存映射）
+        keys.bin     与向量逐行对应的 128 位文本哈希（两个 uint64）
+        meta.json    模型路径、维度、数据类型与最大 token 数
+
+    多个进程（如数据并行导入的各工作进程）可以共用同一缓存目录：写入时持有 write.lock 文件锁，
+    新向量的行号按加锁后的文件大小计算，其他进程写入的条目同时并入本进程的索引。
+
+    Args:
+        cache_dir (str): 缓存根目录。
+        model_name (str): 模型路径或名称，不同模型的缓存互不影响。
+        dim (int): 嵌入维度。
+        dtype (str): 向量存储类型，float32 或 float16。
+        max_tokens (int): 嵌入模型截断文本的最大 token 数，不同截断长度得到的向量互不复用。
+    """
+
+    def __init__(self, cache_dir, model_name, dim, dtype="float32", max_tokens=None):
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.max_tokens = max_tokens
+        # 未指定 max_tokens 时与旧版本缓存的目录和哈希保持一致
+        self._config = model_name if max_tokens is None else f"{model_name}\0max_tokens={max_tokens}"
+        model_key = hashlib.sha1(self._config.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, model_key)
+        os.makedirs(self.path, exist_ok=True)
+
+        self._vectors_path = os.path.join(self.path, "vectors.bin")
+        self._keys_path = os.path.join(self.path, "keys.bin")
+        self._lock = threading.Lock()
+        self._check_meta()
+        self._load()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_meta(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        meta = {"model": self.model_name, "dim": self.dim, "dtype": self.dtype.name}
+        if self.max_tokens is not None:
+            meta["max_tokens"] = self.max_tokens
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"嵌入缓存 {self.path} 的配置 {stored} 与当前配置 {meta} 不一致")
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+    def _committed_rows(self):
+        """文件中完整写入的条目数（先写向量再写哈希，哈希完整的行才有效）"""
+        row_bytes = self.dim * self.dtype.itemsize
+        key_rows = os.path.getsize(self._keys_path) // 16 if os.path.exists(self._keys_path) else 0
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        return min(key_rows, vector_rows)
+
+    def _load(self):
+        """加载哈希索引（只读取；中断写入留下的不完整尾部由下一次写入在持有文件锁时截断）"""
+        self.count = self._committed_rows()
+        if self.count:
+            keys = np.fromfile(self._keys_path, dtype="<u8", count=self.count * 2).reshape(-1, 2)
+            self._order = np.argsort(keys[:, 0], kind="stable")
+            self._sorted_hi = keys[self._order, 0]
+            self._sorted_lo = keys[self._order, 1]
+        else:
+            self._order = np.empty(0, dtype=np.int64)
+            self._sorted_hi = np.empty(0, dtype="<u8")
+            self._sorted_lo = np.empty(0, dtype="<u8")
+        # 本次运行新写入的条目，不重新排序已有索引
+        self._recent = {}
+        self._vectors = None
+        print(f"✅ 嵌入缓存 {self.path} 已加载 {self.count} 条向量")
+
+    def _key(self, text):
+        digest = hashlib.blake2b(f"{self._config}\0{normalize_text(text)}".encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+
+    def _find(self, key):
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+        hi, lo = key
+        pos = np.searchsorted(self._sorted_hi, hi)
+        while pos < len(self._sorted_hi) and self._sorted_hi[pos] == hi:
+            if self._sorted_lo[pos] == lo:
+                return int(self._order[pos])
+            pos += 1
+        return None
+
+    def _matrix(self):
+        # 缓存文件增长后重新映射
+        if self._vectors is None or len(self._vectors) < self.count:
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+        return self._vectors
+
+    def get_many(self, texts):
+        """
+        批量查询缓存。
+
+        Returns:
+            list: 与 texts 对应的向量（list of floats），未命中的位置为 None。
+        """
+        with self._lock:
+            rows = [self._find(self._key(text)) for text in texts]
+            matrix = self._matrix() if self.count else None
+            results = [None if row is None else matrix[row].astype(np.float32).tolist() for row in rows]
+        hit_count = sum(r is not None for r in results)
+        self.hits += hit_count
+        self.misses += len(texts) - hit_count
+        return results
+
+    def _sync(self):
+        """并入其他进程写入的条目，并截断中断写入留下的尾部（只在持有文件锁时调用）"""
+        committed = self._committed_rows()
+        if committed > self.count:
+            keys = np.fromfile(self._keys_path, dtype="<u8", count=committed * 2).reshape(-1, 2)
+            for row in range(self.count, committed):
+                self._recent[(int(keys[row, 0]), int(keys[row, 1]))] = row
+            self.count = committed
+        for file_path, size in ((self._keys_path, self.count * 16),
+                                (self._vectors_path, self.count * self.dim * self.dtype.itemsize)):
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                with open(file_path, 'r+b') as f:
+                    f.truncate(size)
+
+    def put_many(self, texts, vectors):
+        """写入新的向量，已存在的文本会被忽略"""
+        with self._lock, open(os.path.join(self.path, "write.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                new = {}
+                for text, vector in zip(texts, vectors):
+                    key = self._key(text)
+                    if self._find(key) is not None or key in new or len(vector) != self.dim:
+                        continue
+                    new[key] = vector
+                if not new:
+                    return
+                new_keys, new_vectors = list(new), list(new.values())
+                # 先写向量再写哈希，中断时多余的向量会在下一次写入时被截断
+                with open(self._vectors_path, 'ab') as f:
+                    np.asarray(new_vectors, dtype=self.dtype).tofile(f)
+                with open(self._keys_path, 'ab') as f:
+                    np.asarray(new_keys, dtype="<u8").tofile(f)
+                for key in new_keys:
+                    self._recent[key] = self.count
+                    self.count += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self.count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class QueryEmbeddingCache:
+    """
+    查询向量的内存 LRU 缓存，可选地以 EmbeddingCache 作为磁盘层（重启后仍可命中）。
+
+    用于检索时的单条查询：相同查询文本（忽略多余空白）只计算一次嵌入，
+    修改过滤条件或 top_k 后重新检索只需要查询数据库。
+
+    Args:
+        max_entries (int): 内存中最多保存的查询向量数，超出时淘汰最久未使用的条目。
+        disk_cache (EmbeddingCache): 可选的磁盘缓存层。
+    """
+
+    def __init__(self, max_entries=1024, disk_cache=None):
+        self.max_entries = max_entries
+        self.disk_cache = disk_cache
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        """查询缓存，未命中时返回 None"""
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+        if self.disk_cache is not None:
+            vector = self.disk_cache.get_many([text])[0]
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text, vector):
+        """写入查询向量，零向量（模型出错）不缓存"""
+        if not any(vector):
+            return
+        self._remember(normalize_text(text), vector)
+        if self.disk_cache is not None:
+            self.disk_cache.put_many([text], [vector])
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+        }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    在嵌入模型前增加磁盘缓存，只有未命中的文本才会交给模型计算。
+
+    与被包装的模型提供相同的 embed / embedding_dim 接口，可直接传给 SimpleRetriever。
+
+    Args:
+        embedder: 实际的嵌入模型，如 VLLMQwenEmbedding。
+        cache (EmbeddingCache): 嵌入缓存，max_tokens 必须与模型的截断长度一致。
+    """
+
+    def __init__(self, embedder, cache):
+        super().__init__()
+        max_tokens = getattr(embedder, "max_tokens", None)
+        if cache.max_tokens != max_tokens:
+            raise ValueError(f"嵌入缓存的 max_tokens ({cache.max_tokens}) 与模型的截断长度 ({max_tokens}) 不一致")
+        self.embedder = embedder
+        self.cache = cache
+        self.embedding_dim = embedder.embedding_dim
+        self.model_name = getattr(embedder, "model_name", None)
+        self.max_tokens = max_tokens
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return []
+
+        results = self.cache.get_many(texts)
+        # 同一批次中重复的未命中文本只计算一次
+        missing = {}
+        for i, vector in enumerate(results):
+            if vector is None:
+                missing.setdefault(normalize_text(texts[i]), []).append(i)
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            vectors = self.embedder.embed(miss_texts)
+            # 模型出错时返回的零向量不写入缓存
+            valid = [(t, v) for t, v in zip(miss_texts, vectors) if any(v)]
+            if valid:
+                self.cache.put_many([t for t, _ in valid], [v for _, v in valid])
+            for positions, vector in zip(missing.values(), vectors):
+                for i in positions:
+                    results[i] = vector
+        return results
@@ -9,7 +9,8 @@ from docagent.retrieval.embedding.base import BaseEmbedding
 
 # 重命名类以反映新的模型和框架
 class VLLMQwenEmbedding(BaseEmbedding):
-    def __init__(self, model_name='/home/dataset-assist-0/data/paperagentui/models/models--Alibaba-NLP--gte-Qwen2-7B-instruct/snapshots/a8d08b36ada9cacfe34c4d6f80957772a025daf2', tensor_parallel_size=1, trust_remote_code=True, **kwargs):
+    def __init__(self, model_name='/home/dataset-assist-0/data/paperagentui/models/models--Alibaba-NLP--gte-Qwen2-7B-instruct/snapshots/a8d08b36ada9cacfe34c4d6f80957772a025daf2', tensor_parallel_size=1, trust_remote_code=True,
+                 max_tokens=None, max_batch_tokens=32768, **kwargs):
         """
         使用 vLLM 初始化 Qwen 嵌入模型 (从项目内指定路径加载)。
 
@@ -17,9 +18,13 @@ class VLLMQwenEmbedding(BaseEmbedding):
             model_name (str): 项目内模型快照文件夹的绝对路径。
             tensor_parallel_size (int): 用于张量并行的大小。
             trust_remote_code (bool): 是否信任远程代码（对于某些模型是必需的）。
+            max_tokens (int): 单条文本的最大 token 数，超出部分截断；默认使用模型的最大长度。
+            max_batch_tokens (int): 每次调用 encode 的 token 预算（按批内最长文本计算填充后的总量）。
             **kwargs: 其他传递给 vLLM 的参数。
         """
         super().__init__()
+        self.model_name = model_name
+        self.max_batch_tokens = max_batch_tokens
         try:
             # 检查本地路径是否存在
             if not os.path.isdir(model_name):
@@ -57,6 +62,12 @@ class VLLMQwenEmbedding(BaseEmbedding):
 
             self.embedding_dim = len(dummy_output[0].outputs.embedding)
             print(f"✅ 嵌入维度确定为: {self.embedding_dim}")
+
+            # 获取分词器，用于按长度分桶和截断
+            self.tokenizer = self.model.get_tokenizer()
+            model_max_len = self.model.llm_engine.model_config.max_model_len
+            self.max_tokens = min(max_tokens, model_max_len) if max_tokens else model_max_len
+            print(f"✅ 单条文本最大 token 数: {self.max_tokens}，每批 token 预算: {self.max_batch_tokens}")
             print(f"⚠️ 警告：请确保 Milvus 数据库的维度设置为 {self.embedding_dim}")
 
         except ImportError:
@@ -76,10 +87,59 @@ class VLLMQwenEmbedding(BaseEmbedding):
         #     del os.environ["HTTPS_PROXY"]
         #     print("移除了 HTTPS_PROXY 环境变量")
 
+    def tokenize(self, texts):
+        """将文本转换为 token id 列表，并截断到 max_tokens"""
+        token_ids = self.tokenizer(texts)["input_ids"]
+        return [ids[:self.max_tokens] for ids in token_ids]
+
+    def plan_batches(self, lengths):
+        """
+        按 token 长度排序分桶，生成满足 token 预算的批次。
+
+        批次的开销按"条数 × 批内最长长度"计算（即填充后的 token 数），
+        长度相近的文本被分到同一批，减少填充浪费。
+
+        Returns:
+            list: 每个批次包含的原始下标列表。
+        """
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches = []
+        current = []
+        for i in order:
+            # 排序后当前文本即为批内最长文本
+            if current and (len(current) + 1) * max(lengths[i], 1) > self.max_batch_tokens:
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _encode(self, prompts):
+        """调用 vLLM 生成一批嵌入，出错或结果异常时抛出异常（不再用零向量代替，避免污染索引）"""
+        try:
+            request_outputs = self.model.encode(prompts)
+        except Exception as e:
+            print(f"❌ vLLM 嵌入处理错误: {str(e)}")
+            raise
+
+        # 从结果中提取嵌入向量
+        embeddings = [output.outputs.embedding for output in request_outputs]
+
+        # 检查嵌入是否为空或维度不匹配
+        if len(embeddings) != len(prompts) or any(len(e) != self.embedding_dim for e in embeddings):
+            raise ValueError(f"嵌入结果异常：返回了空列表或维度不匹配 ({self.embedding_dim})")
+
+        # vLLM 返回的 embedding 已经是 list of floats
+        return embeddings
+
     def embed(self, texts):
         """
         使用 vLLM 模型为文本列表生成嵌入。
 
+        文本先按 token 长度排序分桶，再按 token 预算组成批次调用 encode，
+        超过 max_tokens 的文本会被截断；返回结果保持输入顺序。
+
         Args:
             texts (list or str): 需要嵌入的文本或文本列表。
 
@@ -95,27 +155,17 @@ class VLLMQwenEmbedding(BaseEmbedding):
             return []
 
         try:
-            # 使用 vLLM 的 encode 方法生成嵌入
-            # 它期望一个文本列表作为输入
-            request_outputs = self.model.encode(texts)
-
-            # 从结果中提取嵌入向量
-            embeddings = [output.outputs.embedding for output in request_outputs]
-
-            # 检查嵌入是否为空或维度不匹配（可选，增加健壮性）
-            if not embeddings or any(len(e) != self.embedding_dim for e in embeddings):
-                print(f"❌ 嵌入结果异常：返回了空列表或维度不匹配 ({self.embedding_dim})。")
-                 # 对于无效嵌入，可以返回零向量或抛出错误
-                return [[0.0] * self.embedding_dim for _ in texts]
-
-            # vLLM 返回的 embedding 已经是 list of floats
-            return embeddings
-
+            token_ids = self.tokenize(texts)
         except Exception as e:
-            print(f"❌ vLLM 嵌入处理错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            # 出错时返回对应维度的零向量列表
-            return [[0.0] * self.embedding_dim for _ in texts]
+            print(f"⚠️ 分词失败，直接按原文本嵌入: {str(e)}")
+            return self._encode(texts)
+
+        embeddings = [None] * len(texts)
+        for batch in self.plan_batches([len(ids) for ids in token_ids]):
+            # 直接传入 token id，避免 vLLM 重复分词
+            prompts = [{"prompt_token_ids": token_ids[i]} for i in batch]
+            for i, embedding in zip(batch, self._encode(prompts)):
+                embeddings[i] = embedding
+        return embeddings
 
 # 移除旧的示例代码和注释
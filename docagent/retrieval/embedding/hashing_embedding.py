@@ -0,0 +1,36 @@
+# hashing_embedding.py - CPU 上的哈希嵌入，用于无 GPU 环境下联调导入流程
+import hashlib
+import math
+
+from docagent.retrieval.embedding.base import BaseEmbedding
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    根据词的哈希值生成确定性向量的轻量嵌入模型。
+
+    不具备语义检索能力，只用于在没有 GPU 的机器上测试导入、合并、分片等流程。
+    与 VLLMQwenEmbedding 提供相同的 embed / embedding_dim / model_name 接口。
+
+    Args:
+        dim (int): 向量维度。
+    """
+
+    def __init__(self, dim=256):
+        super().__init__()
+        self.embedding_dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        embeddings = []
+        for text in texts:
+            vector = [0.0] * self.embedding_dim
+            for token in str(text).lower().split():
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                index = int.from_bytes(digest[:4], "little") % self.embedding_dim
+                vector[index] += 1.0 if digest[4] & 1 else -1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
@@ -0,0 +1,95 @@
+# remote_embedding.py - 嵌入服务客户端，与 VLLMQwenEmbedding 接口一致
+import http.client
+import json
+import queue
+from urllib.parse import urlparse
+
+from docagent.retrieval.embedding.base import BaseEmbedding
+from docagent.retrieval.embedding.server import decode_vectors
+
+
+class RemoteEmbedding(BaseEmbedding):
+    """
+    通过本地 HTTP 调用常驻嵌入服务（docagent.retrieval.embedding.server）。
+
+    提供 embed / embedding_dim / model_name / max_tokens 接口，可直接替换 VLLMQwenEmbedding 传给 SimpleRetriever，
+    启动时不需要加载模型。连接保存在连接池中复用，支持多线程并发调用。
+
+    Args:
+        url (str): 服务地址，如 http://127.0.0.1:8765。
+        pool_size (int): 连接池大小（同时进行的请求数上限）。
+        timeout (float): 单次请求超时（秒）。
+        max_texts_per_request (int): 每个请求最多携带的文本数，超出时拆成多个请求。
+    """
+
+    def __init__(self, url="http://127.0.0.1:8765", pool_size=8, timeout=600, max_texts_per_request=1024):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.max_texts_per_request = max_texts_per_request
+        self._pool = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(pool_size):
+            self._slots.put(None)
+
+        info = self._request("GET", "/info")
+        self.embedding_dim = info["embedding_dim"]
+        self.model_name = info["model_name"]
+        # 旧版本服务不返回 max_tokens
+        self.max_tokens = info.get("max_tokens")
+        print(f"✅ 已连接嵌入服务 {url} (维度 {self.embedding_dim})")
+
+    def _acquire(self):
+        # 先占用一个并发名额，再复用空闲连接或新建连接
+        self._slots.get()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn):
+        if conn is not None:
+            self._pool.put(conn)
+        self._slots.put(None)
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn = self._acquire()
+        try:
+            for attempt in range(2):
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    data = json.loads(response.read().decode("utf-8"))
+                    break
+                except (http.client.HTTPException, ConnectionError, OSError):
+                    # 服务端关闭了空闲连接：换一个新连接重试一次
+                    conn.close()
+                    if attempt:
+                        conn = None
+                        raise
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            if response.status != 200:
+                raise RuntimeError(f"嵌入服务返回错误 {response.status}: {data.get('error')}")
+            return data
+        finally:
+            self._release(conn)
+
+    def embed(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        if not isinstance(texts, list):
+            raise TypeError("输入必须是字符串或字符串列表")
+        embeddings = []
+        for i in range(0, len(texts), self.max_texts_per_request):
+            data = self._request("POST", "/embed", {"texts": texts[i:i + self.max_texts_per_request]})
+            if data["count"]:
+                embeddings.extend(decode_vectors(data["data"], data["count"], data["dim"]))
+        return embeddings
+
+    def stats(self):
+        """嵌入服务端的微批调度统计"""
+        return self._request("GET", "/stats")
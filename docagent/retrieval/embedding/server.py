@@ -0,0 +1,144 @@
+# server.py - 独立的嵌入服务：常驻加载模型，界面和导入进程通过本地 HTTP 共享
+import argparse
+import base64
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from docagent.retrieval.embedding.batching import BatchingEmbedding
+
+
+def encode_vectors(vectors):
+    """将向量列表编码为 base64 的 float32 字节串，比 JSON 数字列表小得多"""
+    return base64.b64encode(np.asarray(vectors, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vectors(data, count, dim):
+    """encode_vectors 的逆过程，返回 list of list"""
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(count, dim).tolist()
+
+
+class EmbeddingServer:
+    """
+    本地 HTTP 嵌入服务。
+
+    模型只加载一次并常驻，并发请求经 BatchingEmbedding 合并后统一调用模型。接口：
+        GET  /info   返回 embedding_dim、model_name 与 max_tokens（截断长度，客户端缓存按此区分）
+        GET  /stats  返回微批调度统计
+        POST /embed  请求体 {"texts": [...]}，返回 {"count", "dim", "data"}（data 为 base64 的 float32 矩阵）
+
+    Args:
+        embedder: 嵌入模型，如 VLLMQwenEmbedding。
+        host (str): 监听地址，默认只监听本机。
+        port (int): 监听端口。
+        max_batch_size (int): 每次调用模型最多合并的文本数。
+        max_wait_ms (float): 合并请求的等待窗口（毫秒）。
+    """
+
+    def __init__(self, embedder, host="127.0.0.1", port=8765, max_batch_size=64, max_wait_ms=5):
+        self.embedder = BatchingEmbedding(embedder, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self.info = {"embedding_dim": embedder.embedding_dim, "model_name": getattr(embedder, "model_name", None),
+                     "max_tokens": getattr(embedder, "max_tokens", None)}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # 保持连接，供客户端连接池复用
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/info":
+                    self._send_json(200, server.info)
+                elif self.path == "/stats":
+                    self._send_json(200, server.embedder.stats())
+                else:
+                    self._send_json(404, {"error": f"未知路径 {self.path}"})
+
+            def do_POST(self):
+                if self.path != "/embed":
+                    self._send_json(404, {"error": f"未知路径 {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    texts = json.loads(self.rfile.read(length).decode("utf-8"))["texts"]
+                    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                        raise ValueError("texts 必须是字符串列表")
+                except Exception as e:
+                    self._send_json(400, {"error": f"请求格式错误: {str(e)}"})
+                    return
+                try:
+                    vectors = server.embedder.embed(texts)
+                except Exception as e:
+                    print(f"❌ 嵌入请求处理失败: {str(e)}")
+                    self._send_json(500, {"error": str(e)})
+                    return
+                self._send_json(200, {"count": len(vectors), "dim": server.info["embedding_dim"],
+                                      "data": encode_vectors(vectors) if vectors else ""})
+
+            def log_message(self, format, *args):
+                # 不逐条打印请求日志
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        host, port = self.httpd.server_address[:2]
+        print(f"🚀 嵌入服务已启动: http://{host}:{port} (维度 {self.info['embedding_dim']})")
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.embedder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻嵌入服务")
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--tensor-parallel-size', type=int, default=1, help='张量并行的GPU数')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='每次调用模型最多合并的文本数')
+    parser.add_argument('--batch-window-ms', type=float, default=5, help='合并并发请求的等待窗口(毫秒)')
+    parser.add_argument('--max-tokens', type=int, default=None, help='单条文本的最大token数(超出截断)')
+    parser.add_argument('--max-batch-tokens', type=int, default=32768, help='每次调用模型的token预算')
+    parser.add_argument('--embedding-cache', type=str, default=None, help='嵌入缓存目录')
+    parser.add_argument('--stand-in-embedder', action='store_true', help='使用CPU哈希嵌入代替模型(用于测试)')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.stand_in_embedder:
+        from docagent.retrieval.embedding.hashing_embedding import HashingEmbedding
+        embedder = HashingEmbedding()
+    else:
+        from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
+        embedder = VLLMQwenEmbedding(tensor_parallel_size=args.tensor_parallel_size, max_tokens=args.max_tokens,
+                                     max_batch_tokens=args.max_batch_tokens)
+    if args.embedding_cache:
+        from docagent.retrieval.embedding.cache import EmbeddingCache, CachedEmbedding
+        embedder = CachedEmbedding(embedder, EmbeddingCache(args.embedding_cache, embedder.model_name, embedder.embedding_dim,
+                                                            max_tokens=getattr(embedder, "max_tokens", None)))
+    print(f"✅ 模型加载完成，用时 {time.time() - start_time:.2f} 秒")
+
+    server = EmbeddingServer(embedder, host=args.host, port=args.port, max_batch_size=args.max_batch_size,
+                             max_wait_ms=args.batch_window_ms)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止嵌入服务...")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
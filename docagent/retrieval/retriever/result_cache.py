@@ -0,0 +1,125 @@
+# result_cache.py - 带版本校验的检索结果缓存，合并并发的相同请求
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def make_cache_key(*parts):
+    """将查询参数（文本、过滤条件字典、top_k 等）序列化为缓存键，字典按键排序"""
+    return json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class SearchResultCache:
+    """
+    检索结果的 LRU 缓存。
+
+    数据版本（如集合文档数）变化时自动清空，导入新数据后不会返回过期结果；
+    多个请求同时查询同一个键时只有第一个请求真正执行检索，其余请求等待并共享其结果。
+
+    Args:
+        max_entries (int): 最多缓存的结果数。
+        version_fn (callable): 返回当前数据版本的函数，为 None 时不做版本校验。
+        version_check_interval (float): 两次版本校验之间的最短间隔（秒），避免每次命中都查询数据库。
+    """
+
+    def __init__(self, max_entries=256, version_fn=None, version_check_interval=2.0):
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._last_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        if self.version_fn is None or time.time() - self._last_check < self.version_check_interval:
+            return self._version
+        version = self.version_fn()
+        with self._lock:
+            self._last_check = time.time()
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                    print(f"🔄 数据版本变化 {self._version} -> {version}，清空 {len(self._entries)} 条检索结果缓存")
+                self._entries.clear()
+                self._version = version
+            return self._version
+
+    def get_or_compute(self, key, compute):
+        """返回缓存的结果；未命中时调用 compute() 计算，并发的相同请求只计算一次"""
+        version = self._check_version()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key])
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return list(future.result())
+
+        try:
+            result = compute()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._store(key, result, version)
+        future.set_result(result)
+        return list(result)
+
+    def get(self, key):
+        """只查询缓存不计算，返回 (结果或 None, 当前数据版本)，用于批量检索时先取出已缓存的部分"""
+        version = self._check_version()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key]), version
+            self.misses += 1
+        return None, version
+
+    def put(self, key, result, version):
+        """写入在数据版本 version 下计算得到的结果"""
+        with self._lock:
+            self._store(key, result, version)
+
+    def _store(self, key, result, version):
+        # 空结果可能来自数据库异常，不缓存；计算期间数据版本变化的结果也不缓存
+        if result and version == self._version:
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0,
+        }
@@ -1,50 +1,205 @@
 # simple_retriever.py - 检索器实现
 from tqdm import tqdm
 
+from docagent.retrieval.embedding.cache import normalize_text
+from docagent.retrieval.retriever.result_cache import make_cache_key
+
 
 class SimpleRetriever:
     """检索器实现"""
 
-    def __init__(self, embedding_model, database):
+    def __init__(self, embedding_model, database, query_cache=None, result_cache=None, batch_retry=None):
         self.embedder = embedding_model
         self.db = database
+        # 查询向量缓存（QueryEmbeddingCache），为 None 时每次检索都调用嵌入模型
+        self.query_cache = query_cache
+        # 检索结果缓存（SearchResultCache），为 None 时每次检索都查询数据库
+        self.result_cache = result_cache
+        # 导入时的批次失败处理（BatchRetry），为 None 时出错的批次整批失败
+        self.batch_retry = batch_retry
+
+    def _embed(self, batch):
+        # 将标题和摘要合并
+        combined_texts = [f"{doc['title']} {doc['summary']}" for doc in batch]
+        # 使用通用的 embed 方法
+        embeddings = self.embedder.embed(combined_texts)
+        # 数量不符或出现零向量时按失败处理，避免无效向量写入集合
+        dim = getattr(self.embedder, "embedding_dim", None)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"嵌入结果数量 {len(embeddings)} 与文档数量 {len(batch)} 不一致")
+        for emb in embeddings:
+            if emb is None or (dim and len(emb) != dim) or not any(emb):
+                raise ValueError("嵌入结果包含空向量、零向量或维度不匹配的向量")
+
+        return [{
+            **doc,
+            "vector": emb
+        } for doc, emb in zip(batch, embeddings)]
+
+    def embed_documents(self, batch):
+        """为一批文档生成嵌入，返回附带 vector 字段的文档列表（无法生成嵌入的文档被隔离时不在结果中）"""
+        if self.batch_retry is None or not batch:
+            return self._embed(batch)
+        return self.batch_retry.run(batch, self._embed, "embed")
+
+    def _insert(self, prepared):
+        # 抛出数据库的原始异常，死信文件中记录真实的失败原因
+        self.db.insert_documents(prepared, raise_errors=True)
+        return prepared
+
+    def insert_documents(self, prepared):
+        """写入已生成嵌入的文档，返回是否成功（被隔离到死信文件的文档不算失败）"""
+        if not prepared:
+            return True
+        if self.batch_retry is None:
+            return self.db.insert_documents(prepared) is not False
+        try:
+            self.batch_retry.run(prepared, self._insert, "insert")
+            return True
+        except Exception as e:
+            print(f"❌ 批次写入失败: {str(e)}")
+            return False
 
     def add_batched_documents(self, documents, batch_size=64):
-        """批量添加文档"""
+        """批量添加文档，返回是否全部写入成功"""
+        success = True
         for i in tqdm(range(0, len(documents), batch_size), desc="插入数据"):
             batch = documents[i:i + batch_size]
-            # 将标题和摘要合并
-            combined_texts = [f"{doc['title']} {doc['summary']}" for doc in batch]
-            # 使用通用的 embed 方法
-            embeddings = self.embedder.embed(combined_texts)
+            try:
+                prepared = self.embed_documents(batch)
+            except Exception as e:
+                print(f"❌ 生成嵌入失败 ({len(batch)} 篇): {str(e)}")
+                success = False
+                continue
+            if not self.insert_documents(prepared):
+                success = False
+        return success
+
+    def upsert_documents(self, documents, batch_size=64):
+        """
+        增量写入论文：只为新论文和标题/摘要变化的论文计算向量，只有元数据变化的论文直接更新元数据。
+
+        Returns:
+            dict: {"embedded", "metadata", "unchanged", "success"}
+        """
+        plan = self.db.plan_upsert(documents)
+        print(f"📝 增量写入: 计算向量 {len(plan['embed'])} 篇，只更新元数据 {len(plan['metadata'])} 篇，"
+              f"未变化 {plan['unchanged']} 篇")
+        success = True
+        if plan["embed"]:
+            success = self.add_batched_documents(plan["embed"], batch_size) and success
+        if plan["metadata"]:
+            success = self.db.update_metadata(plan["metadata"]) is not False and success
+        return {"embedded": len(plan["embed"]), "metadata": len(plan["metadata"]),
+                "unchanged": plan["unchanged"], "success": success}
+
+    def _cached(self, key, compute):
+        if self.result_cache is None:
+            return compute()
+        return self.result_cache.get_or_compute(key, compute)
+
+    def search_by_author(self, author, top_k=5, filter_expression=None):
+        """只按作者检索，直接查询作者索引，不调用嵌入模型"""
+        key = make_cache_key("author", normalize_text(author).lower(), filter_expression, top_k)
+        return self._cached(key, lambda: self.db.search_by_author(author, top_k=top_k, filter_expression=filter_expression))
+
+    def embed_query(self, query_text):
+        """生成单条查询的向量，优先从查询缓存中读取；失败时返回 None"""
+        if self.query_cache is not None:
+            vector = self.query_cache.get(query_text)
+            if vector is not None:
+                return vector
+
+        # 调用 embed 方法，它接收一个列表并返回一个列表
+        # 因此，即使只有一个查询文本，也要传入列表，并取结果列表的第一个元素
+        try:
+            query_vector_list = self.embedder.embed([query_text])
+        except Exception as e:
+            print(f"❌ 查询嵌入失败: {str(e)}")
+            return None
+        if not query_vector_list:
+            return None
+        if self.query_cache is not None:
+            self.query_cache.put(query_text, query_vector_list[0])
+        return query_vector_list[0]
 
-            prepared_batch = [{
-                **doc,
-                "vector": emb
-            } for doc, emb in zip(batch, embeddings)]
+    def embed_queries(self, query_texts):
+        """批量生成查询向量：先查查询缓存，其余文本一次送入嵌入模型；失败的位置为 None"""
+        vectors = [self.query_cache.get(text) if self.query_cache is not None else None for text in query_texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            try:
+                embeddings = self.embedder.embed([query_texts[i] for i in missing]) or []
+            except Exception as e:
+                print(f"❌ 查询嵌入失败: {str(e)}")
+                embeddings = []
+            for i, embedding in zip(missing, embeddings):
+                vectors[i] = embedding
+                if self.query_cache is not None:
+                    self.query_cache.put(query_texts[i], embedding)
+        return vectors
 
-            self.db.insert_documents(prepared_batch)
+    def retrieve_many(self, query_texts, top_k=5, filter_expression=None):
+        """
+        批量检索：所有查询一次生成嵌入，并通过一次数据库多查询调用完成检索。
 
-    def retrieve(self, query_text, top_k=5, filter_expression=None):
-        """执行检索"""
+        Returns:
+            list: 与 query_texts 一一对应的结果列表。
+        """
+        results = [[] for _ in query_texts]
+        keys = [make_cache_key("retrieve", normalize_text(text), filter_expression, top_k, None) for text in query_texts]
+        version = None
+        pending = []
+        for i, text in enumerate(query_texts):
+            if not text:
+                print("⚠️ 检索文本为空，无法执行检索。")
+                continue
+            if self.result_cache is not None:
+                cached, version = self.result_cache.get(keys[i])
+                if cached is not None:
+                    results[i] = cached
+                    continue
+            pending.append(i)
+        if not pending:
+            return results
+
+        vectors = self.embed_queries([query_texts[i] for i in pending])
+        valid = [(i, vector) for i, vector in zip(pending, vectors) if vector is not None]
+        for i, vector in zip(pending, vectors):
+            if vector is None:
+                print(f"❌ 无法为查询文本生成嵌入向量: '{query_texts[i]}'")
+        batch_results = self.db.similarity_search_many(
+            query_vectors=[vector for _, vector in valid],
+            top_k=top_k,
+            filter_expression=filter_expression
+        )
+        for (i, _), result in zip(valid, batch_results):
+            results[i] = result
+            if self.result_cache is not None:
+                self.result_cache.put(keys[i], result, version)
+        return results
+
+    def retrieve(self, query_text, top_k=5, filter_expression=None, author=None):
+        """执行检索（指定 author 时只在该作者的论文中检索）"""
         # 检查 query_text 是否为空
         if not query_text:
             print("⚠️ 检索文本为空，无法执行检索。")
             return []
-            
-        # 调用 embed 方法，它接收一个列表并返回一个列表
-        # 因此，即使只有一个查询文本，也要传入列表，并取结果列表的第一个元素
-        query_vector_list = self.embedder.embed([query_text])
-        
+        key = make_cache_key("retrieve", normalize_text(query_text), filter_expression, top_k,
+                             normalize_text(author).lower() if author else None)
+        return self._cached(key, lambda: self._retrieve(query_text, top_k, filter_expression, author))
+
+    def _retrieve(self, query_text, top_k, filter_expression, author):
+        query_vector = self.embed_query(query_text)
+
         # 确保返回了向量
-        if not query_vector_list:
+        if query_vector is None:
              print(f"❌ 无法为查询文本生成嵌入向量: '{query_text}'")
              return []
-             
-        query_vector = query_vector_list[0]
-        
+
         return self.db.similarity_search(
             query_vector=query_vector,
             top_k=top_k,
-            filter_expression=filter_expression
+            filter_expression=filter_expression,
+            author=author
         )
\ No newline at end of file
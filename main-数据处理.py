@@ -1,115 +1,86 @@
 import os
 import json
-import gradio as gr
 import argparse  # 添加参数解析器
-import torch
-import concurrent.futures
 import multiprocessing
 import time
 import numpy as np
-from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
-from docagent.retrieval.database.milvus_database import ChromaDatabase
+from docagent.retrieval.embedding.cache import EmbeddingCache, CachedEmbedding
+from docagent.retrieval.database.milvus_database import (ChromaDatabase, CHROMA_PERSIST_DIRECTORY, author_index_path,
+                                                         filter_stats_path, binary_index_path)
+from docagent.retrieval.database.author_index import AuthorIndex
+from docagent.retrieval.database.binary_index import BinaryIndex
+from docagent.retrieval.database.filter_stats import FilterStats
+from docagent.retrieval.database.year_partition import YearPartitionedDatabase, reset_year_partitions
 from docagent.retrieval.retriever.simple_retriever import SimpleRetriever
+from docagent.ingest.json_stream import iter_record_chunks, reset_peak_rss, peak_rss_mb
+from docagent.ingest.pipeline import IngestPipeline
+from docagent.ingest.normalize import ChunkNormalizer, process_paper
+from docagent.ingest.manifest import IngestManifest
+from docagent.ingest.delta import apply_delta_files
+from docagent.ingest.watch import DirectoryWatcher
+from docagent.ingest.retry import BatchRetry, DeadLetterFile
+from docagent.ingest.coordinator import IngestCoordinator, VLLMEmbedderFactory
+from docagent.retrieval.embedding.hashing_embedding import HashingEmbedding
+from docagent.retrieval.embedding.remote_embedding import RemoteEmbedding
 
-# 修改时间处理函数
-def process_publish_time(time_str):
-    """处理不同格式的发布时间"""
-    if not time_str or time_str == "Not Available":
-        return None
-    
-    try:
-        # 处理 ISO 格式时间 (如 "2022-11-21T19:10:33.302000Z")
-        if 'T' in time_str:
-            return int(time_str.split('T')[0].split('-')[0])
-        
-        # 处理简单日期格式 (如 "2025-01-02")
-        if '-' in time_str:
-            return int(time_str.split('-')[0])
-        
-        # 如果已经是整数，直接返回
-        if isinstance(time_str, (int, float)):
-            return int(time_str)
-            
-        return None
-    except Exception as e:
-        print(f"⚠️ 时间格式处理错误: {time_str}, 错误: {str(e)}")
-        return None
+# 每次送入嵌入模型的论文数（命令行 --embed-batch-size 与各导入入口共用的默认值）
+DEFAULT_EMBED_BATCH_SIZE = 512
 
-# 修改作者处理函数
-def process_authors(authors):
-    """处理作者列表，清理格式"""
-    if not authors:
-        return ""
-    
-    if isinstance(authors, list):
-        # 处理列表中的每个作者
-        processed_authors = []
-        for author in authors:
-            if author and isinstance(author, str):
-                # 移除多余的大括号和空格
-                author = author.strip().strip('{}').strip()
-                if author:
-                    # 如果作者字符串中包含 "and"，则分割
-                    if " and " in author:
-                        and_authors = [a.strip() for a in author.split(" and ") if a.strip()]
-                        processed_authors.extend(and_authors)
-                    else:
-                        processed_authors.append(author)
-        return ", ".join(processed_authors)
-    elif isinstance(authors, str):
-        # 处理字符串形式的作者列表
-        authors = authors.strip()
-        if " and " in authors:
-            # 分割并处理 "and" 分隔的作者
-            and_authors = [a.strip() for a in authors.split(" and ") if a.strip()]
-            return ", ".join(and_authors)
-        return authors
-    return ""
-
-def process_paper(paper):
-    """处理单篇论文数据"""
+def make_batch_retry(collection_name, max_retries=3, retry_backoff=1.0, dead_letter_path=None):
+    """导入时的批次失败处理：退避重试，仍失败时二分隔离出错的论文并写入死信文件"""
+    if dead_letter_path is None:
+        dead_letter_path = os.path.join(CHROMA_PERSIST_DIRECTORY, f"dead_letter_{collection_name}.jsonl")
+    return BatchRetry(retries=max_retries, backoff=retry_backoff, dead_letter=DeadLetterFile(dead_letter_path))
+
+
+def ingest_file_streaming(file_path, retriever, normalizer, chunk_size=1000, report_memory=False, manifest=None,
+                          embed_batch_size=DEFAULT_EMBED_BATCH_SIZE):
+    """流式导入单个文件：逐条解析记录，按固定大小分块处理、嵌入并入库
+
+    内存占用只与 chunk_size 有关，与文件大小无关。返回成功导入的论文数。
+    提供 manifest 时每处理完一块就记录进度，中断后从上次的位置继续。
+    """
+    if report_memory:
+        reset_peak_rss()
+
+    consumed = 0
+    if manifest is not None:
+        completed, consumed = manifest.status(file_path)
+        if completed:
+            print(f"⏭️ 跳过已导入的文件: {os.path.basename(file_path)}")
+            return 0
+        if consumed:
+            print(f"⏩ {os.path.basename(file_path)} 从第 {consumed} 条记录继续导入")
+
+    file_count = 0
+    checkpoint = manifest is not None
     try:
-        # 处理字段名称映射
-        if "abstract" in paper:
-            paper["summary"] = paper.pop("abstract")
-        if "journal_name" in paper:
-            paper["venue"] = paper.pop("journal_name")
-        if "publish_time" in paper:
-            paper["published"] = paper.pop("publish_time")
-        
-        # 处理作者列表
-        if "authors" in paper:
-            paper["authors"] = process_authors(paper["authors"])
-        
-        # 处理发布时间
-        if "published" in paper:
-            processed_time = process_publish_time(paper["published"])
-            if processed_time is not None:
-                paper["published"] = processed_time
-            else:
-                return None
-        
-        # 确保必要字段存在
-        if not all(key in paper for key in ["title", "authors", "summary"]):
-            return None
-        
-        # 处理期刊名称
-        if "venue" not in paper:
-            paper["venue"] = "未知"
-        elif not paper["venue"]:
-            paper["venue"] = "未知"
-        elif isinstance(paper["venue"], str):
-            paper["venue"] = paper["venue"].strip()
-            if paper["venue"] == "":
-                paper["venue"] = "未知"
-        
-        return paper
+        for records in iter_record_chunks(file_path, chunk_size=chunk_size, start=consumed):
+            chunk_papers = normalizer(records)
+            consumed += len(records)
+            if chunk_papers:
+                if not retriever.add_batched_documents(chunk_papers, batch_size=embed_batch_size):
+                    # 写入失败后不再推进进度，下次运行时从失败的位置重新导入
+                    checkpoint = False
+                file_count += len(chunk_papers)
+            if checkpoint:
+                manifest.update(file_path, consumed)
+        if checkpoint:
+            manifest.update(file_path, consumed, completed=True)
     except Exception as e:
-        print(f"⚠️ 处理论文数据时出错: {str(e)}")
-        return None
+        print(f"❌ 处理文件出错: {os.path.basename(file_path)} (已导入 {file_count} 篇): {str(e)}")
+
+    if report_memory:
+        print(f"📈 {os.path.basename(file_path)}: 导入 {file_count} 篇，峰值内存 {peak_rss_mb():.1f} MB")
+    return file_count
 
 # 系统初始化函数 - 多GPU并行处理
-def initialize_system(data_dir="/home/dataset-assist-0/data/paperagent/data", reset_db=False, gpu_count=8, data_parallel_rank=0, data_parallel_size=1):
+def initialize_system(data_dir="/home/dataset-assist-0/data/paperagent/data", reset_db=False, gpu_count=8, data_parallel_rank=0, data_parallel_size=1,
+                      stream=False, chunk_size=1000, report_memory=False, pipeline=False, queue_size=4, normalize_workers=None,
+                      manifest_path=None, use_manifest=True, embedding_cache_dir=None, embed_batch_size=DEFAULT_EMBED_BATCH_SIZE,
+                      max_tokens=None, max_batch_tokens=32768, embedding_server=None, year_partition_span=0,
+                      watch=False, max_latency=60.0, poll_interval=5.0, max_retries=3, retry_backoff=1.0,
+                      dead_letter_path=None):
     """系统初始化函数，从指定文件夹加载所有JSON文件，利用多GPU并行处理
     
     Parameters:
@@ -124,44 +95,130 @@ def initialize_system(data_dir="/home/dataset-assist-0/data/paperagent/data", re
         数据并行组的排名（0或1）
     data_parallel_size: int
         数据并行组的数量（通常为2）
+    stream: bool
+        是否使用流式读取模式（逐条解析 JSON 数组 / JSON Lines，内存占用恒定）
+    chunk_size: int
+        流式模式下每次处理、嵌入的记录数
+    report_memory: bool
+        是否输出每个文件处理期间的峰值内存
+    pipeline: bool
+        是否使用解析、嵌入、入库并发执行的流水线模式（隐含流式读取）
+    queue_size: int
+        流水线模式下阶段之间队列缓存的批次数
+    normalize_workers: int
+        论文记录规范化使用的进程数，默认使用全部CPU核心
+    manifest_path: str
+        导入清单路径，默认保存在 ChromaDB 目录下并按集合区分
+    use_manifest: bool
+        是否使用导入清单跳过已完成的文件并支持断点续传
+    embedding_cache_dir: str
+        嵌入缓存目录，设置后已计算过的文本直接从磁盘读取向量
+    embed_batch_size: int
+        每次送入嵌入模型的论文数；模型内部会按长度分桶并按 token 预算拆分，较大的值分桶效果更好
+    max_tokens: int
+        单篇论文文本的最大 token 数，超出部分截断（默认使用模型最大长度）
+    max_batch_tokens: int
+        每次调用模型的 token 预算
+    embedding_server: str
+        常驻嵌入服务地址，设置后使用服务端已加载的模型，不在本进程加载
+    year_partition_span: int
+        大于 0 时按发表年份把论文写入 <集合>_y<年份> 分区集合，每个分区包含的年数
+    watch: bool
+        守护模式：导入尚未导入的文件后持续监视数据目录，新增或变化的文件按微批次导入（阻塞直到 Ctrl+C）
+    max_latency: float
+        守护模式下不满 embed_batch_size 的论文最长等待时间（秒）
+    poll_interval: float
+        守护模式下扫描数据目录的间隔（秒）
+    max_retries: int
+        嵌入或写入失败时整批重试的次数，仍失败时二分定位出错的论文
+    retry_backoff: float
+        第一次重试前等待的秒数，之后每次翻倍
+    dead_letter_path: str
+        无法处理的论文写入的死信文件（默认保存在ChromaDB目录下）
     """
     try:
         start_time = time.time()
+
+        # 在加载模型（初始化 CUDA）之前创建规范化进程池
+        normalizer = ChunkNormalizer(workers=normalize_workers)
+        print(f"⚙️ 论文规范化进程数: {normalizer.workers}")
         
         # 初始化嵌入模型
-        tensor_parallel_size = 4  # 使用4个GPU做张量并行
-        print(f"⏳ 初始化嵌入模型 (tensor_parallel_size={tensor_parallel_size})...")
-        embedding = VLLMQwenEmbedding(tensor_parallel_size=tensor_parallel_size)
-        print("✅ 嵌入模型初始化完成")
+        if embedding_server:
+            embedding = RemoteEmbedding(embedding_server)
+        else:
+            tensor_parallel_size = 4  # 使用4个GPU做张量并行
+            print(f"⏳ 初始化嵌入模型 (tensor_parallel_size={tensor_parallel_size})...")
+            from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
+            embedding = VLLMQwenEmbedding(tensor_parallel_size=tensor_parallel_size, max_tokens=max_tokens,
+                                          max_batch_tokens=max_batch_tokens)
+            print("✅ 嵌入模型初始化完成")
+        if embedding_cache_dir:
+            embedding = CachedEmbedding(embedding, EmbeddingCache(embedding_cache_dir, embedding.model_name, embedding.embedding_dim,
+                                                                  max_tokens=getattr(embedding, "max_tokens", None)))
+            print(f"✅ 已启用嵌入缓存: {embedding_cache_dir}")
 
         # 初始化数据库和检索器
         collection_name = f"papers0520_dp{data_parallel_rank}" if data_parallel_size > 1 else "papers0520"
         print(f"💾 使用集合: {collection_name}")
-        database = ChromaDatabase(collection_name=collection_name, dim=embedding.embedding_dim)
+        if year_partition_span > 0:
+            print(f"📅 按年份分区写入 (每个分区 {year_partition_span} 年)")
+            if reset_db:
+                reset_year_partitions(collection_name)
+            database = YearPartitionedDatabase(collection_name, dim=embedding.embedding_dim, span=year_partition_span)
+        else:
+            database = ChromaDatabase(collection_name=collection_name, dim=embedding.embedding_dim)
         
+        # 导入清单：记录已完成的文件，重新运行时跳过
+        manifest = None
+        if use_manifest:
+            if manifest_path is None:
+                manifest_path = os.path.join(CHROMA_PERSIST_DIRECTORY, f"ingest_manifest_{collection_name}.json")
+            manifest = IngestManifest(manifest_path)
+
         # 如果需要重置数据库，则删除集合重新创建
-        if reset_db:
+        if reset_db and year_partition_span > 0:
+            if manifest is not None:
+                manifest.reset()
+            print("✅ 数据库已重置")
+        elif reset_db:
             try:
-                database.client.delete_collection("papers0520")
+                database.client.delete_collection(collection_name)
                 database.collection = database.client.create_collection(
-                    name="papers0520",
+                    name=collection_name,
                     metadata={"hnsw:space": "cosine", "dimension": embedding.embedding_dim}
                 )
                 database.doc_count = 0
+                database.author_index.reset()
+                database.filter_stats.reset()
+                if database._open_binary_index() is not None:
+                    database.binary_index.reset()
+                if manifest is not None:
+                    manifest.reset()
                 print("✅ 数据库已重置")
             except Exception as e:
                 print(f"⚠️ 重置数据库失败: {str(e)}")
         
-        retriever = SimpleRetriever(embedding, database)
+        batch_retry = make_batch_retry(collection_name, max_retries, retry_backoff, dead_letter_path)
+        retriever = SimpleRetriever(embedding, database, batch_retry=batch_retry)
         print("✅ 数据库和检索器初始化完成")
+
+        if watch:
+            # 守护模式：首次扫描即导入目录中尚未导入的文件，之后持续导入新到达的文件
+            watcher = DirectoryWatcher(data_dir, retriever, normalizer, manifest=manifest, batch_size=embed_batch_size,
+                                       max_latency=max_latency, poll_interval=poll_interval, chunk_size=chunk_size)
+            with normalizer:
+                watcher.run()
+            return retriever
         
         # 检查数据目录是否存在
         if not os.path.exists(data_dir):
             print(f"⚠️ 数据目录 {data_dir} 不存在，系统将以空数据库启动")
             return retriever
         
-        # 获取所有JSON文件
-        json_files = [f for f in os.listdir(data_dir) if f.endswith('.json')]
+        # 获取所有JSON文件（流式模式同时支持 JSON Lines）
+        extensions = ('.json', '.jsonl') if stream or pipeline else ('.json',)
+        json_files = [f for f in os.listdir(data_dir) if f.endswith(extensions)]
         json_files.sort()  # 按文件名排序
         total_files = len(json_files)
         
@@ -177,57 +234,97 @@ def initialize_system(data_dir="/home/dataset-assist-0/data/paperagent/data", re
             json_files = json_files[start_idx:end_idx]
             print(f"📊 数据并行组 {data_parallel_rank+1}/{data_parallel_size}，处理 {len(json_files)}/{total_files} 个文件")
         
-        print(f"⏳ 开始处理 {len(json_files)} 个文件...")
         total_papers = 0
         file_paths = [os.path.join(data_dir, filename) for filename in json_files]
         processed_files = 0
+
+        # 跳过清单中已完成导入且内容未变化的文件
+        if manifest is not None:
+            file_paths = [p for p in file_paths if not manifest.status(p)[0]]
+            if len(file_paths) < len(json_files):
+                print(f"⏭️ 跳过 {len(json_files) - len(file_paths)} 个已导入的文件")
+        print(f"⏳ 开始处理 {len(file_paths)} 个文件...")
         
-        # 创建进程池，处理每个文件
-        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
-            for batch_start in range(0, len(file_paths), 10):  # 每次处理10个文件
-                batch_end = min(batch_start + 10, len(file_paths))
-                batch_files = file_paths[batch_start:batch_end]
+        # 使用进程池规范化论文数据，处理每个文件
+        with normalizer:
+            if pipeline:
+                # 流水线模式：解析、嵌入、入库三个阶段并发执行
+                ingest_pipeline = IngestPipeline(retriever, normalizer, chunk_size=chunk_size,
+                                                 batch_size=embed_batch_size, queue_size=queue_size, manifest=manifest)
+                total_papers = ingest_pipeline.run(file_paths)
+            elif stream:
+                # 流式模式：逐个文件、逐块处理，不再一次性加载10个文件
+                for file_path in file_paths:
+                    total_papers += ingest_file_streaming(file_path, retriever, normalizer,
+                                                          chunk_size=chunk_size, report_memory=report_memory,
+                                                          manifest=manifest, embed_batch_size=embed_batch_size)
+                    processed_files += 1
+                    progress = processed_files / len(file_paths) * 100
+                    print(f"🔄 已处理: {processed_files}/{len(file_paths)} 个文件 ({progress:.1f}%)，总计已导入: {total_papers} 篇论文")
+            else:
+                for batch_start in range(0, len(file_paths), 10):  # 每次处理10个文件
+                    batch_end = min(batch_start + 10, len(file_paths))
+                    batch_files = file_paths[batch_start:batch_end]
                 
-                # 并行处理每个文件
-                file_papers_list = []
-                for file_path in batch_files:
-                    try:
-                        # 读取JSON文件
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            papers = json.load(f)
+                    # 并行处理每个文件
+                    file_papers_list = []
+                    loaded_files = []
+                    for file_path in batch_files:
+                        if report_memory:
+                            reset_peak_rss()
+                        try:
+                            # 读取JSON文件
+                            with open(file_path, 'r', encoding='utf-8') as f:
+                                papers = json.load(f)
                         
-                        # 处理论文数据
-                        file_papers = []
-                        if isinstance(papers, list):
-                            paper_results = list(executor.map(process_paper, papers))
-                            file_papers = [p for p in paper_results if p]
-                        elif isinstance(papers, dict):
-                            processed_paper = process_paper(papers)
-                            if processed_paper:
-                                file_papers.append(processed_paper)
+                            # 处理论文数据
+                            file_papers = []
+                            if isinstance(papers, list):
+                                file_papers = normalizer(papers)
+                            elif isinstance(papers, dict):
+                                processed_paper = process_paper(papers)
+                                if processed_paper:
+                                    file_papers.append(processed_paper)
                         
-                        file_papers_list.extend(file_papers)
-                    except Exception as e:
-                        print(f"❌ 处理文件出错: {os.path.basename(file_path)}")
+                            file_papers_list.extend(file_papers)
+                            loaded_files.append((file_path, len(papers) if isinstance(papers, list) else 1))
+                        except Exception as e:
+                            print(f"❌ 处理文件出错: {os.path.basename(file_path)}")
+                        if report_memory:
+                            print(f"📈 {os.path.basename(file_path)}: 峰值内存 {peak_rss_mb():.1f} MB")
                 
-                processed_files += len(batch_files)
-                progress = processed_files / len(file_paths) * 100
-                print(f"🔄 已处理: {processed_files}/{len(file_paths)} 个文件 ({progress:.1f}%)")
+                    processed_files += len(batch_files)
+                    progress = processed_files / len(file_paths) * 100
+                    print(f"🔄 已处理: {processed_files}/{len(file_paths)} 个文件 ({progress:.1f}%)")
                 
-                # 处理完一批文件后生成嵌入并导入数据库
-                if file_papers_list:
-                    # 分批处理嵌入，提高批处理大小以提升GPU利用率
-                    for i in range(0, len(file_papers_list), 128):
-                        batch_papers = file_papers_list[i:i+128]
-                        # 使用检索器添加文档
-                        retriever.add_batched_documents(batch_papers, batch_size=128)
+                    # 处理完一批文件后生成嵌入并导入数据库
+                    if file_papers_list:
+                        # 分批处理嵌入，提高批处理大小以提升GPU利用率
+                        batch_success = True
+                        for i in range(0, len(file_papers_list), embed_batch_size):
+                            batch_papers = file_papers_list[i:i+embed_batch_size]
+                            # 使用检索器添加文档
+                            if not retriever.add_batched_documents(batch_papers, batch_size=embed_batch_size):
+                                batch_success = False
                     
-                    total_papers += len(file_papers_list)
-                    print(f"📝 总计已导入: {total_papers} 篇论文")
+                        total_papers += len(file_papers_list)
+                        print(f"📝 总计已导入: {total_papers} 篇论文")
+                    else:
+                        batch_success = True
+
+                    # 整批文件全部写入成功后才记为完成
+                    if manifest is not None and batch_success:
+                        for file_path, record_count in loaded_files:
+                            manifest.update(file_path, record_count, completed=True)
         
         end_time = time.time()
         processing_time = end_time - start_time
         
+        if embedding_cache_dir:
+            print(f"📊 嵌入缓存统计: {embedding.cache.stats()}")
+        if batch_retry.dead_letter.count:
+            print(f"📮 {batch_retry.dead_letter.count} 篇论文无法处理，已写入死信文件 {batch_retry.dead_letter.path}")
+
         if total_papers > 0:
             print(f"\n✅ 处理完成: 导入 {total_papers} 篇论文，用时 {processing_time:.2f} 秒，平均每文件 {processing_time/len(json_files):.2f} 秒")
         else:
@@ -241,6 +338,74 @@ def initialize_system(data_dir="/home/dataset-assist-0/data/paperagent/data", re
         traceback.print_exc()
         return None
 
+# 单命令数据并行导入
+def run_data_parallel_ingest(data_dir, num_workers, gpu_count=8, reset_db=False, collection_name="papers0520",
+                             manifest_path=None, chunk_size=1000, embed_batch_size=DEFAULT_EMBED_BATCH_SIZE, max_restarts=3,
+                             embedding_cache_dir=None, max_tokens=None, max_batch_tokens=32768, stand_in_embedder=False,
+                             year_partition_span=0, max_retries=3, retry_backoff=1.0, dead_letter_path=None):
+    """启动多个工作进程并行生成嵌入，由协调器直接写入主集合，无需再手动合并
+
+    Returns:
+        bool: 所有分片是否都处理成功
+    """
+    start_time = time.time()
+    if manifest_path is None:
+        manifest_path = os.path.join(CHROMA_PERSIST_DIRECTORY, f"ingest_manifest_{collection_name}.json")
+    manifest = IngestManifest(manifest_path)
+
+    if reset_db:
+        import chromadb
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        try:
+            client.delete_collection(collection_name)
+        except Exception as e:
+            print(f"⚠️ 删除集合 {collection_name} 失败: {str(e)}")
+        manifest.reset()
+        AuthorIndex(author_index_path(collection_name)).reset()
+        FilterStats(filter_stats_path(collection_name)).reset()
+        if BinaryIndex.exists(binary_index_path(collection_name)):
+            BinaryIndex(binary_index_path(collection_name)).reset()
+        reset_year_partitions(collection_name)
+        print("✅ 数据库已重置")
+
+    if not os.path.exists(data_dir):
+        print(f"⚠️ 数据目录 {data_dir} 不存在")
+        return False
+    file_paths = sorted(os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith(('.json', '.jsonl')))
+
+    if stand_in_embedder:
+        # CPU 上的哈希嵌入，仅用于在没有 GPU 的环境下测试协调器流程
+        embedder_factory = HashingEmbedding
+        gpu_ids = None
+    else:
+        embedder_factory = VLLMEmbedderFactory(
+            tensor_parallel_size=max(1, gpu_count // num_workers),
+            embedding_cache_dir=embedding_cache_dir,
+            max_tokens=max_tokens,
+            max_batch_tokens=max_batch_tokens,
+        )
+        gpu_ids = list(range(gpu_count))
+
+    coordinator = IngestCoordinator(
+        database_factory=lambda dim: (YearPartitionedDatabase(collection_name, dim=dim, span=year_partition_span)
+                                      if year_partition_span > 0 else ChromaDatabase(collection_name=collection_name, dim=dim)),
+        embedder_factory=embedder_factory,
+        num_workers=num_workers,
+        manifest=manifest,
+        gpu_ids=gpu_ids,
+        max_restarts=max_restarts,
+        chunk_size=chunk_size,
+        batch_size=embed_batch_size,
+        batch_retry=make_batch_retry(collection_name, max_retries, retry_backoff, dead_letter_path),
+    )
+    total_papers, failed_shards = coordinator.run(file_paths)
+
+    print(f"\n✅ 数据并行导入结束: 写入 {total_papers} 篇论文，用时 {time.time() - start_time:.2f} 秒")
+    if failed_shards:
+        print(f"❌ 以下分片失败: {failed_shards}，重新运行相同命令即可从中断处继续")
+        return False
+    return True
+
 # 修改构建Milvus过滤表达式函数
 def build_filters(journal=None, min_year=None, max_year=None, author=None):
     """构建Milvus过滤表达式"""
@@ -339,18 +504,18 @@ def analyze_authors_publications(keyword1, keyword2, keyword3, keyword4, keyword
         else:
             filter_expr = 'venue != "nature"'
             
-        # 对每个关键词进行检索
-        for keyword in keywords:
-            try:
-                results = retriever.retrieve(query_text=keyword, top_k=200, filter_expression=filter_expr)
-                # 存储完整的论文信息
-                for paper in results:
-                    title = paper['entity']['title']
-                    if title not in papers_dict:  # 避免重复添加
-                        papers_dict[title] = paper['entity']
-            except Exception as e:
-                print(f"检索关键词 '{keyword}' 时出错: {str(e)}")
-                continue
+        # 所有关键词一次批量检索（一次嵌入调用、一次数据库查询）
+        try:
+            results_per_keyword = retriever.retrieve_many(keywords, top_k=200, filter_expression=filter_expr)
+        except Exception as e:
+            print(f"批量检索关键词 {keywords} 时出错: {str(e)}")
+            results_per_keyword = []
+        for results in results_per_keyword:
+            # 存储完整的论文信息
+            for paper in results:
+                title = paper['entity']['title']
+                if title not in papers_dict:  # 避免重复添加
+                    papers_dict[title] = paper['entity']
                 
         if not papers_dict:
             return "<div class='output-container'><div style='text-align:center;color:#666;'>🔍 未找到相关论文</div></div>"
@@ -542,121 +707,131 @@ journal_list = ["nature", "science", "cell"]
 year_list = [str(year) for year in range(2025, 1899, -1)]
 
 # 更新Gradio界面
-with gr.Blocks(title="AI4s学术论文智能检索平台", theme=gr.themes.Soft(), css=css) as interface:
-    gr.Markdown("""
-        # 📚 AI4s学术论文智能检索平台
-        ### 智能检索您需要的学术论文
-    """)
+def build_interface():
+    """
+    构建 Gradio 界面。只在启动界面时调用：数据并行导入的工作进程以 spawn 方式重新导入本模块，
+    模块级不导入 gradio / vLLM、不构建界面，工作进程启动时不必加载这些依赖。
+    """
+    import gradio as gr
+
+    with gr.Blocks(title="AI4s学术论文智能检索平台", theme=gr.themes.Soft(), css=css) as interface:
+        gr.Markdown("""
+            # 📚 AI4s学术论文智能检索平台
+            ### 智能检索您需要的学术论文
+        """)
     
-    # 创建标签页
-    with gr.Tabs():
-        # 论文检索标签页
-        with gr.Tab("论文检索"):
-            with gr.Row(equal_height=True):
-                # 左侧输入面板
-                with gr.Column(scale=1, min_width=300):
-                    with gr.Column(elem_classes="input-container"):
-                        # 基础搜索区域
-                        with gr.Column(elem_classes="search-group"):
-                            gr.Markdown("### 📝 基础搜索", elem_classes="search-group-title")
-                            title_input = gr.Textbox(
-                                label="论文标题",
-                                placeholder="输入论文标题（选填）...",
-                            )
-                            abstract_input = gr.TextArea(
-                                label="论文摘要",
-                                placeholder="输入论文摘要（选填）...",
-                                lines=4,
-                            )
-                        
-                        # 高级筛选区域
-                        with gr.Accordion("🔍 高级筛选", open=True):
+        # 创建标签页
+        with gr.Tabs():
+            # 论文检索标签页
+            with gr.Tab("论文检索"):
+                with gr.Row(equal_height=True):
+                    # 左侧输入面板
+                    with gr.Column(scale=1, min_width=300):
+                        with gr.Column(elem_classes="input-container"):
+                            # 基础搜索区域
                             with gr.Column(elem_classes="search-group"):
-                                author_input = gr.Textbox(
-                                    label="作者姓名",
-                                    placeholder="输入作者姓名，支持模糊匹配...",
+                                gr.Markdown("### 📝 基础搜索", elem_classes="search-group-title")
+                                title_input = gr.Textbox(
+                                    label="论文标题",
+                                    placeholder="输入论文标题（选填）...",
                                 )
-                                journal_input = gr.Dropdown(
-                                    label="目标期刊",
-                                    choices=journal_list,
-                                    value=None,
+                                abstract_input = gr.TextArea(
+                                    label="论文摘要",
+                                    placeholder="输入论文摘要（选填）...",
+                                    lines=4,
                                 )
-                                with gr.Row():
-                                    min_year_input = gr.Dropdown(
-                                        label="起始年份",
-                                        choices=year_list,
-                                        value=None
+                        
+                            # 高级筛选区域
+                            with gr.Accordion("🔍 高级筛选", open=True):
+                                with gr.Column(elem_classes="search-group"):
+                                    author_input = gr.Textbox(
+                                        label="作者姓名",
+                                        placeholder="输入作者姓名，支持模糊匹配...",
                                     )
-                                    max_year_input = gr.Dropdown(
-                                        label="结束年份",
-                                        choices=year_list,
-                                        value=None
+                                    journal_input = gr.Dropdown(
+                                        label="目标期刊",
+                                        choices=journal_list,
+                                        value=None,
                                     )
+                                    with gr.Row():
+                                        min_year_input = gr.Dropdown(
+                                            label="起始年份",
+                                            choices=year_list,
+                                            value=None
+                                        )
+                                        max_year_input = gr.Dropdown(
+                                            label="结束年份",
+                                            choices=year_list,
+                                            value=None
+                                        )
                         
-                        # 搜索控制区域
-                        with gr.Row():
-                            top_k_input = gr.Slider(
-                                minimum=1,
-                                maximum=30,
-                                value=3,
-                                step=1,
-                                label="显示论文数量"
-                            )
-                            search_btn = gr.Button(
-                                "开始检索",
-                                variant="primary",
-                                scale=1
-                            )
+                            # 搜索控制区域
+                            with gr.Row():
+                                top_k_input = gr.Slider(
+                                    minimum=1,
+                                    maximum=30,
+                                    value=3,
+                                    step=1,
+                                    label="显示论文数量"
+                                )
+                                search_btn = gr.Button(
+                                    "开始检索",
+                                    variant="primary",
+                                    scale=1
+                                )
 
-                # 右侧结果面板
-                with gr.Column(scale=2):
-                    output_panel = gr.HTML(
-                        value="<div class='output-container'><div style='text-align:center;color:#666;padding:20px;'>等待检索，请输入搜索条件...</div></div>"
-                    )
+                    # 右侧结果面板
+                    with gr.Column(scale=2):
+                        output_panel = gr.HTML(
+                            value="<div class='output-container'><div style='text-align:center;color:#666;padding:20px;'>等待检索，请输入搜索条件...</div></div>"
+                        )
 
-        # 作者统计标签页
-        with gr.Tab("作者统计"):
-            with gr.Column():
-                with gr.Column(elem_classes="input-container"):
-                    # 修改为6个关键词输入框
-                    keywords_inputs = []
-                    for i in range(6):
-                        keywords_inputs.append(
-                            gr.Textbox(
-                                label=f"研究领域关键词 {i+1}",
-                                placeholder=f"输入第{i+1}个研究领域关键词...",
-                                value="" if i > 0 else "ai for science"
+            # 作者统计标签页
+            with gr.Tab("作者统计"):
+                with gr.Column():
+                    with gr.Column(elem_classes="input-container"):
+                        # 修改为6个关键词输入框
+                        keywords_inputs = []
+                        for i in range(6):
+                            keywords_inputs.append(
+                                gr.Textbox(
+                                    label=f"研究领域关键词 {i+1}",
+                                    placeholder=f"输入第{i+1}个研究领域关键词...",
+                                    value="" if i > 0 else "ai for science"
+                                )
                             )
-                        )
-                    with gr.Row():
-                        stat_min_year = gr.Dropdown(
-                            label="起始年份",
-                            choices=year_list,
-                            value=None
-                        )
-                        stat_max_year = gr.Dropdown(
-                            label="结束年份",
-                            choices=year_list,
-                            value=None
-                        )
-                    analyze_btn = gr.Button("开始统计", variant="primary")
+                        with gr.Row():
+                            stat_min_year = gr.Dropdown(
+                                label="起始年份",
+                                choices=year_list,
+                                value=None
+                            )
+                            stat_max_year = gr.Dropdown(
+                                label="结束年份",
+                                choices=year_list,
+                                value=None
+                            )
+                        analyze_btn = gr.Button("开始统计", variant="primary")
                 
-                stats_output = gr.HTML(
-                    value="<div class='output-container'><div style='text-align:center;color:#666;'>等待统计...</div></div>"
-                )
+                    stats_output = gr.HTML(
+                        value="<div class='output-container'><div style='text-align:center;color:#666;'>等待统计...</div></div>"
+                    )
     
-    # 事件绑定
-    search_btn.click(
-        fn=search_papers,
-        inputs=[title_input, abstract_input, top_k_input, journal_input, min_year_input, max_year_input, author_input],
-        outputs=output_panel
-    )
+        # 事件绑定
+        search_btn.click(
+            fn=search_papers,
+            inputs=[title_input, abstract_input, top_k_input, journal_input, min_year_input, max_year_input, author_input],
+            outputs=output_panel
+        )
     
-    analyze_btn.click(
-        fn=analyze_authors_publications,
-        inputs=[*keywords_inputs, stat_min_year, stat_max_year],
-        outputs=stats_output
-    )
+        analyze_btn.click(
+            fn=analyze_authors_publications,
+            inputs=[*keywords_inputs, stat_min_year, stat_max_year],
+            outputs=stats_output
+        )
+
+    return interface
+
 
 if __name__ == "__main__":
     # 添加命令行参数
@@ -669,108 +844,214 @@ if __name__ == "__main__":
     parser.add_argument('--dp-rank', type=int, default=0, help='数据并行组编号(0或1)')
     parser.add_argument('--dp-size', type=int, default=1, help='数据并行组数量(通常为2)')
     parser.add_argument('--merge', action='store_true', help='合并所有数据并行集合到主集合')
+    parser.add_argument('--merge-batch-size', type=int, default=5000, help='合并时每批读取和写入的记录数')
+    parser.add_argument('--migrate-slim', type=str, default=None, metavar='COLLECTION', help='将旧结构集合改写为精简元数据结构，并输出磁盘占用与查询延迟对比')
+    parser.add_argument('--build-author-index', type=str, default=None, metavar='COLLECTION', help='从集合元数据重新构建作者索引与过滤统计')
+    parser.add_argument('--export-numpy', type=str, default=None, metavar='DIR', help='将主集合导出为NumPy内存映射向量库')
+    parser.add_argument('--numpy-dtype', type=str, default='float16', choices=['float16', 'float32'], help='导出向量库的存储类型')
+    parser.add_argument('--build-binary-index', type=str, default=None, metavar='COLLECTION', help='从集合向量增量构建二值量化索引(构建后随写入自动更新)')
+    parser.add_argument('--build-ivfpq', type=str, default=None, metavar='DIR', help='在主集合向量样本上训练并构建IVF-PQ索引')
+    parser.add_argument('--evaluate-ivfpq', type=str, default=None, metavar='DIR', help='测试IVF-PQ索引各nprobe下的recall@k与延迟')
+    parser.add_argument('--ivf-nlist', type=int, default=1024, help='IVF-PQ粗聚类中心(倒排表)数')
+    parser.add_argument('--pq-m', type=int, default=64, help='乘积量化段数(每篇论文的编码字节数，需整除向量维度)')
+    parser.add_argument('--ivf-sample-size', type=int, default=50000, help='IVF-PQ训练样本数')
+    parser.add_argument('--nprobes', type=str, default='1,4,16,64', help='测试的nprobe取值(逗号分隔)')
+    parser.add_argument('--ivfpq-rerank-factor', type=int, default=1, help='测试IVF-PQ时候选数相对Top K的倍数，大于1时读取原始向量精确重排')
+    parser.add_argument('--build-reduced-index', type=str, default=None, metavar='DIR', help='为NumPy向量库构建或补齐两阶段检索的低维索引')
+    parser.add_argument('--benchmark-reduced', type=str, default=None, metavar='DIR', help='在NumPy向量库上测试各降维维度的recall@k与延迟')
+    parser.add_argument('--reduced-dims', type=str, default='64,128,256,512', help='低维索引的维度(逗号分隔)')
+    parser.add_argument('--reduced-method', type=str, default='pca', choices=['pca', 'truncate'], help='降维方法(PCA或Matryoshka式截断)')
+    parser.add_argument('--rerank-factor', type=int, default=10, help='两阶段检索精排的候选数相对Top K的倍数')
+    parser.add_argument('--swap', action='store_true', help='迁移完成后由新集合接管原集合名称')
+    parser.add_argument('--delete-legacy', action='store_true', help='交换后删除旧结构集合')
+    parser.add_argument('--stream', action='store_true', help='流式读取JSON数组/JSON Lines，内存占用与文件大小无关')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='流式模式下每块处理的论文数')
+    parser.add_argument('--report-memory', action='store_true', help='输出每个文件处理期间的峰值内存')
+    parser.add_argument('--pipeline', action='store_true', help='解析、嵌入、入库并发执行的流水线模式')
+    parser.add_argument('--queue-size', type=int, default=4, help='流水线阶段之间队列缓存的批次数')
+    parser.add_argument('--normalize-workers', type=int, default=None, help='论文规范化进程数(默认使用全部CPU核心)')
+    parser.add_argument('--manifest', type=str, default=None, help='导入清单路径(默认保存在ChromaDB目录下)')
+    parser.add_argument('--no-manifest', action='store_true', help='不使用导入清单，重新处理所有文件')
+    parser.add_argument('--embedding-cache', type=str, default=None, help='嵌入缓存目录(重建集合时复用已计算的向量)')
+    parser.add_argument('--embed-batch-size', type=int, default=DEFAULT_EMBED_BATCH_SIZE, help='每次送入嵌入模型的论文数')
+    parser.add_argument('--max-tokens', type=int, default=None, help='单篇论文文本的最大token数(超出截断)')
+    parser.add_argument('--max-batch-tokens', type=int, default=32768, help='每次调用嵌入模型的token预算')
+    parser.add_argument('--dp-workers', type=int, default=0, help='单命令数据并行导入的工作进程数(由协调器启动并直接写入主集合)')
+    parser.add_argument('--max-restarts', type=int, default=3, help='数据并行导入中每个分片失败后最多重启的次数')
+    parser.add_argument('--stand-in-embedder', action='store_true', help='工作进程使用CPU哈希嵌入代替模型(用于测试协调器)')
+    parser.add_argument('--embedding-server', type=str, default=None, help='常驻嵌入服务地址(如 http://127.0.0.1:8765)，设置后不在本进程加载模型')
+    parser.add_argument('--year-partition-span', type=int, default=0, help='按发表年份写入分区集合，每个分区包含的年数(0表示不分区)')
+    parser.add_argument('--max-retries', type=int, default=3, help='嵌入或写入失败时整批重试的次数，仍失败时二分定位出错的论文')
+    parser.add_argument('--retry-backoff', type=float, default=1.0, help='第一次重试前等待的秒数(之后每次翻倍)')
+    parser.add_argument('--dead-letter', type=str, default=None, help='无法处理的论文写入的死信文件(默认保存在ChromaDB目录下)')
+    parser.add_argument('--watch', action='store_true', help='守护模式：持续监视数据目录，新增或变化的文件按微批次导入(不启动界面)')
+    parser.add_argument('--max-latency', type=float, default=60.0, help='守护模式下不满一批的论文最长等待时间(秒)')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='守护模式下扫描数据目录的间隔(秒)')
+    parser.add_argument('--apply-delta', type=str, default=None, metavar='PATH', help='应用增量文件(单个文件或目录)：只为标题/摘要变化的论文计算向量，并处理删除记录')
     args = parser.parse_args()
+
+    # 单命令数据并行导入：协调器负责启动、监控和重启工作进程
+    if args.dp_workers > 0:
+        success = run_data_parallel_ingest(
+            data_dir=args.data_dir,
+            num_workers=args.dp_workers,
+            gpu_count=args.gpu_count,
+            reset_db=args.reset,
+            manifest_path=args.manifest,
+            chunk_size=args.chunk_size,
+            embed_batch_size=args.embed_batch_size,
+            max_restarts=args.max_restarts,
+            embedding_cache_dir=args.embedding_cache,
+            max_tokens=args.max_tokens,
+            max_batch_tokens=args.max_batch_tokens,
+            stand_in_embedder=args.stand_in_embedder,
+            year_partition_span=args.year_partition_span,
+            max_retries=args.max_retries,
+            retry_backoff=args.retry_backoff,
+            dead_letter_path=args.dead_letter
+        )
+        exit(0 if success else 1)
     
+    # 应用每日增量文件：新增/修改按需计算向量，删除记录按ID或条件删除
+    if args.apply_delta:
+        if args.embedding_server:
+            embedding = RemoteEmbedding(args.embedding_server)
+        elif args.stand_in_embedder:
+            embedding = HashingEmbedding()
+        else:
+            from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
+            embedding = VLLMQwenEmbedding(tensor_parallel_size=4, max_tokens=args.max_tokens,
+                                          max_batch_tokens=args.max_batch_tokens)
+        if args.embedding_cache:
+            embedding = CachedEmbedding(embedding, EmbeddingCache(args.embedding_cache, embedding.model_name, embedding.embedding_dim,
+                                                                  max_tokens=getattr(embedding, "max_tokens", None)))
+        if args.year_partition_span > 0:
+            database = YearPartitionedDatabase("papers0520", dim=embedding.embedding_dim, span=args.year_partition_span)
+        else:
+            database = ChromaDatabase(collection_name="papers0520", dim=embedding.embedding_dim)
+        manifest = None
+        if not args.no_manifest:
+            manifest = IngestManifest(args.manifest or os.path.join(CHROMA_PERSIST_DIRECTORY, "delta_manifest_papers0520.json"))
+        normalizer = ChunkNormalizer(workers=args.normalize_workers)
+        retriever = SimpleRetriever(embedding, database, batch_retry=make_batch_retry(
+            "papers0520", args.max_retries, args.retry_backoff, args.dead_letter))
+        success = apply_delta_files(args.apply_delta, retriever, normalize=normalizer,
+                                    manifest=manifest, chunk_size=args.chunk_size, batch_size=args.embed_batch_size)
+        normalizer.close()
+        exit(0 if success else 1)
+
+    # 从已有集合构建作者索引与过滤统计
+    if args.build_author_index:
+        import chromadb
+
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        collection = client.get_collection(name=args.build_author_index)
+        AuthorIndex(author_index_path(args.build_author_index)).rebuild(collection)
+        FilterStats(filter_stats_path(args.build_author_index)).rebuild(collection)
+        exit(0)
+
+    # 从集合向量增量构建二值量化索引
+    if args.build_binary_index:
+        import chromadb
+
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        collection = client.get_collection(name=args.build_binary_index)
+        path = binary_index_path(args.build_binary_index)
+        if BinaryIndex.exists(path):
+            index = BinaryIndex(path)
+        else:
+            sample = collection.get(limit=1, include=["embeddings"])
+            if not sample["ids"]:
+                print(f"⚠️ 集合 {args.build_binary_index} 为空")
+                exit(1)
+            index = BinaryIndex(path, dim=len(sample["embeddings"][0]))
+        index.sync(collection, batch_size=args.merge_batch_size)
+        exit(0)
+
+    # IVF-PQ 索引：在主集合上训练构建，或测试各 nprobe 的召回率与延迟
+    if args.build_ivfpq or args.evaluate_ivfpq:
+        import chromadb
+        from docagent.retrieval.database.ivfpq_index import IVFPQIndex, build_ivfpq_index, evaluate_ivfpq
+
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        collection = client.get_collection(name="papers0520")
+        nprobes = [int(n) for n in args.nprobes.split(',') if n.strip()]
+        if args.build_ivfpq:
+            index = build_ivfpq_index(collection, args.build_ivfpq, nlist=args.ivf_nlist, m=args.pq_m,
+                                      sample_size=args.ivf_sample_size, batch_size=args.merge_batch_size)
+        else:
+            index = IVFPQIndex(args.evaluate_ivfpq)
+        evaluate_ivfpq(index, collection, nprobes=nprobes, batch_size=args.merge_batch_size,
+                       rerank_factor=args.ivfpq_rerank_factor)
+        exit(0)
+
+    # 将主集合导出为 NumPy 向量库
+    if args.export_numpy:
+        import chromadb
+        from docagent.retrieval.database.numpy_database import export_collection
+
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        export_collection(client.get_collection(name="papers0520"), args.export_numpy, dtype=args.numpy_dtype,
+                          batch_size=args.merge_batch_size)
+        exit(0)
+
+    # 两阶段检索的低维索引：构建/补齐，或测试各维度的召回率与延迟
+    if args.build_reduced_index or args.benchmark_reduced:
+        from docagent.retrieval.database.numpy_database import NumpyVectorDatabase
+        from docagent.retrieval.database.reduced_index import ReducedIndex, benchmark_reduced_dims
+
+        dims = [int(d) for d in args.reduced_dims.split(',') if d.strip()]
+        database = NumpyVectorDatabase(args.build_reduced_index or args.benchmark_reduced)
+        if args.benchmark_reduced:
+            benchmark_reduced_dims(database, dims, method=args.reduced_method, rerank_factor=args.rerank_factor)
+        else:
+            for dim in dims:
+                ReducedIndex(database, dim, method=args.reduced_method).build()
+        exit(0)
+
+    # 将旧结构集合改写为精简元数据结构
+    if args.migrate_slim:
+        import chromadb
+        from docagent.retrieval.database.slim_schema import migrate_collection
+
+        client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+        report = migrate_collection(
+            client,
+            source_name=args.migrate_slim,
+            persist_directory=CHROMA_PERSIST_DIRECTORY,
+            batch_size=args.merge_batch_size,
+            swap=args.swap,
+            delete_source=args.delete_legacy
+        )
+        exit(0 if report is not None else 1)
+
     # 处理数据合并请求
     if args.merge and args.dp_size > 1:
         try:
             import chromadb
-            import time
-            
-            # 生成唯一的合并操作ID（使用时间戳）
-            merge_id = int(time.time())
-            
+            from docagent.retrieval.database.chroma_merge import merge_collections
+
             print("🔄 开始合并集合...")
-            print(f"🆔 本次合并操作ID: {merge_id}")
-            client = chromadb.PersistentClient(path="/home/dataset-assist-0/data/chromadb")
-            print(f"📂 使用数据库路径: /home/dataset-assist-0/data/chromadb")
-            
-            # 列出所有现有集合进行检查
-            existing_collections = client.list_collections()
-            print(f"📋 现有集合列表:")
-            for coll in existing_collections:
-                print(f"  - {coll.name} (ID: {coll.id})")
-            
-            # 检查并获取主集合 - 不使用自定义嵌入函数，保持与源集合一致
+            client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
+            print(f"📂 使用数据库路径: {CHROMA_PERSIST_DIRECTORY}")
+
             main_collection_name = "papers0520"
-            try:
+            success = merge_collections(
+                client,
+                source_names=[f"papers0520_dp{dp_rank}" for dp_rank in range(args.dp_size)],
+                dest_name=main_collection_name,
+                checkpoint_path=os.path.join(CHROMA_PERSIST_DIRECTORY, f"merge_checkpoint_{main_collection_name}.json"),
+                batch_size=args.merge_batch_size
+            )
+            if success:
+                # 合并后部分文档ID带有源集合前缀，按主集合重新构建作者索引与过滤统计
                 main_collection = client.get_collection(name=main_collection_name)
-                original_count = main_collection.count()
-                print(f"📊 主集合 {main_collection_name} 中已有 {original_count} 条记录")
-            except:
-                main_collection = client.create_collection(name=main_collection_name)
-                original_count = 0
-                print(f"✅ 已创建主集合 {main_collection_name}")
-            
-            # 记录总合并文档数
-            total_merged_docs = 0
-            
-            # 合并所有数据并行集合的数据
-            for dp_rank in range(args.dp_size):
-                src_collection_name = f"papers0520_dp{dp_rank}"
-                try:
-                    # 不指定嵌入函数，使用集合原有的嵌入函数
-                    src_collection = client.get_collection(name=src_collection_name)
-                    doc_count = src_collection.count()
-                    if doc_count == 0:
-                        print(f"⚠️ 集合 {src_collection_name} 为空，跳过")
-                        continue
-                        
-                    print(f"📤 从集合 {src_collection_name} 导出 {doc_count} 条记录...")
-                    
-                    # 分批获取并导入数据
-                    batch_size = 1000
-                    for i in range(0, doc_count, batch_size):
-                        # 获取当前批次的文档和嵌入
-                        results = src_collection.get(
-                            limit=batch_size,
-                            offset=i,
-                            include=["documents", "embeddings", "metadatas"]
-                        )
-                        
-                        if not results["ids"]:
-                            continue
-                            
-                        # 修改ID，添加合并ID和来源前缀，确保多次合并也不会重复
-                        modified_ids = [f"merge{merge_id}_dp{dp_rank}_{id}" for id in results["ids"]]
-                        
-                        # 添加到主集合
-                        main_collection.add(
-                            ids=modified_ids,
-                            embeddings=results["embeddings"],
-                            documents=results["documents"],
-                            metadatas=results["metadatas"]
-                        )
-                        
-                        # 更新合并计数
-                        batch_count = len(modified_ids)
-                        total_merged_docs += batch_count
-                        
-                        print(f"✅ 已处理 {min(i+batch_size, doc_count)}/{doc_count} 条记录")
-                    
-                    print(f"✅ 已完成集合 {src_collection_name} 的合并")
-                except Exception as e:
-                    print(f"❌ 合并集合 {src_collection_name} 失败: {str(e)}")
-            
-            final_count = main_collection.count()
-            print(f"📊 合并前主集合中有 {original_count} 条记录")
-            print(f"📊 合并后主集合 {main_collection_name} 中有 {final_count} 条记录")
-            print(f"📈 本次合并添加了 {final_count - original_count} 条记录")
-            print(f"📈 理论上应添加 {total_merged_docs} 条记录")
-            print("✅ 集合合并完成")
-            
-            # 删除源集合
-            print("🗑️ 开始删除源集合...")
-            for dp_rank in range(args.dp_size):
-                src_collection_name = f"papers0520_dp{dp_rank}"
-                try:
-                    client.delete_collection(src_collection_name)
-                    print(f"✅ 已删除源集合 {src_collection_name}")
-                except Exception as e:
-                    print(f"⚠️ 删除集合 {src_collection_name} 失败: {str(e)}")
-            
-            print("✅ 所有操作完成")
-            exit(0)
+                AuthorIndex(author_index_path(main_collection_name)).rebuild(main_collection)
+                FilterStats(filter_stats_path(main_collection_name)).rebuild(main_collection)
+                if BinaryIndex.exists(binary_index_path(main_collection_name)):
+                    BinaryIndex(binary_index_path(main_collection_name)).sync(main_collection)
+            print("✅ 所有操作完成" if success else "⚠️ 合并未完成，重新运行 --merge 将从中断处继续")
+            exit(0 if success else 1)
         except Exception as e:
             print(f"❌ 合并集合失败: {str(e)}")
             import traceback
@@ -791,8 +1072,31 @@ if __name__ == "__main__":
         reset_db=args.reset, 
         gpu_count=args.gpu_count // args.dp_size if args.dp_size > 1 else args.gpu_count,
         data_parallel_rank=args.dp_rank,
-        data_parallel_size=args.dp_size
+        data_parallel_size=args.dp_size,
+        stream=args.stream,
+        chunk_size=args.chunk_size,
+        report_memory=args.report_memory,
+        pipeline=args.pipeline,
+        queue_size=args.queue_size,
+        normalize_workers=args.normalize_workers,
+        manifest_path=args.manifest,
+        use_manifest=not args.no_manifest,
+        embedding_cache_dir=args.embedding_cache,
+        embed_batch_size=args.embed_batch_size,
+        max_tokens=args.max_tokens,
+        max_batch_tokens=args.max_batch_tokens,
+        embedding_server=args.embedding_server,
+        year_partition_span=args.year_partition_span,
+        watch=args.watch,
+        max_latency=args.max_latency,
+        poll_interval=args.poll_interval,
+        max_retries=args.max_retries,
+        retry_backoff=args.retry_backoff,
+        dead_letter_path=args.dead_letter
     )
+    if args.watch:
+        exit(0 if retriever is not None else 1)
     
     # 启动界面
+    interface = build_interface()
     interface.launch(server_port=args.port, share=not args.no_share)
\ No newline at end of file
@@ -7,7 +7,14 @@ import chromadb
 from chromadb.config import Settings
 from docagent.retrieval.embedding.gemini_embedding import VLLMQwenEmbedding
 from docagent.retrieval.database.milvus_database import ChromaDatabase
+from docagent.retrieval.database.numpy_database import NumpyVectorDatabase
+from docagent.retrieval.database.sharded_database import ShardedDatabase, open_shards
+from docagent.retrieval.database.year_partition import YearPartitionedDatabase
 from docagent.retrieval.retriever.simple_retriever import SimpleRetriever
+from docagent.retrieval.embedding.cache import EmbeddingCache, QueryEmbeddingCache
+from docagent.retrieval.embedding.batching import BatchingEmbedding
+from docagent.retrieval.embedding.remote_embedding import RemoteEmbedding
+from docagent.retrieval.retriever.result_cache import SearchResultCache
 
 # Define the core JS logic as a string (to be embedded in onclick)
 # Note: This string itself should not contain the outer function definition or call parenthesis.
@@ -63,8 +70,8 @@ js_onclick_logic = r"""
 """
 
 # 构建过滤表达式函数
-def build_filters(journal=None, min_year=None, max_year=None, author=None):
-    """构建适用于 ChromaDB 的过滤表达式 (where document)"""
+def build_filters(journal=None, min_year=None, max_year=None):
+    """构建适用于 ChromaDB 的过滤表达式 (where document)，作者条件由作者索引处理，不在此生成"""
     # 注意：这个函数现在返回 ChromaDB 的 where dict，而不是字符串
     db_conditions = [] # 使用列表存储 AND 条件
 
@@ -90,25 +97,6 @@ def build_filters(journal=None, min_year=None, max_year=None, author=None):
     elif len(time_conditions) == 1:
         db_conditions.append(time_conditions[0])
 
-    # Author Filter ($or across author1..authorN)
-    if author and author.strip():
-        # 假设作者输入是单个姓名或逗号分隔的多个姓名
-        # 这里我们处理单个作者精确匹配的情况，与milvus_database.py中的解析逻辑类似
-        # 如果需要支持UI输入多个作者并进行OR/AND组合，逻辑会更复杂
-        # 当前简化为：如果输入了作者名，则在 author1 到 author50 中查找完全匹配项
-        author_name_to_match = author.strip() # 直接使用输入框的值
-        author_or_conditions = []
-        # 从 milvus_database.py 导入或重新定义 MAX_AUTHORS_PER_PAPER
-        # 为简单起见，直接在这里用字面量 50
-        MAX_AUTHORS_PER_PAPER = 50
-        for i in range(1, MAX_AUTHORS_PER_PAPER + 1):
-            author_or_conditions.append({f"author{i}": {"$eq": author_name_to_match}})
-
-        if author_or_conditions:
-             # 只需要一个 $or 条件来包含所有 authorN 字段的检查
-            db_conditions.append({"$or": author_or_conditions})
-        # 注意：之前的 LIKE "%term%" 逻辑已被移除，替换为精确匹配 $eq
-
     # Combine all conditions with $and if multiple exist
     if len(db_conditions) > 1:
         final_where = {"$and": db_conditions}
@@ -121,40 +109,111 @@ def build_filters(journal=None, min_year=None, max_year=None, author=None):
     return final_where
 
 # 系统初始化函数 - 直接连接到特定集合
-def initialize_system():
-    """系统初始化函数，直接连接到papers0520集合"""
+def initialize_system(query_cache_size=1024, query_cache_dir=None, result_cache_size=256, batch_window_ms=5,
+                      max_query_batch=32, embedding_server=None, numpy_store=None, reduced_dim=None,
+                      reduced_method="pca", rerank_factor=10, binary_index=False, ivfpq_index=None, nprobe=16,
+                      ivfpq_rerank_factor=1, shards=None, year_partitions=False):
+    """系统初始化函数，直接连接到papers0520集合
+
+    Args:
+        query_cache_size (int): 内存中缓存的查询向量数，为 0 时不缓存。
+        query_cache_dir (str): 查询向量磁盘缓存目录，重启后仍可命中；为 None 时只使用内存缓存。
+        result_cache_size (int): 缓存的检索结果数，为 0 时不缓存；集合文档数变化时自动失效。
+        batch_window_ms (float): 并发查询合并为一次嵌入调用的等待窗口（毫秒），为 0 时不合并。
+        max_query_batch (int): 每次嵌入调用最多合并的查询数。
+        embedding_server (str): 常驻嵌入服务地址，设置后不在本进程加载模型（请求由服务端合并）。
+        numpy_store (str): NumPy 内存映射向量库目录，设置后使用该后端代替 ChromaDB（精确检索）。
+        reduced_dim (int): 使用 NumPy 向量库时启用两阶段检索的低维维度，为 None 时精确检索。
+        reduced_method (str): 降维方法，"pca" 或 "truncate"。
+        rerank_factor (int): 两阶段检索精排的候选数相对 top_k 的倍数。
+        binary_index (bool): 使用 ChromaDB 时改用二值量化索引 Hamming 初筛 + 原始向量精排（精排倍数同 rerank_factor）。
+        ivfpq_index (str): IVF-PQ 索引目录（main-数据处理.py --build-ivfpq 构建），设置后使用该索引检索。
+        nprobe (int): IVF-PQ 检索扫描的倒排表数，越大召回率越高、延迟越大。
+        ivfpq_rerank_factor (int): 大于 1 时读取 n_results 倍数的候选原始向量精确重排。
+        shards (list): 分片集合或分片目录（如 papers0520_dp0、/data/shard0:papers0520），设置后并行检索各分片并合并结果，
+            不再需要把数据并行导入的集合合并为一个集合。
+        year_partitions (bool): 使用按年份分区的集合（main-数据处理.py --year-partition-span 导入，包括数据并行导入时
+            各进程写入的 papers0520_dp<序号>_y<年份> 分区），按查询的年份范围只检索重叠的分区。
+    """
     try:
         start_time = time.time()
         
         # 初始化嵌入模型
-        tensor_parallel_size = 1
-        print(f"⏳ 初始化嵌入模型 (tensor_parallel_size={tensor_parallel_size})...")
-        embedding = VLLMQwenEmbedding(tensor_parallel_size=tensor_parallel_size)
-        print("✅ 嵌入模型初始化完成")
-
-        # 设置ChromaDB连接方式
-        db_path = "/home/dataset-assist-0/data/chromadb/"
-        print(f"💾 连接到数据库: {db_path}")
-        chroma_client = chromadb.PersistentClient(
-            path=db_path,
-            settings=Settings(anonymized_telemetry=False)
-        )
-        
-        # 获取集合
-        collection_name = "papers0520"
-        print(f"📄 使用集合: {collection_name}")
-        collection = chroma_client.get_collection(name=collection_name)
-        
-        # 创建数据库对象
-        database = ChromaDatabase(collection_name=collection_name, dim=embedding.embedding_dim)
-        # 替换默认客户端
-        database.client = chroma_client
-        database.collection = collection
-        
-        doc_count = collection.count()
-        print(f"📊 集合 {collection_name} 中包含 {doc_count} 篇论文")
+        if embedding_server:
+            # 连接已加载模型的嵌入服务，启动只需几秒
+            embedding = RemoteEmbedding(embedding_server)
+        else:
+            tensor_parallel_size = 1
+            print(f"⏳ 初始化嵌入模型 (tensor_parallel_size={tensor_parallel_size})...")
+            embedding = VLLMQwenEmbedding(tensor_parallel_size=tensor_parallel_size)
+            print("✅ 嵌入模型初始化完成")
+        if batch_window_ms > 0 and not embedding_server:
+            # 并发请求由调度线程合并后统一调用模型
+            embedding = BatchingEmbedding(embedding, max_batch_size=max_query_batch, max_wait_ms=batch_window_ms)
+            print(f"✅ 查询微批调度已启用 (窗口 {batch_window_ms} ms, 每批最多 {max_query_batch} 条)")
+
+        if numpy_store:
+            # NumPy 内存映射向量库（由 main-数据处理.py --export-numpy 从集合导出）
+            print(f"💾 使用 NumPy 向量库: {numpy_store}")
+            database = NumpyVectorDatabase(numpy_store, dim=embedding.embedding_dim)
+            if reduced_dim:
+                database.enable_two_stage(reduced_dim, method=reduced_method, rerank_factor=rerank_factor)
+        elif shards or year_partitions:
+            # 并行检索各分片（或与年份范围重叠的分区），按距离归并各分片的 top_k
+            if year_partitions:
+                database = YearPartitionedDatabase("papers0520", dim=embedding.embedding_dim, data_parallel=True)
+            else:
+                database = ShardedDatabase(open_shards(shards, embedding.embedding_dim))
+            if binary_index:
+                for shard in database.shards:
+                    shard.enable_binary_index(rerank_factor=rerank_factor, sync=False)
+            if ivfpq_index:
+                print("⚠️ IVF-PQ 索引按单个集合构建，分片模式下忽略 --ivfpq-index")
+        else:
+            # 设置ChromaDB连接方式
+            db_path = "/home/dataset-assist-0/data/chromadb/"
+            print(f"💾 连接到数据库: {db_path}")
+            chroma_client = chromadb.PersistentClient(
+                path=db_path,
+                settings=Settings(anonymized_telemetry=False)
+            )
+
+            # 获取集合
+            collection_name = "papers0520"
+            print(f"📄 使用集合: {collection_name}")
+            collection = chroma_client.get_collection(name=collection_name)
+
+            # 创建数据库对象
+            database = ChromaDatabase(collection_name=collection_name, dim=embedding.embedding_dim)
+            # 替换默认客户端
+            database.client = chroma_client
+            database.collection = collection
+
+            doc_count = collection.count()
+            print(f"📊 集合 {collection_name} 中包含 {doc_count} 篇论文")
+            if binary_index:
+                # 二值索引由 main-数据处理.py --build-binary-index 构建；不存在或与集合不一致时在此构建/补齐
+                database.enable_binary_index(rerank_factor=rerank_factor, sync=False)
+            if ivfpq_index:
+                database.enable_ivfpq(ivfpq_index, nprobe=nprobe, rerank_factor=ivfpq_rerank_factor)
         
-        retriever = SimpleRetriever(embedding, database)
+        # 查询向量缓存：相同查询只调用一次嵌入模型
+        query_cache = None
+        if query_cache_size > 0:
+            disk_cache = None
+            if query_cache_dir:
+                disk_cache = EmbeddingCache(query_cache_dir, embedding.model_name, embedding.embedding_dim,
+                                            max_tokens=getattr(embedding, "max_tokens", None))
+            query_cache = QueryEmbeddingCache(max_entries=query_cache_size, disk_cache=disk_cache)
+            print(f"✅ 查询向量缓存已启用 (内存 {query_cache_size} 条, 磁盘: {query_cache_dir or '无'})")
+
+        # 检索结果缓存：按集合版本失效，并合并并发的相同请求
+        result_cache = None
+        if result_cache_size > 0:
+            result_cache = SearchResultCache(max_entries=result_cache_size, version_fn=database.version)
+            print(f"✅ 检索结果缓存已启用 (最多 {result_cache_size} 条)")
+
+        retriever = SimpleRetriever(embedding, database, query_cache=query_cache, result_cache=result_cache)
         print("✅ 数据库和检索器初始化完成")
         
         end_time = time.time()
@@ -197,26 +256,25 @@ def search_papers(query_title, query_abstract, top_k=5, journal=None, min_year=N
         query_parts.append(f"Abstract: {query_abstract}")
 
     query_text = "\n".join(query_parts)
-    # If only author is present, query_text will be empty.
-    # Pass the author name as query_text if title/abstract are empty
-    # to satisfy retriever's need for non-empty text for embedding.
-    if not query_text and author_present:
-        query_text = author
-    # Handle the case where all inputs are empty (though validation should prevent this)
-    if not query_text:
-        # Provide a default or generic query string if absolutely necessary
-        # Or rely on the retriever to handle this case if it can.
-        # For now, we might let it proceed and potentially fail at the retriever if it requires text.
-        # Alternatively, return an error earlier if query_text is mandatory for the retriever.
-        print("Warning: query_text is empty after processing inputs. Proceeding...")
-        # query_text = "general search" # Example placeholder if needed
 
     # Restore filter building and retrieval logic
-    where_document = build_filters(journal, min_year, max_year, author)
+    where_document = build_filters(journal, min_year, max_year)
     try:
-        print(f"[Debug Full Inputs] Calling retriever.retrieve with query_text='{query_text}', top_k={top_k}, where_document={where_document}")
-        # Ensure retriever is accessible (assuming it's initialized globally)
-        results = retriever.retrieve(query_text=query_text, top_k=top_k, filter_expression=where_document)
+        if not query_text:
+            # 只输入了作者：直接查询作者索引，不需要生成嵌入
+            print(f"[Debug Full Inputs] Calling retriever.search_by_author with author='{author}', top_k={top_k}, where_document={where_document}")
+            results = retriever.search_by_author(author.strip(), top_k=top_k, filter_expression=where_document)
+        else:
+            print(f"[Debug Full Inputs] Calling retriever.retrieve with query_text='{query_text}', top_k={top_k}, where_document={where_document}, author='{author}'")
+            # Ensure retriever is accessible (assuming it's initialized globally)
+            results = retriever.retrieve(query_text=query_text, top_k=top_k, filter_expression=where_document,
+                                         author=author.strip() if author_present else None)
+            if retriever.query_cache is not None:
+                print(f"[Debug] 查询向量缓存: {retriever.query_cache.stats()}")
+            if isinstance(retriever.embedder, BatchingEmbedding):
+                print(f"[Debug] 查询微批调度: {retriever.embedder.stats()}")
+        if retriever.result_cache is not None:
+            print(f"[Debug] 检索结果缓存: {retriever.result_cache.stats()}")
     except Exception as e:
         print(f"❌ Retriever Error: {e}")
         import traceback
@@ -312,18 +370,18 @@ def analyze_authors_publications(keyword1, keyword2, keyword3, keyword4, keyword
         # else:
         #     filter_expr = 'venue != "nature"'
             
-        # 对每个关键词进行检索
-        for keyword in keywords:
-            try:
-                results = retriever.retrieve(query_text=keyword, top_k=200, filter_expression=filter_expr)
-                # 存储完整的论文信息
-                for paper in results:
-                    title = paper['entity']['title']
-                    if title not in papers_dict:  # 避免重复添加
-                        papers_dict[title] = paper['entity']
-            except Exception as e:
-                print(f"检索关键词 '{keyword}' 时出错: {str(e)}")
-                continue
+        # 所有关键词一次批量检索（一次嵌入调用、一次数据库查询）
+        try:
+            results_per_keyword = retriever.retrieve_many(keywords, top_k=200, filter_expression=filter_expr)
+        except Exception as e:
+            print(f"批量检索关键词 {keywords} 时出错: {str(e)}")
+            results_per_keyword = []
+        for results in results_per_keyword:
+            # 存储完整的论文信息
+            for paper in results:
+                title = paper['entity']['title']
+                if title not in papers_dict:  # 避免重复添加
+                    papers_dict[title] = paper['entity']
                 
         if not papers_dict:
             return "<div class='output-container'><div style='text-align:center;color:var(--text-color);'>🔍 未找到相关论文</div></div>"
@@ -703,11 +761,35 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="AI4s学术论文智能检索平台")
     parser.add_argument('--port', type=int, default=8081, help='服务端口号')
     parser.add_argument('--no-share', action='store_true', help='不创建公共链接')
+    parser.add_argument('--query-cache-size', type=int, default=1024, help='内存中缓存的查询向量数(0表示不缓存)')
+    parser.add_argument('--query-cache-dir', type=str, default=None, help='查询向量磁盘缓存目录(重启后仍可命中)')
+    parser.add_argument('--result-cache-size', type=int, default=256, help='缓存的检索结果数(0表示不缓存)')
+    parser.add_argument('--batch-window-ms', type=float, default=5, help='并发查询合并为一次嵌入调用的等待窗口(毫秒，0表示不合并)')
+    parser.add_argument('--max-query-batch', type=int, default=32, help='每次嵌入调用最多合并的查询数')
+    parser.add_argument('--embedding-server', type=str, default=None, help='常驻嵌入服务地址(如 http://127.0.0.1:8765)，设置后不在本进程加载模型')
+    parser.add_argument('--numpy-store', type=str, default=None, help='使用NumPy内存映射向量库目录代替ChromaDB')
+    parser.add_argument('--reduced-dim', type=int, default=None, help='NumPy向量库启用两阶段检索的低维维度(先用 main-数据处理.py --benchmark-reduced 选择)')
+    parser.add_argument('--reduced-method', type=str, default='pca', choices=['pca', 'truncate'], help='降维方法(PCA或Matryoshka式截断)')
+    parser.add_argument('--rerank-factor', type=int, default=10, help='两阶段检索精排的候选数相对Top K的倍数')
+    parser.add_argument('--binary-index', action='store_true', help='使用二值量化索引Hamming初筛+原始向量精排代替HNSW检索')
+    parser.add_argument('--ivfpq-index', type=str, default=None, help='使用IVF-PQ索引目录检索(由 main-数据处理.py --build-ivfpq 构建)')
+    parser.add_argument('--year-partitions', action='store_true', help='使用按年份分区的集合(papers0520_y<年份>，含数据并行导入的 papers0520_dp<序号>_y<年份>)，按年份条件只检索重叠的分区')
+    parser.add_argument('--shards', type=str, default=None, help='逗号分隔的分片集合或分片目录(如 papers0520_dp0,papers0520_dp1 或 /data/shard0:papers0520)，并行检索后合并结果')
+    parser.add_argument('--nprobe', type=int, default=16, help='IVF-PQ检索扫描的倒排表数')
+    parser.add_argument('--ivfpq-rerank-factor', type=int, default=1, help='IVF-PQ候选数相对Top K的倍数，大于1时读取原始向量精确重排')
     args = parser.parse_args()
     
     # 系统初始化
     print(f"🚀 系统启动 - 端口: {args.port}")
-    retriever = initialize_system()
+    retriever = initialize_system(query_cache_size=args.query_cache_size, query_cache_dir=args.query_cache_dir,
+                                  result_cache_size=args.result_cache_size, batch_window_ms=args.batch_window_ms,
+                                  max_query_batch=args.max_query_batch, embedding_server=args.embedding_server,
+                                  numpy_store=args.numpy_store, reduced_dim=args.reduced_dim,
+                                  reduced_method=args.reduced_method, rerank_factor=args.rerank_factor,
+                                  binary_index=args.binary_index, ivfpq_index=args.ivfpq_index, nprobe=args.nprobe,
+                                  ivfpq_rerank_factor=args.ivfpq_rerank_factor,
+                                  shards=[s for s in args.shards.split(',') if s.strip()] if args.shards else None,
+                                  year_partitions=args.year_partitions)
     
     # 启动界面
     interface.launch(server_port=args.port, share=not args.no_share)
\ No newline at end of file